@@ -0,0 +1,126 @@
+"""
+セッションの受け入れ制御
+
+コンテナが受け入れるセッション数に上限が無いと、負荷が高いときに全セッションの音声が
+まとめて遅れる。AdmissionController は次のどちらかに達したら新しい接続を受け入れず、
+/ping で HealthyBusy を返して AgentCore Runtime に別の場所へ振り分けてもらう。
+
+- 同時セッション数
+    BIDI_MAX_SESSIONS             コンテナ全体(全ワーカーの合計, workers.py)
+    BIDI_MAX_SESSIONS_PER_WORKER  ワーカーごと
+- イベントループの遅延
+    BIDI_MAX_LOOP_LAG_MS          tool_executor.py の監視が測る遅延。1回のスパイクで
+                                  振れすぎないよう、減衰させた最大値と比べる
+
+いずれも 0 なら制限しない。受け入れない接続は、エージェントを取り出す前に
+close code 1013(Try Again Later)と理由("server busy: sessions" 等)で閉じる。
+
+同時セッション数と遅延は telemetry の bidi.server.sessions / bidi.loop.current_lag(ゲージ)、
+拒否した接続は bidi.admission.rejected(属性 reason)で記録する。
+"""
+import contextlib
+import os
+from collections import Counter
+
+from bedrock_agentcore.runtime.models import PingStatus
+
+import telemetry
+import workers
+
+# 同時セッション数の上限(コンテナ全体。0 なら上限なし)
+MAX_SESSIONS = int(os.environ.get("BIDI_MAX_SESSIONS", "0"))
+
+# イベントループの遅延の上限(ms。0 なら見ない)
+MAX_LOOP_LAG_MS = float(os.environ.get("BIDI_MAX_LOOP_LAG_MS", "0"))
+
+# 受け入れない接続の close code(RFC 6455 Try Again Later)
+REJECT_CLOSE_CODE = 1013
+
+# 遅延の測定1回ごとの減衰率(監視間隔 100ms で約0.5秒かけて下がる)
+_LAG_DECAY = 0.7
+
+
+class AdmissionController:
+    """このワーカーのセッション数とイベントループの遅延から、受け入れの可否を決める
+
+    Args:
+        max_sessions: 同時セッション数の上限(全ワーカーの合計)
+        max_sessions_per_worker: ワーカーごとの同時セッション数の上限
+        max_loop_lag_ms: イベントループの遅延の上限(ms)
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = MAX_SESSIONS,
+        max_sessions_per_worker: int = workers.MAX_SESSIONS_PER_WORKER,
+        max_loop_lag_ms: float = MAX_LOOP_LAG_MS,
+    ):
+        self.max_sessions = max_sessions
+        self.max_sessions_per_worker = max_sessions_per_worker
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.active = 0
+        self.loop_lag_ms = 0.0
+        self.rejected = Counter()
+
+    @property
+    def total_sessions(self) -> int:
+        """全ワーカーの同時セッション数"""
+        return workers.total_sessions(self.active)
+
+    def busy_reason(self) -> str | None:
+        """新しいセッションを受け入れられない理由(受け入れられるなら None)"""
+        if self.max_sessions_per_worker and self.active >= self.max_sessions_per_worker:
+            return "worker sessions"
+        if self.max_sessions and self.total_sessions >= self.max_sessions:
+            return "sessions"
+        if self.max_loop_lag_ms and self.loop_lag_ms >= self.max_loop_lag_ms:
+            return "loop lag"
+        return None
+
+    def ping_status(self) -> PingStatus:
+        """/ping の応答(app.ping に登録する)
+
+        ワーカーごとの上限は、全ワーカーが上限に達したときだけ HealthyBusy にする
+        (/ping を受けたワーカーだけが埋まっていても、他のワーカーは受け入れられる)。
+        """
+        reason = self.busy_reason()
+        if reason == "worker sessions":
+            full = self.total_sessions >= self.max_sessions_per_worker * workers.worker_slots()
+            if not full:
+                reason = None
+        return PingStatus.HEALTHY_BUSY if reason else PingStatus.HEALTHY
+
+    def reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        telemetry.record_admission_rejected(reason)
+        print(f"[Admission] Rejected ({reason}): {self.active} sessions on this worker, "
+              f"{self.total_sessions} in total, loop lag {self.loop_lag_ms:.0f} ms")
+
+    @contextlib.contextmanager
+    def session(self):
+        """受け入れたセッションの実行中、同時セッション数に数える"""
+        self._set_active(self.active + 1)
+        try:
+            yield
+        finally:
+            self._set_active(self.active - 1)
+
+    def record_loop_lag(self, lag_ms: float) -> None:
+        """イベントループの遅延の測定値(tool_executor.monitor から呼ばれる)"""
+        self.loop_lag_ms = max(lag_ms, self.loop_lag_ms * _LAG_DECAY)
+
+    def register_metrics(self) -> None:
+        """セッション数と遅延のゲージを登録する"""
+        telemetry.observe_server(lambda: self.active, lambda: self.loop_lag_ms, workers.worker_index())
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "total": self.total_sessions,
+            "loop_lag_ms": round(self.loop_lag_ms),
+            "rejected": dict(self.rejected),
+        }
+
+    def _set_active(self, count: int) -> None:
+        self.active = count
+        workers.report_sessions(count)
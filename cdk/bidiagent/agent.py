@@ -4,20 +4,105 @@ BidiAgent on AWS - WebSocket Voice Agent Server
 BedrockAgentCoreApp + BidiAgent + Nova Sonic を使用した
 WebSocket経由の双方向音声ストリーミングエージェント
 """
+import asyncio
+import contextlib
 import os
+import sys
+import uuid
+from types import SimpleNamespace
+
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
 from strands.experimental.bidi.agent import BidiAgent
-from strands.experimental.bidi.models.nova_sonic import BidiNovaSonicModel
 from strands.experimental.bidi.tools import stop_conversation
 
 from strands_tools import http_request, calculator
 
-model_id = "amazon.nova-2-sonic-v1:0"
+import framing
+import mux
+import resume
+from admission import REJECT_CLOSE_CODE, AdmissionController
+from agent_pool import AgentPool
+from bridge import WebSocketBridge
+from http_client import HttpClient
+from input_validation import InputValidator
+from models import BIDI_MODEL, create_model
+from mux_bridge import MuxConnection, MuxStreamSocket
+from output_channel import OutputChannel
+from recorder import SessionRecorder
+from resumable import ResumableSessions
+from session import run_session, start_agent
+from telemetry import SessionTelemetry
+from tool_executor import ToolExecutor
+from workers import serve, worker_count
+
+# 事前生成しておくエージェント数(0でプール無効)
+AGENT_POOL_SIZE = int(os.environ.get("BIDI_AGENT_POOL_SIZE", "2"))
+
+# WebSocketのacceptと並行してNova Sonicへの接続を開始する(0で無効: accept後に接続)
+EARLY_CONNECT = os.environ.get("BIDI_EARLY_CONNECT", "1") != "0"
+
+# セッションの送受信メッセージを記録するディレクトリ(未設定なら記録しない)
+RECORD_DIR = os.environ.get("BIDI_RECORD_DIR")
+
+
+# http_request が使う共有HTTPクライアント(接続プール・レスポンスキャッシュ)
+http_client = HttpClient()
+http_client.install(http_request)
+
+# ツールの実行先(専用のスレッドプール、ツールごとの同時実行数・タイムアウト)
+tool_executor = ToolExecutor()
+# 同期のツールは専用のスレッドで実行する。stop_conversation はループ上で実行する(遅延の監視対象)
+TOOLS = tool_executor.wrap([calculator, http_request]) + tool_executor.wrap([stop_conversation], offload=False)
+
+
+def create_agent() -> BidiAgent:
+    """1セッション分のモデルとエージェントを生成する"""
+    # Nova Sonic(BIDI_MODEL=fake でオフライン用のフェイクモデル)
+    model = create_model(voice="tiffany")
+
+    # BidiAgent の設定
+    # stop_conversation toolはユーザーが口頭でエージェントを停止できるようにする
+    return BidiAgent(
+        model=model,
+        tools=TOOLS,
+        system_prompt="You are a helpful assistant. Speak Japanese.",
+    )
+
+
+# 生成済みエージェントのプール(使い捨て・バックグラウンド補充)
+agent_pool = AgentPool(create_agent, size=AGENT_POOL_SIZE)
+
+# 同時セッション数・イベントループの遅延による受け入れ制御
+admission = AdmissionController()
+
+# 切断後も猶予時間のあいだ保持し、再接続で再開できるセッション
+resumable_sessions = ResumableSessions()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """サーバー起動時にプールの充填とイベントループの監視を開始し、終了時に破棄する"""
+    print(f"[Server] Worker started (pid {os.getpid()})")
+    agent_pool.start()
+    admission.register_metrics()
+    monitor_task = asyncio.create_task(tool_executor.monitor(on_lag=admission.record_loop_lag))
+    yield
+    monitor_task.cancel()
+    await agent_pool.close()
+    print(f"[Admission] Stats: {admission.stats()}")
+    print(f"[Resume] Stats: {resumable_sessions.stats()}")
+    print(f"[ToolExecutor] Stats: {tool_executor.stats()}")
+    tool_executor.shutdown()
+    print(f"[HttpClient] Cache stats: {http_client.stats()}")
+    http_client.close()
+
 
 # BedrockAgentCoreApp を使用
-app = BedrockAgentCoreApp()
+app = BedrockAgentCoreApp(lifespan=lifespan)
+# 上限に達している間は /ping で HealthyBusy を返す
+app.ping(admission.ping_status)
 
 @app.websocket
 async def websocket_handler(websocket: WebSocket, context):
@@ -33,50 +118,139 @@ async def websocket_handler(websocket: WebSocket, context):
         websocket: Starlette WebSocketオブジェクト
         context: RequestContext (session_id, request_headers等を含む)
     """
-    await websocket.accept()
-    print("[Server] WebSocket connected")
-    print(f"[Server] Context: {context}")
-
-    # Nova Sonic モデルの設定
-    # Note: Nova Sonicはus-east-1, us-west-2, ap-northeast-1等で利用可能
-    print("[Server] Creating model...")
-    model = BidiNovaSonicModel(
-        model_id=model_id,
-        provider_config={
-            "audio": {
-                "voice": "tiffany",  # 利用可能: "tiffany", "matthew", "ruth"
-            }
-        },
-    )
-    print("[Server] Model created")
+    if mux.SUBPROTOCOL_MUX in websocket.scope.get("subprotocols", []):
+        # 1接続で複数のセッションを扱う(受け入れ制御はストリームごと)
+        await _run_mux_connection(websocket, context)
+        return
 
-    # BidiAgent の設定
-    # stop_conversation toolはユーザーが口頭でエージェントを停止できるようにする
-    print("[Server] Creating agent...")
-    agent = BidiAgent(
-        model=model,
-        tools=[calculator, http_request, stop_conversation],
-        system_prompt="You are a helpful assistant. Speak Japanese.",
-    )
-    print("[Server] Agent created")
+    offer = resume.parse_offer(websocket.scope.get("subprotocols", [])) if resumable_sessions.enabled else None
+    if offer is not None and offer.token:
+        # 切断したセッションの再開(受け入れ制御は最初の接続で済んでいる)
+        await resumable_sessions.resume(websocket, offer)
+        return
+
+    if await _reject_if_busy(websocket):
+        return
+    with admission.session():
+        await _run_websocket_session(websocket, context, resumable=offer is not None)
+
+
+async def _reject_if_busy(websocket: WebSocket | MuxStreamSocket, accept: bool = True) -> bool:
+    """上限に達していれば、エージェントを取り出す前に close code 1013 で断る
+
+    WebSocket は accept 前に閉じると close code が伝わらない(HTTP 403 になる)ため、accept してから閉じる。
+    多重化接続のストリームは accept(mux_opened)せずに mux_closed を返す(accept=False)。
+    """
+    reason = admission.busy_reason()
+    if not reason:
+        return False
+    # クライアントは再接続で別のワーカー・コンテナに割り振られうる
+    admission.reject(reason)
+    if accept:
+        await websocket.accept()
+    await websocket.close(code=REJECT_CLOSE_CODE, reason=f"server busy: {reason}")
+    return True
+
+
+async def _run_mux_connection(websocket: WebSocket, context) -> None:
+    """多重化接続(mux.py): ストリームごとに通常の接続と同じセッションを実行する"""
+    session_id = getattr(context, "session_id", None)
+    await websocket.accept(subprotocol=mux.SUBPROTOCOL_MUX)
+    print(f"[Server] Multiplexed connection (session_id={session_id})")
+
+    async def run_stream(stream: MuxStreamSocket) -> None:
+        if await _reject_if_busy(stream, accept=False):
+            return
+        stream_context = SimpleNamespace(
+            session_id=f"{session_id or 'mux'}-{stream.stream}",
+            request_headers=getattr(context, "request_headers", None),
+        )
+        with admission.session():
+            await _run_websocket_session(stream, stream_context)
 
     try:
-        print("[Server] Starting agent.run()...")
-        # WebSocketのreceive_json/send_jsonを直接I/Oとして使用
-        await agent.run(
-            inputs=[websocket.receive_json],
-            outputs=[websocket.send_json],
+        await MuxConnection(websocket, run_stream).run()
+    finally:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+async def _run_websocket_session(websocket: WebSocket | MuxStreamSocket, context, resumable: bool = False) -> None:
+    """受け入れた接続(または多重化接続の1ストリーム)の1セッション
+
+    resumable=True の場合は、以降の接続の差し替えを ResumableSocket(resumable.py)が受け持つ。
+    """
+    session_id = getattr(context, "session_id", None)
+    telemetry = SessionTelemetry(session_id)
+    if resumable:
+        websocket = resumable_sessions.open(websocket, telemetry)
+    recorder = None
+    output = None
+    session_error = None
+
+    def on_agent_ready(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            telemetry.agent_ready()
+
+    # プールからエージェントを取り出す(空ならその場で生成)
+    agent = await agent_pool.acquire()
+
+    # モデル接続のハンドシェイクをacceptと並行して進める
+    start_task = asyncio.create_task(start_agent(agent)) if EARLY_CONNECT else None
+
+    try:
+        subprotocol = framing.choose_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        telemetry.accepted()
+        print(f"[Server] WebSocket connected (subprotocol: {subprotocol or 'none'}, resumable: {resumable})")
+        print(f"[Server] Context: {context}")
+        print(f"[Server] Agent ready (pool: {agent_pool.stats.as_dict()}, early connect: {EARLY_CONNECT})")
+
+        if start_task is None:
+            start_task = asyncio.create_task(start_agent(agent))
+        start_task.add_done_callback(on_agent_ready)
+
+        if RECORD_DIR:
+            recorder = SessionRecorder(
+                os.path.join(RECORD_DIR, f"{session_id or uuid.uuid4()}.bidirec"),
+                {"source": "server", "session_id": session_id, "subprotocol": subprotocol},
+            )
+
+        # 入力イベントの検証と、モデルの入力形式(接続時に固定)への変換
+        audio_config = agent.model.config["audio"]
+        validator = InputValidator(audio_config["input_rate"], audio_config["channels"], telemetry)
+        # 音声イベントのバイナリ/JSON変換を行うI/Oアダプタ
+        bridge = WebSocketBridge(websocket, subprotocol, telemetry, recorder, validator=validator)
+        # 遅いクライアントでエージェントのループが止まらないよう、送信はキュー経由で行う
+        output = OutputChannel(bridge.send, telemetry=telemetry, on_interrupt=bridge.interrupt)
+
+        print("[Server] Starting session...")
+        await run_session(
+            agent,
+            inputs=[bridge.receive],
+            outputs=[output.put],
+            start_task=start_task,
         )
-        print("[Server] agent.run() completed")
+        print("[Server] Session completed")
 
     except WebSocketDisconnect:
         print("[Server] Client disconnected")
     except Exception as e:
+        session_error = e
         print(f"[Server] Error: {e}")
         import traceback
         traceback.print_exc()
     finally:
         print("[Server] Cleanup...")
+        if output:
+            await output.close()
+        telemetry.end(session_error)
+        if recorder:
+            recorder.close()
+        if start_task and not start_task.done():
+            start_task.cancel()
         try:
             await agent.stop()
         except Exception as e:
@@ -89,5 +263,9 @@ async def websocket_handler(websocket: WebSocket, context):
 
 
 if __name__ == "__main__":
-    print("Starting WebSocket server with BedrockAgentCoreApp on port 8080...")
-    app.run()
+    if worker_count() > 1:
+        # spawn のワーカーがこのファイルを __mp_main__ として読み直さないよう、workers.py から起動し直す
+        workers_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers.py")
+        os.execv(sys.executable, [sys.executable, workers_path, *sys.argv[1:]])
+    print(f"Starting WebSocket server with BedrockAgentCoreApp on port 8080 (model: {BIDI_MODEL})...")
+    serve(app)
@@ -0,0 +1,114 @@
+"""
+BidiAgent の事前生成プール
+
+BidiNovaSonicModel / BidiAgent の生成(ツールレジストリの構築、boto3セッションの作成等)を
+接続ごとの accept 後に行うと、その時間がそのまま最初の音声応答までの遅延になる。
+このプールはプロセスごとに生成済みのエージェントを保持し、接続時にはそれを取り出すだけにする。
+
+- 取り出したエージェントはプールに戻さない(使い捨て)。会話履歴やツールの状態が
+  セッション間で漏れないようにするため。
+- 取り出すたびにバックグラウンドで補充する。補充はワーカースレッドで行い、
+  他のセッションの音声中継を止めない。
+- プールが空のときはその場で生成する(ミス)。
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass
+class PoolStats:
+    """プールのメトリクス"""
+
+    hits: int = 0
+    misses: int = 0
+    constructed: int = 0
+    construct_total_ms: float = 0.0
+    construct_max_ms: float = 0.0
+    last_construct_ms: float = 0.0
+
+    @property
+    def construct_avg_ms(self) -> float:
+        return self.construct_total_ms / self.constructed if self.constructed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "constructed": self.constructed,
+            "construct_avg_ms": round(self.construct_avg_ms, 1),
+            "construct_max_ms": round(self.construct_max_ms, 1),
+            "last_construct_ms": round(self.last_construct_ms, 1),
+        }
+
+
+class AgentPool:
+    """生成済みエージェントのプール
+
+    Args:
+        factory: エージェントを1つ生成する関数(同期)
+        size: プールに保持する数(0ならプールを使わず毎回生成する)
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 2):
+        self._factory = factory
+        self.size = max(0, size)
+        self._ready: deque = deque()
+        self._refill_task: asyncio.Task | None = None
+        self.stats = PoolStats()
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def start(self) -> None:
+        """バックグラウンドでプールを満たし始める(イベントループ上で呼ぶ)"""
+        self._schedule_refill()
+
+    async def acquire(self) -> Any:
+        """エージェントを1つ取り出す(返却不要)"""
+        if self._ready:
+            agent = self._ready.popleft()
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            agent = await asyncio.to_thread(self._build)
+        self._schedule_refill()
+        return agent
+
+    async def close(self) -> None:
+        """補充を止め、保持しているエージェントを破棄する"""
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        self._ready.clear()
+
+    def _build(self) -> Any:
+        start = time.perf_counter()
+        agent = self._factory()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats.constructed += 1
+        self.stats.construct_total_ms += elapsed_ms
+        self.stats.construct_max_ms = max(self.stats.construct_max_ms, elapsed_ms)
+        self.stats.last_construct_ms = elapsed_ms
+        return agent
+
+    def _schedule_refill(self) -> None:
+        if len(self._ready) >= self.size:
+            return
+        if self._refill_task and not self._refill_task.done():
+            return
+        self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        while len(self._ready) < self.size:
+            try:
+                agent = await asyncio.to_thread(self._build)
+            except Exception as e:
+                print(f"[AgentPool] Refill error: {e}")
+                return
+            self._ready.append(agent)
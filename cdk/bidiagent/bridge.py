@@ -0,0 +1,318 @@
+"""
+WebSocket ⇔ BidiAgent ブリッジ
+
+websocket.receive_json / websocket.send_json の代わりに agent.run() の
+inputs / outputs として渡すI/Oアダプタ。ネゴシエーションの結果に応じて
+音声イベントをバイナリフレーム(framing.py)またはJSONで送受信する。
+"""
+import asyncio
+import base64
+import os
+import time
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import codec
+import control
+import framing
+from event_filter import EventFilter
+from input_validation import REJECT_CLOSE_CODE, InputError, InputValidator, check_size, error_event
+from json_codec import JsonCodec, default_codec, utf8_length
+from recorder import DOWNLINK, UPLINK, SessionRecorder
+from telemetry import SessionTelemetry
+
+# クライアントの再生位置(送った音声の長さから推定)より先に送る音声の長さ(ms)。0 ならペーシングしない。
+# Nova Sonic は応答音声を実時間より速く生成するため、先に送りすぎると割り込み時に捨てられる音声が増える
+AUDIO_LEAD_MS = int(os.environ.get("BIDI_AUDIO_LEAD_MS", "0"))
+
+# bridge_config で指定できる audio_lead_ms の上限
+MAX_AUDIO_LEAD_MS = 10_000
+
+
+def choose_audio_lead(requested) -> int:
+    """クライアントが要求した audio_lead_ms を検証して、実際に使う値を返す"""
+    if requested is None:
+        return AUDIO_LEAD_MS
+    try:
+        lead_ms = int(requested)
+    except (TypeError, ValueError):
+        return AUDIO_LEAD_MS
+    return min(max(lead_ms, 0), MAX_AUDIO_LEAD_MS)
+
+
+class WebSocketBridge:
+    """1つのWebSocket接続に対応するI/Oアダプタ
+
+    Args:
+        websocket: accept済みのStarlette WebSocketオブジェクト
+        subprotocol: accept時に選択したサブプロトコル(Noneなら従来のJSON)
+        telemetry: セッションの計測(Noneなら記録しない)
+        recorder: 送受信メッセージの記録先(Noneなら記録しない)
+        json_codec: JSONイベントのエンコーダ/デコーダ(Noneならプロセス共通のもの)
+        validator: 受信イベントの検証・正規化(Noneなら検証しない)
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        subprotocol: str | None = None,
+        telemetry: SessionTelemetry | None = None,
+        recorder: SessionRecorder | None = None,
+        json_codec: JsonCodec | None = None,
+        validator: InputValidator | None = None,
+    ):
+        self._websocket = websocket
+        self._validator = validator
+        self._json = json_codec or default_codec
+        self._telemetry = telemetry
+        self._recorder = recorder
+        self.binary = subprotocol == framing.SUBPROTOCOL_BINARY
+        # WebSocket 上の音声フォーマット(bridge_config で変更される)
+        self.audio_format = "pcm"
+        # (sample_rate, channels) ごとのエンコーダ/デコーダ
+        self._encoders: dict[tuple[int, int], codec.OpusEncoder] = {}
+        self._decoders: dict[tuple[int, int], codec.OpusDecoder] = {}
+        # ペーシング(bridge_config で変更される)
+        self.audio_lead_ms = AUDIO_LEAD_MS
+        # 送った音声をクライアントが再生し終える推定時刻(loop.time())
+        self._playback_end = 0.0
+        self._pacing_interrupted = asyncio.Event()
+        # 送るイベントの選択(クエリパラメータ、bridge_config で変更される)
+        self.event_filter = EventFilter.from_options(websocket.query_params)
+
+    async def receive(self) -> dict:
+        """クライアントからのイベントを1つ受信する(agent.run の input)"""
+        while True:
+            try:
+                event, framed = await self._receive_event()
+            except InputError as error:
+                if self._validator is None:
+                    raise
+                await self._reject(error)
+                continue
+            event_type = event.get("type")
+
+            if event_type == control.BRIDGE_CONFIG:
+                # 制御メッセージはエージェントに渡さない
+                await self._configure(event)
+                continue
+            if self._validator is not None:
+                try:
+                    return await self._validate(event, framed)
+                except InputError as error:
+                    await self._reject(error)
+                    continue
+            if event_type == framing.SILENCE_EVENT_TYPE:
+                # クライアントのVADが省略した無音区間をゼロPCMに戻してモデルに渡す
+                return framing.expand_silence(event)
+            if event_type == "bidi_audio_input" and event.get("format") == "opus":
+                return await self._decode(event)
+            return event
+
+    async def send(self, event: dict) -> None:
+        """エージェントからのイベントを1つ送信する(agent.run の output)"""
+        event_type = event.get("type")
+        if event_type == "bidi_interruption" or (
+                event_type == "bidi_response_complete" and event.get("stop_reason") == "interrupted"):
+            # クライアントは再生中の音声を捨てるので、再生位置とエンコーダの状態を戻す
+            self._playback_end = 0.0
+            for encoder in self._encoders.values():
+                encoder.reset()
+        elif self.audio_format == "opus" and event_type == "bidi_response_complete":
+            # 応答の最後の端数を無音で埋めて送ってから完了を通知する(次の応答に持ち越さない)。
+            # 埋める無音は他の音声と同じく購読・ペーシングを通す
+            for padding in self._padding_events():
+                await self.send(padding)
+
+        if self.event_filter.active and not self.event_filter.admit(event):
+            # クライアントが受け取らないイベントは送らない
+            if self._telemetry:
+                self._telemetry.record_filtered(event)
+            return
+
+        if event_type == "bidi_audio_stream" and self.audio_lead_ms > 0:
+            if not await self._pace(event):
+                return
+
+        if self.audio_format == "opus" and event_type == "bidi_audio_stream":
+            event = await self._encode(event)
+            if event is None:
+                # 1パケットに満たない端数は次の音声と一緒に送る
+                return
+
+        if self.event_filter.active:
+            for pending in self.event_filter.release(event):
+                await self._send_event(pending)
+        await self._send_event(event)
+
+    def interrupt(self) -> None:
+        """割り込みを受けた(出力キューから呼ばれる)。ペーシングで待っている音声は送らない"""
+        self._playback_end = 0.0
+        self._pacing_interrupted.set()
+
+    async def _pace(self, event: dict) -> bool:
+        """クライアントの再生位置が audio_lead_ms 以内に近づくまで待つ
+
+        Returns:
+            送ってよければ True、待っている間に割り込まれた場合は False
+        """
+        loop = asyncio.get_running_loop()
+        delay = self._playback_end - self.audio_lead_ms / 1000 - loop.time()
+        if delay > 0:
+            self._pacing_interrupted.clear()
+            try:
+                await asyncio.wait_for(self._pacing_interrupted.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                if self._telemetry:
+                    self._telemetry.record_output_drop(
+                        "interrupted", framing.audio_size(event), framing.pcm_duration(event) * 1000)
+                return False
+        # 再生が途切れていた(送信が追いつかなかった)場合は今から再生される
+        self._playback_end = max(self._playback_end, loop.time()) + framing.pcm_duration(event)
+        return True
+
+    async def _validate(self, event: dict, framed: bool) -> dict:
+        """イベントを検証し、モデルに渡す形(PCM、モデルの入力形式)にする"""
+        started = time.perf_counter()
+        event_type = event.get("type")
+        try:
+            if framed:
+                event = self._validator.check_frame(event)
+            else:
+                event = self._validator.check(event)
+            if event_type == "bidi_audio_input" and event["format"] == "opus":
+                event = await self._decode(event)
+                self._validator.check_decoded(event)
+            return await self._validator.normalize(event)
+        finally:
+            self._validator.record(event_type if isinstance(event_type, str) else "unknown", started)
+
+    async def _reject(self, error: InputError) -> None:
+        """受け付けないイベントを bidi_error で知らせる。拒否が続いていれば接続を閉じる"""
+        close = self._validator.reject(error)
+        await self._send_event(error_event(error))
+        if close:
+            reason = f"too many invalid events ({self._validator.rejected})"
+            print(f"[Bridge] Closing: {reason}")
+            await self._websocket.close(code=REJECT_CLOSE_CODE, reason=reason)
+            raise WebSocketDisconnect(REJECT_CLOSE_CODE, reason)
+
+    async def _receive_event(self) -> tuple[dict, bool]:
+        """次のイベントと、それがバイナリフレームだったかを返す
+
+        Raises:
+            InputError: デコードできないメッセージ(大きさの上限は validator がある場合のみ確認する)
+        """
+        message = await self._websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+        data = message.get("bytes")
+        try:
+            if data is not None:
+                # バイナリフレームは音声入力(base64化してStrandsのイベント形式に揃える)
+                size = len(data)
+                if self._validator is not None:
+                    check_size(size)
+                event = framing.frame_to_event(data)
+            elif "event" in message:
+                # 多重化接続(mux_bridge.py)はストリームの振り分けのために解釈済み
+                event = message["event"]
+                size = message["size"]
+                if self._validator is not None:
+                    check_size(size)
+            else:
+                text = message["text"]
+                size = utf8_length(text)
+                if self._validator is not None:
+                    # デコードする前に大きさで断る
+                    check_size(size)
+                event = self._json.decode(text)
+        except InputError:
+            raise
+        except ValueError as error:
+            # framing.FrameError / JSONDecodeError
+            raise InputError("malformed", f"cannot decode message: {error}") from error
+        if not isinstance(event, dict):
+            raise InputError("malformed", "event must be a JSON object")
+
+        if self._telemetry:
+            self._telemetry.record_input(event.get("type", ""), size)
+        if self._recorder:
+            self._recorder.record(UPLINK, data if data is not None else event)
+        return event, data is not None
+
+    async def _send_event(self, event: dict) -> None:
+        data = None
+        if self.binary and event.get("type") == "bidi_audio_stream":
+            data = framing.event_to_frame(event)
+            await self._websocket.send_bytes(data)
+            size = len(data)
+        else:
+            # send_json の代わりに自前でシリアライズする(高速化とサイズの記録のため)
+            text = self._json.encode(event)
+            await self._websocket.send_text(text)
+            size = utf8_length(text)
+
+        if self._telemetry:
+            self._telemetry.record_output(event, size)
+        if self._recorder:
+            self._recorder.record(DOWNLINK, data if data is not None else event)
+
+    async def _configure(self, event: dict) -> None:
+        """bridge_config を適用し、実際に使う設定を ack で返す"""
+        self.audio_format = codec.choose_format(event.get("audio_format"))
+        self.audio_lead_ms = choose_audio_lead(event.get("audio_lead_ms"))
+        self.event_filter = EventFilter.from_options(event, self.event_filter)
+        print(f"[Bridge] Config: audio_format={self.audio_format}, audio_lead_ms={self.audio_lead_ms}, "
+              f"filter={self.event_filter.as_options()}")
+        await self._send_event({
+            "type": control.BRIDGE_CONFIG_ACK,
+            "audio_format": self.audio_format,
+            "audio_lead_ms": self.audio_lead_ms,
+            **self.event_filter.as_options(),
+        })
+
+    async def _decode(self, event: dict) -> dict:
+        """Opus の bidi_audio_input を PCM に変換する
+
+        Raises:
+            InputError: 復号できないペイロード・libopus が対応していない形式
+        """
+        key = (int(event["sample_rate"]), int(event["channels"]))
+        try:
+            decoder = self._decoders.get(key)
+            if decoder is None:
+                decoder = self._decoders[key] = codec.OpusDecoder(*key)
+            pcm = await codec.run_in_worker(decoder.decode, base64.b64decode(event["audio"]))
+        except codec.DECODE_ERRORS as error:
+            raise InputError("invalid_field", f"cannot decode opus audio: {error}", "bidi_audio_input") from error
+        return {**event, "audio": base64.b64encode(pcm).decode("ascii"), "format": "pcm"}
+
+    async def _encode(self, event: dict) -> dict | None:
+        """PCM の bidi_audio_stream を Opus に変換する"""
+        key = (int(event["sample_rate"]), int(event["channels"]))
+        encoder = self._encoders.get(key)
+        if encoder is None:
+            encoder = self._encoders[key] = codec.OpusEncoder(*key)
+        payload = await codec.run_in_worker(encoder.encode, base64.b64decode(event["audio"]))
+        if not payload:
+            return None
+        return {**event, "audio": base64.b64encode(payload).decode("ascii"), "format": "opus"}
+
+    def _padding_events(self) -> list[dict]:
+        """エンコーダに残っている端数を1パケットにする無音(PCM の bidi_audio_stream)"""
+        events = []
+        for (sample_rate, channels), encoder in self._encoders.items():
+            size = encoder.padding()
+            if size:
+                events.append({
+                    "type": "bidi_audio_stream",
+                    "audio": base64.b64encode(bytes(size)).decode("ascii"),
+                    "format": "pcm",
+                    "sample_rate": sample_rate,
+                    "channels": channels,
+                })
+        return events
@@ -0,0 +1,144 @@
+"""
+音声コーデック(Opus)
+
+bidi_audio_input / bidi_audio_stream は通常 16bit PCM をそのまま送るが、
+接続ごとのネゴシエーション(control.py の bridge_config)で "opus" が選ばれた場合は
+WebSocket 上では Opus で圧縮した音声をやり取りし、モデルとの境界で PCM に変換する。
+
+Opus のペイロード形式:
+
+    | length (uint16, big endian) | Opus パケット | length | Opus パケット | ...
+
+1つのイベントに FRAME_MS ごとのパケットを複数並べる。エンコーダは FRAME_MS に満たない
+端数を次の呼び出しまで持ち越す(Opus は決まった長さのフレームしか符号化できないため)。
+
+エンコーダ/デコーダは状態を持つため、接続・方向ごとに1つずつ用意し、同時に1つのスレッドからだけ
+呼び出すこと。opuslib(libopus)が無い環境では OPUS_AVAILABLE が False になり、"pcm" のみ使用する。
+
+このモジュールは test/ 配下のクライアントからも読み込まれる。
+"""
+import asyncio
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# opuslibのインポート（Opus用、オプション。libopus も必要）
+try:
+    import opuslib
+    OPUS_AVAILABLE = True
+    # 復号できないペイロード・libopus が対応していない形式で投げられる例外
+    DECODE_ERRORS: tuple[type[Exception], ...] = (ValueError, opuslib.OpusError)
+except Exception:
+    # opuslib は libopus が見つからない場合 ImportError 以外の例外を投げる
+    OPUS_AVAILABLE = False
+    DECODE_ERRORS = (ValueError,)
+
+# 1パケットの長さ(ms)。Opus が扱える 2.5 / 5 / 10 / 20 / 40 / 60 のいずれか
+FRAME_MS = 20
+
+# Opusのビットレート(bps)
+OPUS_BITRATE = int(os.environ.get("BIDI_OPUS_BITRATE", "24000"))
+
+# 変換を行うワーカースレッド数(libopus の呼び出し中は GIL が解放される)
+CODEC_WORKERS = int(os.environ.get("BIDI_CODEC_WORKERS", "4"))
+
+_PACKET_LENGTH = struct.Struct("!H")
+
+# 16bit PCM 1サンプルのバイト数
+_PCM_SAMPLE_WIDTH = 2
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def supported_formats() -> tuple[str, ...]:
+    """この環境で扱える音声フォーマット(優先順)"""
+    return ("opus", "pcm") if OPUS_AVAILABLE else ("pcm",)
+
+
+def choose_format(requested: str | None) -> str:
+    """クライアントが要求したフォーマットが使えればそれを、使えなければ "pcm" を返す"""
+    return requested if requested in supported_formats() else "pcm"
+
+
+async def run_in_worker(func, *args):
+    """変換処理をワーカースレッドで実行する(イベントループを止めない)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=CODEC_WORKERS, thread_name_prefix="codec")
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+class OpusEncoder:
+    """PCM → Opus ペイロード
+
+    Args:
+        sample_rate: サンプリングレート(8000 / 12000 / 16000 / 24000 / 48000)
+        channels: チャンネル数
+        bitrate: ビットレート(bps)
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 1, bitrate: int = OPUS_BITRATE):
+        if not OPUS_AVAILABLE:
+            raise RuntimeError("opuslib (and libopus) is required for opus")
+        self._encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self._frame_size = sample_rate * FRAME_MS // 1000
+        self._frame_bytes = self._frame_size * channels * _PCM_SAMPLE_WIDTH
+        self._pending = bytearray()
+
+    def encode(self, pcm: bytes) -> bytes:
+        """PCMを符号化する(FRAME_MS に満たない端数は次回に持ち越す)"""
+        self._pending += pcm
+        packets = []
+        while len(self._pending) >= self._frame_bytes:
+            frame = bytes(self._pending[:self._frame_bytes])
+            del self._pending[:self._frame_bytes]
+            packet = self._encoder.encode(frame, self._frame_size)
+            packets.append(_PACKET_LENGTH.pack(len(packet)) + packet)
+        return b"".join(packets)
+
+    def padding(self) -> int:
+        """持ち越している端数を1フレームにするのに足りないバイト数(端数が無ければ0)"""
+        return self._frame_bytes - len(self._pending) if self._pending else 0
+
+    def flush(self) -> bytes:
+        """持ち越している端数を無音で埋めて符号化する(応答の終わり等)"""
+        if not self._pending:
+            return b""
+        return self.encode(bytes(self.padding()))
+
+    def reset(self) -> None:
+        """持ち越している端数を捨てる(割り込み時)"""
+        self._pending.clear()
+
+
+class OpusDecoder:
+    """Opus ペイロード → PCM
+
+    Args:
+        sample_rate: サンプリングレート
+        channels: チャンネル数
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 1):
+        if not OPUS_AVAILABLE:
+            raise RuntimeError("opuslib (and libopus) is required for opus")
+        self._decoder = opuslib.Decoder(sample_rate, channels)
+        # 1パケットの最大長(120ms)
+        self._max_frame_size = sample_rate * 120 // 1000
+
+    def decode(self, payload: bytes) -> bytes:
+        """長さ付きで並んだ Opus パケットを復号して連結したPCMを返す"""
+        pcm = []
+        offset = 0
+        while offset < len(payload):
+            if offset + _PACKET_LENGTH.size > len(payload):
+                raise ValueError("truncated opus payload")
+            (length,) = _PACKET_LENGTH.unpack_from(payload, offset)
+            offset += _PACKET_LENGTH.size
+            packet = payload[offset:offset + length]
+            if len(packet) != length:
+                raise ValueError("truncated opus packet")
+            offset += length
+            pcm.append(self._decoder.decode(packet, self._max_frame_size))
+        return b"".join(pcm)
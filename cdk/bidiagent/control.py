@@ -0,0 +1,50 @@
+"""
+ブリッジ制御メッセージ
+
+サブプロトコル(framing.py)をネゴシエーションしたクライアントは、最初に bridge_config を送って
+接続ごとの設定を要求できる。サーバー(bridge.py)はこれをエージェントには渡さず、
+実際に適用した設定を bridge_config_ack で返す。
+
+    クライアント → サーバー: {"type": "bridge_config", "audio_format": "opus", "audio_lead_ms": 300}
+    サーバー → クライアント: {"type": "bridge_config_ack", "audio_format": "opus", "audio_lead_ms": 300}
+
+    audio_format   WebSocket 上の音声フォーマット("pcm" / "opus", codec.py)
+    audio_lead_ms  応答音声をクライアントの再生位置より何ms先まで送るか(0 でペーシングしない, bridge.py)
+    events / transcripts / usage
+                   クライアントが受け取るイベントの選択(event_filter.py)
+
+サーバーが対応していない項目・値は ack で既定値に戻して返すため、クライアントは
+ack の内容に従うこと。
+
+このモジュールは標準ライブラリのみに依存し、test/ 配下のクライアントからも読み込まれる。
+"""
+import asyncio
+import json
+
+BRIDGE_CONFIG = "bridge_config"
+BRIDGE_CONFIG_ACK = "bridge_config_ack"
+
+
+def config_event(**options) -> dict:
+    """bridge_config イベントを作る(値が None の項目は送らない)"""
+    return {"type": BRIDGE_CONFIG, **{key: value for key, value in options.items() if value is not None}}
+
+
+async def negotiate(websocket, timeout: float = 10.0, **options) -> dict:
+    """bridge_config を送り、サーバーの ack を待って返す(websockets クライアント用)
+
+    ack より先に届いたメッセージ(モデル接続の通知等)は読み捨てる。
+    """
+    await websocket.send(json.dumps(config_event(**options)))
+
+    async def wait_ack() -> dict:
+        while True:
+            message = await websocket.recv()
+            if isinstance(message, bytes):
+                continue
+            data = json.loads(message)
+            if data.get("type") == BRIDGE_CONFIG_ACK:
+                return data
+            print(f"[Negotiate] Skipped {data.get('type')} before ack")
+
+    return await asyncio.wait_for(wait_ack(), timeout)
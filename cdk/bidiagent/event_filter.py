@@ -0,0 +1,125 @@
+"""
+クライアントへ送るイベントの選択(購読)
+
+サーバーはエージェントのイベントをすべてクライアントに転送するが、多くのクライアントは
+bidi_usage を読まず、トランスクリプトも最終結果(is_final)しか使わない。
+クライアントは接続時に受け取るイベントを宣言でき、ブリッジ(bridge.py)は
+それ以外をシリアライズ・送信せずに捨てる。
+
+宣言はクエリパラメータ、または bridge_config(control.py)で行う(bridge_config が優先)。
+
+    ws://.../ws?events=bidi_audio_stream,bidi_transcript_stream&transcripts=final&usage=turn
+    {"type": "bridge_config", "events": ["bidi_audio_stream", ...], "transcripts": "final", "usage": "turn"}
+
+    events       受け取るイベントの種類(省略時はすべて)
+    transcripts  bidi_transcript_stream の粒度
+                   all    すべての更新(既定)
+                   final  is_final=True のみ
+                   none   送らない
+    usage        bidi_usage の粒度
+                   all    モデルが出すたび(既定)
+                   turn   応答ごとに1回(bidi_response_complete の直前に最新の値を送る)
+                   none   送らない
+
+Nova Sonic の bidi_usage はセッション開始からの累計値のため、turn では最新の1件だけを送る。
+turn の使用量は bidi_response_complete の直前に送るため、events に bidi_response_complete が無くても
+usage=turn なら bidi_response_complete を送る(ack の events にも含める)。
+bridge_config_ack / bidi_error / bidi_connection_close は宣言に関わらず送る。
+"""
+from collections.abc import Iterable, Mapping
+
+TRANSCRIPT_MODES = ("all", "final", "none")
+USAGE_MODES = ("all", "turn", "none")
+
+# 宣言に関わらず送るイベント
+_ALWAYS_SENT = frozenset(("bridge_config_ack", "bidi_error", "bidi_connection_close"))
+
+
+def _parse_events(value) -> frozenset[str] | None:
+    """events の値(リスト、またはカンマ区切りの文字列)を解釈する"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, Iterable):
+        return None
+    events = frozenset(str(event_type).strip() for event_type in value if str(event_type).strip())
+    return events or None
+
+
+class EventFilter:
+    """1接続分のイベントの選択
+
+    Args:
+        events: 受け取るイベントの種類(Noneならすべて)
+        transcripts: トランスクリプトの粒度("all" / "final" / "none")
+        usage: 使用量の粒度("all" / "turn" / "none")
+    """
+
+    def __init__(self, events: Iterable[str] | None = None, transcripts: str = "all", usage: str = "all"):
+        if transcripts not in TRANSCRIPT_MODES:
+            raise ValueError(f"Unknown transcripts mode: {transcripts} (expected one of {TRANSCRIPT_MODES})")
+        if usage not in USAGE_MODES:
+            raise ValueError(f"Unknown usage mode: {usage} (expected one of {USAGE_MODES})")
+        self.events = frozenset(events) if events is not None else None
+        if self.events is not None and usage == "turn":
+            # 保持した使用量は bidi_response_complete と一緒に送る
+            self.events |= {"bidi_response_complete"}
+        self.transcripts = transcripts
+        self.usage = usage
+        # 全イベントを送る場合は判定を省く
+        self.active = self.events is not None or transcripts != "all" or usage != "all"
+        self._pending_usage: dict | None = None
+
+    @classmethod
+    def from_options(cls, options: Mapping, base: "EventFilter | None" = None) -> "EventFilter":
+        """クエリパラメータ / bridge_config から作る
+
+        指定の無い項目は base(無ければ既定値)のまま。不正な値も base の値に戻す
+        (サーバーが実際に使う設定は ack で返す)。
+        """
+        base = base or cls()
+        events = _parse_events(options.get("events")) if "events" in options else base.events
+        transcripts = options.get("transcripts", base.transcripts)
+        usage = options.get("usage", base.usage)
+        return cls(
+            events,
+            transcripts if transcripts in TRANSCRIPT_MODES else base.transcripts,
+            usage if usage in USAGE_MODES else base.usage,
+        )
+
+    def admit(self, event: dict) -> bool:
+        """イベントをクライアントに送るか判定する
+
+        usage="turn" の bidi_usage は送らずに保持し、release() で応答の完了時に返す。
+        """
+        event_type = event.get("type", "")
+        if event_type in _ALWAYS_SENT:
+            return True
+        if self.events is not None and event_type not in self.events:
+            return False
+        if event_type == "bidi_transcript_stream":
+            if self.transcripts == "none":
+                return False
+            return self.transcripts == "all" or bool(event.get("is_final"))
+        if event_type == "bidi_usage":
+            if self.usage == "turn":
+                self._pending_usage = event
+                return False
+            return self.usage == "all"
+        return True
+
+    def release(self, event: dict) -> list[dict]:
+        """event の直前に送るイベント(応答の完了時に、保持していた使用量)"""
+        if self._pending_usage is None or event.get("type") != "bidi_response_complete":
+            return []
+        usage, self._pending_usage = self._pending_usage, None
+        return [usage]
+
+    def as_options(self) -> dict:
+        """ack で返す設定"""
+        return {
+            "events": sorted(self.events) if self.events is not None else None,
+            "transcripts": self.transcripts,
+            "usage": self.usage,
+        }
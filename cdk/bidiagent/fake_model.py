@@ -0,0 +1,329 @@
+"""
+オフライン用のフェイク双方向モデル
+
+Bedrock(Nova Sonic)に接続せずに、ブリッジ・クライアント・同時接続数のスループットや
+レイテンシを計測するための BidiModel 実装。Nova Sonic と同じ順序・形式でイベントを出す:
+
+    bidi_connection_start
+    (ユーザー発話の終了ごとに)
+    bidi_transcript_stream (role=user, is_final=True)
+    bidi_response_start
+    [tool_use_stream → ツール結果の受信 → bidi_response_start(同じ response_id)]
+    bidi_transcript_stream (role=assistant, is_final=False)
+    bidi_audio_stream × N(CHUNK_MS ごと、REALTIME 倍速でペーシング)
+    bidi_transcript_stream (role=assistant, is_final=True)
+    bidi_usage
+    bidi_response_complete (complete)
+
+ユーザー発話の区切りは音声入力のピーク値で判定する(SPEECH_PEAK を超えるチャンクが発話、
+発話の後に SILENCE_MS 続いた無音で終了)。テキスト入力は受信時点で1発話とみなす。
+応答中に発話を検出すると bidi_interruption と bidi_response_complete(interrupted) を出して
+応答を打ち切る。
+
+ツール使用:
+    テキスト入力 "/tool <name> <JSON>" でそのツールを呼ぶ(JSON オブジェクトとして読めなければ通常の発話として扱う)。
+    TOOL_EVERY > 0 の場合は N ターンごとに calculator を呼ぶ(音声入力でもツール経路を計測できる)。
+    TOOL_TIMEOUT 秒以内にツール結果が届かなければ、エラーを伝えるトランスクリプトと
+    bidi_response_complete (error) を出して応答を終える。
+
+出力は ID を除いて決定的(固定の文言と正弦波)で、同じ入力に対して同じイベント列を返す。
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import uuid
+from array import array
+from functools import lru_cache
+
+from strands.experimental.bidi.types.events import (
+    BidiAudioInputEvent,
+    BidiAudioStreamEvent,
+    BidiConnectionStartEvent,
+    BidiInterruptionEvent,
+    BidiResponseCompleteEvent,
+    BidiResponseStartEvent,
+    BidiTextInputEvent,
+    BidiTranscriptStreamEvent,
+    BidiUsageEvent,
+)
+from strands.types._events import ToolResultEvent, ToolUseStreamEvent
+
+# モデル接続(start)にかかる時間(ms)
+CONNECT_MS = int(os.environ.get("BIDI_FAKE_CONNECT_MS", "300"))
+
+# ユーザー発話の終了から応答開始までの時間(ms)
+LATENCY_MS = int(os.environ.get("BIDI_FAKE_LATENCY_MS", "400"))
+
+# 1応答の音声の長さ(ms)
+RESPONSE_MS = int(os.environ.get("BIDI_FAKE_RESPONSE_MS", "2000"))
+
+# bidi_audio_stream 1イベントあたりの音声の長さ(ms)
+CHUNK_MS = int(os.environ.get("BIDI_FAKE_CHUNK_MS", "40"))
+
+# 実時間に対する送出速度(1.0 = 実時間、2.0 = 2倍速、0 = ペーシングなし)
+REALTIME = float(os.environ.get("BIDI_FAKE_REALTIME", "1.0"))
+
+# 発話とみなす16bit PCMのピーク値
+SPEECH_PEAK = int(os.environ.get("BIDI_FAKE_SPEECH_PEAK", "1000"))
+
+# 発話の終了とみなす無音の長さ(ms)
+SILENCE_MS = int(os.environ.get("BIDI_FAKE_SILENCE_MS", "600"))
+
+# Nターンごとに calculator を呼ぶ(0で無効)
+TOOL_EVERY = int(os.environ.get("BIDI_FAKE_TOOL_EVERY", "0"))
+
+# ツール結果を待つ最大時間(秒)
+TOOL_TIMEOUT = 30.0
+
+# 音声1秒あたりのトークン数(bidi_usage の概算用)
+_TOKENS_PER_SECOND = 25
+
+_PCM_SAMPLE_WIDTH = 2
+
+
+@lru_cache(maxsize=8)
+def _tone_chunk(sample_rate: int, channels: int, chunk_ms: int) -> str:
+    """応答音声1チャンク分(440Hz の正弦波)を base64 で返す
+
+    chunk_ms が 440Hz の周期の整数倍でなくても連結時のノイズは計測には影響しないため、
+    全チャンクで同じデータを使い回す。
+    """
+    frames = sample_rate * chunk_ms // 1000
+    samples = array("h")
+    for i in range(frames):
+        value = int(3000 * math.sin(2 * math.pi * 440 * i / sample_rate))
+        samples.extend([value] * channels)
+    return base64.b64encode(samples.tobytes()).decode("ascii")
+
+
+def _peak(pcm: bytes) -> int:
+    """16bit PCMのピーク値"""
+    if len(pcm) < _PCM_SAMPLE_WIDTH:
+        return 0
+    samples = array("h", pcm[:len(pcm) - len(pcm) % _PCM_SAMPLE_WIDTH])
+    return max(max(samples), -min(samples))
+
+
+class FakeBidiModel:
+    """Nova Sonic 互換のイベントを出すオフライン用モデル
+
+    Args:
+        provider_config: BidiNovaSonicModel と同じ形式の設定("audio" のみ参照)
+    """
+
+    def __init__(self, provider_config: dict | None = None):
+        audio = {
+            "input_rate": 16000,
+            "output_rate": 16000,
+            "channels": 1,
+            "format": "pcm",
+            "voice": "fake",
+        }
+        audio.update((provider_config or {}).get("audio", {}))
+        self.config = {"audio": audio}
+
+        self._connection_id: str | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tool_names: set[str] = set()
+        self._response_task: asyncio.Task | None = None
+        self._response_id: str | None = None
+        self._tool_results: dict[str, asyncio.Future] = {}
+        self._turns = 0
+
+        # 音声入力の発話区間の検出状態
+        self._speech_ms = 0.0
+        self._silence_ms = 0.0
+
+    async def start(self, system_prompt=None, tools=None, messages=None, **kwargs) -> None:
+        """モデル接続(CONNECT_MS 待つだけ)"""
+        if self._connection_id:
+            raise RuntimeError("model already started")
+        await asyncio.sleep(CONNECT_MS / 1000)
+        self._connection_id = str(uuid.uuid4())
+        self._queue = asyncio.Queue()
+        self._tool_names = {tool["name"] for tool in tools or []}
+        self._turns = 0
+        self._speech_ms = 0.0
+        self._silence_ms = 0.0
+
+    async def stop(self) -> None:
+        """応答中のタスクを止めて接続を閉じる"""
+        await self._cancel_response()
+        self._connection_id = None
+
+    async def receive(self):
+        """出力イベントを返す(agent.receive から呼ばれる)"""
+        if not self._connection_id:
+            raise RuntimeError("model not started")
+        yield BidiConnectionStartEvent(connection_id=self._connection_id, model="fake")
+        while True:
+            yield await self._queue.get()
+
+    async def send(self, content) -> None:
+        """入力イベント(音声・テキスト・ツール結果)を受け取る"""
+        if not self._connection_id:
+            raise RuntimeError("model not started")
+
+        if isinstance(content, BidiAudioInputEvent):
+            await self._on_audio(content)
+        elif isinstance(content, BidiTextInputEvent):
+            await self._interrupt()
+            await self._start_turn(content.text, len(content.text))
+        elif isinstance(content, ToolResultEvent):
+            future = self._tool_results.pop(content.tool_use_id, None)
+            if future and not future.done():
+                future.set_result(content.tool_result)
+        # 画像入力は無視する
+
+    # --- 入力 ------------------------------------------------------------
+
+    async def _on_audio(self, event: BidiAudioInputEvent) -> None:
+        pcm = base64.b64decode(event.audio)
+        duration_ms = len(pcm) / (_PCM_SAMPLE_WIDTH * event.channels * event.sample_rate) * 1000
+
+        if _peak(pcm) >= SPEECH_PEAK:
+            if self._speech_ms == 0:
+                # 応答中の発話は割り込み(Nova Sonic の barge-in と同じ)
+                await self._interrupt()
+            self._speech_ms += duration_ms
+            self._silence_ms = 0.0
+        elif self._speech_ms > 0:
+            self._silence_ms += duration_ms
+            if self._silence_ms >= SILENCE_MS:
+                speech_ms = self._speech_ms
+                self._speech_ms = 0.0
+                self._silence_ms = 0.0
+                await self._start_turn(
+                    f"(音声 {speech_ms / 1000:.1f} 秒)",
+                    int(speech_ms / 1000 * _TOKENS_PER_SECOND),
+                )
+
+    async def _start_turn(self, user_text: str, input_tokens: int) -> None:
+        self._turns += 1
+        await self._emit(BidiTranscriptStreamEvent(
+            delta={"text": user_text},
+            text=user_text,
+            role="user",
+            is_final=True,
+            current_transcript=user_text,
+        ))
+        self._response_task = asyncio.create_task(
+            self._respond(self._tool_request(user_text), input_tokens))
+
+    def _tool_request(self, user_text: str) -> tuple[str, dict] | None:
+        """このターンで呼ぶツール(name, input)を決める"""
+        if user_text.startswith("/tool "):
+            name, _, arguments = user_text[len("/tool "):].partition(" ")
+            if not arguments.strip():
+                return name, {}
+            try:
+                tool_input = json.loads(arguments)
+            except ValueError:
+                tool_input = None
+            if isinstance(tool_input, dict):
+                return name, tool_input
+            print(f"[FakeModel] Invalid /tool arguments, treating as text: {arguments[:80]}")
+            return None
+        if TOOL_EVERY > 0 and self._turns % TOOL_EVERY == 0 and "calculator" in self._tool_names:
+            return "calculator", {"expression": f"{self._turns} * 7"}
+        return None
+
+    # --- 応答 ------------------------------------------------------------
+
+    async def _respond(self, tool_request: tuple[str, dict] | None, input_tokens: int) -> None:
+        await asyncio.sleep(LATENCY_MS / 1000)
+        self._response_id = str(uuid.uuid4())
+        await self._emit(BidiResponseStartEvent(response_id=self._response_id))
+
+        text = f"フェイクモデルの応答です(ターン {self._turns})。"
+        if tool_request is not None:
+            try:
+                result = await self._use_tool(*tool_request)
+            except asyncio.TimeoutError:
+                print(f"[FakeModel] Tool {tool_request[0]} timed out after {TOOL_TIMEOUT}s")
+                await self._fail_response(f"ツール {tool_request[0]} の結果が得られませんでした。")
+                return
+            text = f"ツール {tool_request[0]} の結果は {result} です。"
+
+        audio = self.config["audio"]
+        await self._emit(BidiTranscriptStreamEvent(
+            delta={"text": text}, text=text, role="assistant", is_final=False, current_transcript=text,
+        ))
+        await self._stream_audio(audio["output_rate"], audio["channels"])
+        await self._emit(BidiTranscriptStreamEvent(
+            delta={"text": text}, text=text, role="assistant", is_final=True, current_transcript=text,
+        ))
+
+        output_tokens = RESPONSE_MS * _TOKENS_PER_SECOND // 1000 + len(text)
+        await self._emit(BidiUsageEvent(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+        ))
+        await self._emit(BidiResponseCompleteEvent(response_id=self._response_id, stop_reason="complete"))
+        self._response_id = None
+
+    async def _fail_response(self, text: str) -> None:
+        """エラーを伝えるトランスクリプトを出して応答を終える(クライアントは response_complete を待っている)"""
+        await self._emit(BidiTranscriptStreamEvent(
+            delta={"text": text}, text=text, role="assistant", is_final=True, current_transcript=text,
+        ))
+        await self._emit(BidiResponseCompleteEvent(response_id=self._response_id, stop_reason="error"))
+        self._response_id = None
+
+    async def _use_tool(self, name: str, tool_input: dict) -> str:
+        """tool_use_stream を出してツール結果を待ち、結果のテキストを返す"""
+        tool_use = {"toolUseId": f"tooluse_{uuid.uuid4().hex[:22]}", "name": name, "input": tool_input}
+        future = asyncio.get_running_loop().create_future()
+        self._tool_results[tool_use["toolUseId"]] = future
+
+        await self._emit(ToolUseStreamEvent(delta={"toolUse": tool_use}, current_tool_use=dict(tool_use)))
+
+        try:
+            tool_result = await asyncio.wait_for(future, TOOL_TIMEOUT)
+        finally:
+            self._tool_results.pop(tool_use["toolUseId"], None)
+
+        # Nova Sonic と同様、ツール結果を受けて同じ応答の中で続きを始める
+        await self._emit(BidiResponseStartEvent(response_id=self._response_id))
+        return " ".join(block["text"] for block in tool_result.get("content", []) if "text" in block)
+
+    async def _stream_audio(self, sample_rate: int, channels: int) -> None:
+        """応答音声を CHUNK_MS ごとに実時間(× REALTIME)でペーシングして出す"""
+        chunk = _tone_chunk(sample_rate, channels, CHUNK_MS)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(max(1, RESPONSE_MS // CHUNK_MS)):
+            if REALTIME > 0:
+                # 開始時刻からの絶対時刻で待つ(sleep の誤差を積み上げない)
+                delay = started + i * CHUNK_MS / 1000 / REALTIME - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._emit(BidiAudioStreamEvent(
+                audio=chunk, format="pcm", sample_rate=sample_rate, channels=channels,
+            ))
+
+    async def _interrupt(self) -> None:
+        """応答中なら打ち切って割り込みを通知する"""
+        if self._response_task is None or self._response_task.done():
+            return
+        response_id = self._response_id
+        await self._cancel_response()
+        if response_id is not None:
+            await self._emit(BidiInterruptionEvent(reason="user_speech"))
+            await self._emit(BidiResponseCompleteEvent(response_id=response_id, stop_reason="interrupted"))
+
+    async def _cancel_response(self) -> None:
+        task, self._response_task = self._response_task, None
+        self._response_id = None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _emit(self, event) -> None:
+        await self._queue.put(event)
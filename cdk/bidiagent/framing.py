@@ -0,0 +1,179 @@
+"""
+バイナリWebSocketフレーミング
+
+音声イベント(bidi_audio_input / bidi_audio_stream)を base64 入りのJSONではなく、
+固定長ヘッダ + 生の音声データのバイナリフレームで送受信するための定義。
+制御イベントやトランスクリプト等は従来どおりJSONのテキストフレームで送る。
+
+どちらの形式を使うかは WebSocket のサブプロトコル(Sec-WebSocket-Protocol)で
+ネゴシエーションする。サブプロトコルを提示しない(または未対応の)相手とは
+従来のJSON形式で通信するため、既存クライアント・既存サーバーとも互換性がある。
+
+ヘッダ形式(8バイト, ネットワークバイトオーダー):
+
+    version (uint8) | kind (uint8) | format (uint8) | channels (uint8) | sample_rate (uint32)
+
+無音区間(キープアライブ)フレーム:
+
+    クライアントのVADが無音と判定した区間は音声を送らず、kind=3 のフレーム
+    (ペイロードは無音のフレーム数 uint32)またはJSONの bidi_audio_silence イベントで
+    長さだけを伝える。サーバーはこれを同じ長さのゼロPCMの bidi_audio_input に展開して
+    モデルに渡すため、モデル側から見た音声の時間軸(発話終了の検出等)は変わらない。
+    サブプロトコルをネゴシエーションしたサーバーだけがこの形式を解釈できる。
+
+このモジュールは標準ライブラリのみに依存し、test/ 配下のクライアントからも読み込まれる。
+"""
+import base64
+import functools
+import struct
+
+# サブプロトコル名
+SUBPROTOCOL_BINARY = "bidi.binary.v1"
+SUBPROTOCOL_JSON = "bidi.json.v1"
+SUPPORTED_SUBPROTOCOLS = (SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON)
+
+FRAME_VERSION = 1
+
+# フレーム種別
+KIND_AUDIO_INPUT = 1   # クライアント → サーバー (bidi_audio_input)
+KIND_AUDIO_STREAM = 2  # サーバー → クライアント (bidi_audio_stream)
+KIND_AUDIO_SILENCE = 3  # クライアント → サーバー (bidi_audio_silence, 無音区間)
+
+# 無音区間イベント(このリポジトリ独自。サーバーで bidi_audio_input に展開する)
+SILENCE_EVENT_TYPE = "bidi_audio_silence"
+
+_EVENT_TYPES = {
+    KIND_AUDIO_INPUT: "bidi_audio_input",
+    KIND_AUDIO_STREAM: "bidi_audio_stream",
+    KIND_AUDIO_SILENCE: SILENCE_EVENT_TYPE,
+}
+_EVENT_KINDS = {event_type: kind for kind, event_type in _EVENT_TYPES.items()}
+
+# 音声フォーマット(Strands の AudioFormat に対応)
+_FORMAT_CODES = {"pcm": 0, "wav": 1, "opus": 2, "mp3": 3}
+_FORMAT_NAMES = {code: name for name, code in _FORMAT_CODES.items()}
+
+_HEADER = struct.Struct("!BBBBI")
+HEADER_SIZE = _HEADER.size
+
+_SILENCE_FRAMES = struct.Struct("!I")
+
+# 16bit PCM 1サンプルのバイト数
+_PCM_SAMPLE_WIDTH = 2
+
+
+class FrameError(ValueError):
+    """不正なバイナリフレームを受信した"""
+
+
+def choose_subprotocol(offered: list[str] | tuple[str, ...]) -> str | None:
+    """クライアントが提示したサブプロトコルから使用するものを選ぶ
+
+    クライアントの提示順を優先し、対応していなければ None(従来のJSON)を返す。
+    """
+    for subprotocol in offered:
+        if subprotocol in SUPPORTED_SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def encode_audio_frame(kind: int, audio: bytes, format: str, sample_rate: int, channels: int) -> bytes:
+    """音声データにヘッダを付けてバイナリフレームを作る"""
+    try:
+        format_code = _FORMAT_CODES[format]
+    except KeyError:
+        raise FrameError(f"unsupported audio format: {format}") from None
+    return _HEADER.pack(FRAME_VERSION, kind, format_code, channels, sample_rate) + audio
+
+
+def decode_audio_frame(data: bytes) -> tuple[int, str, int, int, bytes]:
+    """バイナリフレームを (kind, format, sample_rate, channels, audio) に分解する"""
+    if len(data) < HEADER_SIZE:
+        raise FrameError(f"frame too short: {len(data)} bytes")
+    version, kind, format_code, channels, sample_rate = _HEADER.unpack_from(data)
+    if version != FRAME_VERSION:
+        raise FrameError(f"unsupported frame version: {version}")
+    if kind not in _EVENT_TYPES:
+        raise FrameError(f"unknown frame kind: {kind}")
+    if format_code not in _FORMAT_NAMES:
+        raise FrameError(f"unknown audio format code: {format_code}")
+    return kind, _FORMAT_NAMES[format_code], sample_rate, channels, data[HEADER_SIZE:]
+
+
+def encode_silence_frame(frames: int, sample_rate: int, channels: int, format: str = "pcm") -> bytes:
+    """無音区間(フレーム数)を表すバイナリフレームを作る"""
+    return encode_audio_frame(KIND_AUDIO_SILENCE, _SILENCE_FRAMES.pack(frames), format, sample_rate, channels)
+
+
+def silence_event(frames: int, sample_rate: int, channels: int, format: str = "pcm") -> dict:
+    """無音区間(フレーム数)を表すJSONイベントを作る"""
+    return {
+        "type": SILENCE_EVENT_TYPE,
+        "frames": frames,
+        "format": format,
+        "sample_rate": sample_rate,
+        "channels": channels,
+    }
+
+
+@functools.lru_cache(maxsize=32)
+def _silence_base64(size: int) -> str:
+    return base64.b64encode(bytes(size)).decode("ascii")
+
+
+def expand_silence(event: dict) -> dict:
+    """無音区間イベントを同じ長さのゼロPCMの bidi_audio_input に展開する"""
+    if event.get("format", "pcm") != "pcm":
+        raise FrameError(f"silence is only supported for pcm: {event.get('format')}")
+    frames = int(event["frames"])
+    channels = int(event["channels"])
+    return {
+        "type": "bidi_audio_input",
+        "audio": _silence_base64(frames * channels * _PCM_SAMPLE_WIDTH),
+        "format": "pcm",
+        "sample_rate": event["sample_rate"],
+        "channels": channels,
+    }
+
+
+def audio_size(event: dict) -> int:
+    """音声イベントの音声のバイト数(base64 を展開せずに求める)"""
+    audio = event.get("audio", "")
+    return len(audio) * 3 // 4 - audio[-2:].count("=")
+
+
+def pcm_duration(event: dict) -> float:
+    """PCM の音声イベントの長さ(秒)"""
+    return audio_size(event) / (_PCM_SAMPLE_WIDTH * int(event["sample_rate"]) * int(event["channels"]))
+
+
+def frame_to_event(data: bytes) -> dict:
+    """バイナリフレームを Strands の音声イベント(dict, audioはbase64)に変換する"""
+    kind, format, sample_rate, channels, audio = decode_audio_frame(data)
+    if kind == KIND_AUDIO_SILENCE:
+        if len(audio) != _SILENCE_FRAMES.size:
+            raise FrameError(f"invalid silence frame payload: {len(audio)} bytes")
+        (frames,) = _SILENCE_FRAMES.unpack(audio)
+        return silence_event(frames, sample_rate, channels, format)
+    return {
+        "type": _EVENT_TYPES[kind],
+        "audio": base64.b64encode(audio).decode("ascii"),
+        "format": format,
+        "sample_rate": sample_rate,
+        "channels": channels,
+    }
+
+
+def event_to_frame(event: dict) -> bytes:
+    """Strands の音声イベント(dict, audioはbase64)をバイナリフレームに変換する"""
+    try:
+        kind = _EVENT_KINDS[event["type"]]
+    except KeyError:
+        raise FrameError(f"not an audio event: {event.get('type')}") from None
+    return encode_audio_frame(
+        kind,
+        base64.b64decode(event["audio"]),
+        event["format"],
+        event["sample_rate"],
+        event["channels"],
+    )
@@ -0,0 +1,290 @@
+"""
+http_request ツール用の共有HTTPクライアントとレスポンスキャッシュ
+
+strands_tools の http_request はドメインごとに requests.Session を作り、接続数の上限も
+タイムアウトも無いまま使う。ここではプロセスで1つのトランスポートアダプタ(接続プール)を共有し、
+
+- keep-alive の接続プール(ホストごとの接続数の上限 BIDI_HTTP_PER_HOST、超えた分は空きを待つ)
+- タイムアウトの既定値(BIDI_HTTP_TIMEOUT。ツールは指定しないため)
+- GET のレスポンスキャッシュ(TTL + LRU、合計サイズの上限 BIDI_HTTP_CACHE_MB。0 で無効)
+
+を与える。キャッシュは requests のトランスポートアダプタとして実装し、http_request の
+処理(ヘッダの表示、Markdown変換等)はそのまま使う。
+
+キャッシュはレスポンスのヘッダに従う。
+
+- 対象は GET の 200 のみ。Authorization / Cookie 付きのリクエストはキャッシュしない
+- Cache-Control: no-store / no-cache / private、Vary: *、Set-Cookie 付きのレスポンスは保存しない
+- 有効期間は s-maxage > max-age > Expires - Date の順で決め、どれも無ければ
+  BIDI_HTTP_CACHE_DEFAULT_TTL 秒(既定0 = 保存しない)
+- Vary に挙げられたリクエストヘッダはキーに含める
+- リクエストの Cache-Control: no-cache / no-store はキャッシュを使わない
+
+ヒット率等は stats() と telemetry(bidi.http.cache)で確認できる。
+test/http_cache_check.py でローカルのHTTPスタブに対して動作を確認できる。
+"""
+import email.utils
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from types import ModuleType
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3 import Retry
+
+import telemetry
+
+# 接続を保持するホスト数と、ホストごとの接続数の上限
+HTTP_POOL_HOSTS = int(os.environ.get("BIDI_HTTP_POOL_HOSTS", "32"))
+HTTP_PER_HOST = int(os.environ.get("BIDI_HTTP_PER_HOST", "4"))
+
+# タイムアウトの既定値(秒)
+HTTP_TIMEOUT = float(os.environ.get("BIDI_HTTP_TIMEOUT", "10"))
+
+# レスポンスキャッシュの上限(MB, 0で無効)と、ヘッダに有効期間が無い場合のTTL(秒)
+HTTP_CACHE_MB = float(os.environ.get("BIDI_HTTP_CACHE_MB", "16"))
+HTTP_CACHE_DEFAULT_TTL = float(os.environ.get("BIDI_HTTP_CACHE_DEFAULT_TTL", "0"))
+
+# キャッシュしないヘッダ(ホップごとのヘッダ)
+_HOP_HEADERS = frozenset(("connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length"))
+
+
+class _Entry(NamedTuple):
+    expires: float
+    size: int
+    status_code: int
+    reason: str
+    headers: dict
+    content: bytes
+    url: str
+    encoding: str | None
+
+
+def _cache_control(headers) -> dict[str, str | None]:
+    directives = {}
+    for item in headers.get("Cache-Control", "").split(","):
+        name, _, value = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+def _freshness(headers, default_ttl: float) -> float:
+    """レスポンスの有効期間(秒)。0以下なら保存しない"""
+    directives = _cache_control(headers)
+    if {"no-store", "no-cache", "private"} & directives.keys():
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name):
+            try:
+                return float(directives[name]) - float(headers.get("Age", 0) or 0)
+            except ValueError:
+                return 0.0
+    if "Expires" in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["Expires"])
+            date = email.utils.parsedate_to_datetime(headers["Date"]) if "Date" in headers else None
+        except (TypeError, ValueError):
+            return 0.0
+        if expires is None:
+            return 0.0
+        return expires.timestamp() - (date.timestamp() if date else time.time())
+    return default_ttl
+
+
+class ResponseCache:
+    """GET のレスポンスの TTL + LRU キャッシュ(スレッドセーフ)
+
+    Args:
+        max_bytes: 保存するレスポンスの合計サイズの上限
+        default_ttl: ヘッダに有効期間が無い場合のTTL(秒)
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float = HTTP_CACHE_DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        # 1件で全体の1/4を超えるレスポンスは保存しない
+        self.max_entry_bytes = max_bytes // 4
+        self.default_ttl = default_ttl
+        self.size = 0
+        self.counts = Counter()
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        # URL ごとの Vary ヘッダ
+        self._vary: dict[str, tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, request: requests.PreparedRequest) -> tuple | None:
+        if request.method != "GET":
+            return None
+        headers = request.headers
+        if "Authorization" in headers or "Cookie" in headers:
+            return None
+        if {"no-store", "no-cache"} & _cache_control(headers).keys():
+            return None
+        vary = self._vary.get(request.url, ())
+        return (request.url, tuple(headers.get(name, "") for name in vary))
+
+    def get(self, request: requests.PreparedRequest) -> _Entry | None:
+        key = self._key(request)
+        if key is None:
+            self._count("bypass")
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self._count("hit" if entry is not None else "miss")
+        return entry
+
+    def put(self, request: requests.PreparedRequest, response: requests.Response) -> None:
+        if request.method != "GET" or response.status_code != 200:
+            return
+        headers = response.headers
+        if "Set-Cookie" in headers:
+            return
+        vary = tuple(sorted(name.strip() for name in headers.get("Vary", "").split(",") if name.strip()))
+        if "*" in vary:
+            return
+        ttl = _freshness(headers, self.default_ttl)
+        if ttl <= 0:
+            return
+        content = response.content
+        kept_headers = {name: value for name, value in headers.items() if name.lower() not in _HOP_HEADERS}
+        size = len(content) + sum(len(name) + len(value) for name, value in kept_headers.items())
+        if size > self.max_entry_bytes:
+            return
+
+        with self._lock:
+            self._vary[request.url] = vary
+            key = self._key(request)
+            if key is None:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(
+                time.monotonic() + ttl, size, response.status_code, response.reason,
+                kept_headers, content, response.url, response.encoding)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._count("evict")
+        self._count("store")
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def _count(self, result: str) -> None:
+        self.counts[result] += 1
+        telemetry.record_http_cache(result)
+
+    def stats(self) -> dict:
+        lookups = self.counts["hit"] + self.counts["miss"]
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hit_rate": round(self.counts["hit"] / lookups, 3) if lookups else 0.0,
+            **self.counts,
+        }
+
+
+class CachingAdapter(HTTPAdapter):
+    """接続プール + レスポンスキャッシュのトランスポートアダプタ"""
+
+    def __init__(self, cache: ResponseCache | None, timeout: float = HTTP_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.timeout = timeout
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.cache is not None:
+            entry = self.cache.get(request)
+            if entry is not None:
+                return self._cached_response(request, entry)
+        response = super().send(request, stream=stream, timeout=timeout or self.timeout,
+                                verify=verify, cert=cert, proxies=proxies)
+        if self.cache is not None and not stream:
+            self.cache.put(request, response)
+        return response
+
+    def _cached_response(self, request: requests.PreparedRequest, entry: _Entry) -> requests.Response:
+        response = requests.Response()
+        response.status_code = entry.status_code
+        response.reason = entry.reason
+        response.headers = CaseInsensitiveDict(entry.headers)
+        response._content = entry.content
+        response._content_consumed = True
+        response.url = entry.url
+        response.encoding = entry.encoding
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(0)
+        return response
+
+
+class HttpClient:
+    """プロセスで共有するHTTPクライアント
+
+    Args:
+        pool_hosts: 接続を保持するホスト数
+        per_host: ホストごとの接続数の上限(超えたリクエストは空きを待つ)
+        timeout: タイムアウトの既定値(秒)
+        cache_mb: レスポンスキャッシュの上限(MB, 0で無効)
+    """
+
+    def __init__(
+        self,
+        pool_hosts: int = HTTP_POOL_HOSTS,
+        per_host: int = HTTP_PER_HOST,
+        timeout: float = HTTP_TIMEOUT,
+        cache_mb: float = HTTP_CACHE_MB,
+    ):
+        self.cache = ResponseCache(int(cache_mb * 1024 * 1024)) if cache_mb > 0 else None
+        adapter = CachingAdapter(
+            self.cache,
+            timeout=timeout,
+            pool_connections=pool_hosts,
+            pool_maxsize=per_host,
+            pool_block=True,
+            # http_request の既定と同じ再試行
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]),
+        )
+        self.adapter = adapter
+
+    def session(self, config: dict | None = None) -> requests.Session:
+        """共有の接続プールを使う、呼び出しごとの requests.Session
+
+        http_request は取得したセッションに Cookie や max_redirects を設定するため、セッション自体は
+        共有しない(別のセッション・ユーザーの Cookie が混ざらない)。ツール入力の session_config のうち
+
+        - keep_alive: false は接続を使い回さない(Connection: close)
+        - cookie_persistence は常に false と同じ(Cookie は1回の呼び出しの中だけ保持する)
+        - pool_size / max_retries は使わない(共有の接続プールの BIDI_HTTP_* と再試行の設定に従う)
+        """
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        if config and not config.get("keep_alive", True):
+            session.headers["Connection"] = "close"
+        return session
+
+    def install(self, http_request_module: ModuleType) -> None:
+        """strands_tools.http_request がこのクライアントの接続プールを使うようにする
+
+        http_request はリクエストのたびに get_cached_session(url, config) でセッションを取得するため、
+        それを session() に置き換える(ドメインごとのセッションのキャッシュは使わない)。
+        """
+        http_request_module.get_cached_session = lambda url, config: self.session(config)
+
+    def stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {"cache": "disabled"}
+
+    def close(self) -> None:
+        self.adapter.close()
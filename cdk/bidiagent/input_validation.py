@@ -0,0 +1,280 @@
+"""
+クライアントからの入力イベントの検証と正規化
+
+WebSocketBridge(bridge.py)は受信したイベントをエージェントに渡す前にここを通す。
+以前はクライアントが送ったものをそのまま agent.run() に渡していた。
+必須フィールドが欠けた bidi_audio_input や未知のイベント種別は、モデルのストリームの奥で初めて例外になり、セッションごと終了していた。
+形式の違う音声（48kHz ステレオ等）は、そのままモデルに渡ってエラーにならずに音声が壊れていた。
+Nova Sonic は接続時に決めた入力形式（16kHz モノラル）で解釈する。
+
+検証（安いものから順に、失敗したらその場で拒否する）:
+
+- メッセージの大きさ（BIDI_INPUT_MAX_EVENT_BYTES、JSON をデコードする前）
+- イベントの形式（JSON オブジェクトであること、既知の type、フィールドの型・値）
+- 音声の長さ（1イベント BIDI_INPUT_MAX_AUDIO_MS、無音マーカーは BIDI_INPUT_MAX_SILENCE_MS）
+- サンプル形式（pcm / opus、対応するサンプリングレート・チャンネル数、PCM がフレーム境界で終わっていること、base64）
+- Opus は libopus が扱えるサンプリングレートだけを受け付け、復号できないペイロードも拒否する。長さは復号後に確認する
+- テキストの長さ（BIDI_INPUT_MAX_TEXT_CHARS）
+
+拒否したイベントはエージェントに渡さず、クライアントに bidi_error（code: InvalidInput）を返す。
+1セッションで BIDI_INPUT_MAX_REJECTIONS 回拒否したら close code 1008 で閉じる。
+
+正規化:
+
+- 既知のフィールドだけを残す（Strands のイベントは未知の引数で例外になる）
+- モデルの入力形式と違うサンプリングレート・チャンネル数の PCM は、resample.py でモデルの形式に変換する
+  （チャンクをまたいで状態を持つ。変換はワーカースレッドで行う、要numpy。NumPy がなければ拒否する）
+- 無音マーカーはモデルの形式のゼロPCMに直接展開する
+
+イベントの種類ごとに検証・正規化にかかった時間を telemetry に記録する（bidi.input.validation）。
+"""
+import base64
+import binascii
+import os
+import time
+
+import codec
+import framing
+from resample import NUMPY_AVAILABLE, AudioConverter
+from telemetry import SessionTelemetry
+
+# 1メッセージの大きさの上限(バイト、JSON / バイナリフレームとも)
+MAX_EVENT_BYTES = int(os.environ.get("BIDI_INPUT_MAX_EVENT_BYTES", str(512 * 1024)))
+
+# 1イベントの音声の長さの上限(ms)
+MAX_AUDIO_MS = int(os.environ.get("BIDI_INPUT_MAX_AUDIO_MS", "2000"))
+
+# 無音マーカー1つの長さの上限(ms)。展開するゼロPCMの大きさを抑える
+MAX_SILENCE_MS = int(os.environ.get("BIDI_INPUT_MAX_SILENCE_MS", "10000"))
+
+# bidi_text_input の文字数の上限
+MAX_TEXT_CHARS = int(os.environ.get("BIDI_INPUT_MAX_TEXT_CHARS", "4000"))
+
+# 1セッションでこの回数拒否したら接続を閉じる(0 なら閉じない)
+MAX_REJECTIONS = int(os.environ.get("BIDI_INPUT_MAX_REJECTIONS", "50"))
+
+# 拒否が続いたときの close code(ポリシー違反)
+REJECT_CLOSE_CODE = 1008
+
+# 受け付ける音声の形式
+AUDIO_FORMATS = frozenset(("pcm", "opus"))
+SAMPLE_RATES = frozenset((8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000))
+# libopus が扱えるサンプリングレート
+OPUS_SAMPLE_RATES = frozenset((8000, 12000, 16000, 24000, 48000))
+CHANNELS = frozenset((1, 2))
+IMAGE_MIME_TYPES = frozenset(("image/jpeg", "image/png", "image/gif", "image/webp"))
+
+AUDIO_INPUT = "bidi_audio_input"
+TEXT_INPUT = "bidi_text_input"
+IMAGE_INPUT = "bidi_image_input"
+
+_PCM_SAMPLE_WIDTH = 2
+
+
+class InputError(ValueError):
+    """受け付けない入力イベント
+
+    Attributes:
+        reason: 拒否した理由(メトリクスの属性: too_large / malformed / unknown_type / invalid_field /
+            unsupported_format / too_long)
+        event_type: イベントの種類(分からなければ "unknown")
+    """
+
+    def __init__(self, reason: str, message: str, event_type: str = "unknown"):
+        super().__init__(message)
+        self.reason = reason
+        self.event_type = event_type
+
+
+def check_size(size: int) -> None:
+    """デコードする前にメッセージの大きさを確認する"""
+    if size > MAX_EVENT_BYTES:
+        raise InputError("too_large", f"message is {size} bytes (max {MAX_EVENT_BYTES})")
+
+
+def error_event(error: InputError) -> dict:
+    """クライアントに返す bidi_error"""
+    return {"type": "bidi_error", "message": f"{error.event_type}: {error}", "code": "InvalidInput"}
+
+
+def _check_duration(size: int, sample_rate: int, channels: int) -> None:
+    """PCM の長さ(バイト数)を確認する"""
+    if size % (_PCM_SAMPLE_WIDTH * channels):
+        raise InputError("invalid_field", f"pcm audio of {size} bytes is not a whole number of frames", AUDIO_INPUT)
+    duration_ms = size * 1000 / (_PCM_SAMPLE_WIDTH * channels * sample_rate)
+    if duration_ms > MAX_AUDIO_MS:
+        raise InputError("too_long", f"audio is {duration_ms:.0f} ms (max {MAX_AUDIO_MS})", AUDIO_INPUT)
+
+
+def _int_field(event: dict, name: str, allowed: frozenset[int], event_type: str) -> int:
+    value = event.get(name)
+    # bool は int のサブクラスなので除く
+    if type(value) is not int:
+        raise InputError("invalid_field", f"{name} must be an integer", event_type)
+    if value not in allowed:
+        raise InputError("unsupported_format", f"unsupported {name}: {value}", event_type)
+    return value
+
+
+def _str_field(event: dict, name: str, event_type: str) -> str:
+    value = event.get(name)
+    if not isinstance(value, str):
+        raise InputError("invalid_field", f"{name} must be a string", event_type)
+    return value
+
+
+class InputValidator:
+    """1セッション分の入力の検証と正規化
+
+    Args:
+        input_rate: モデルの入力のサンプリングレート
+        channels: モデルの入力のチャンネル数
+        telemetry: 検証時間・拒否数の記録先(Noneなら記録しない)
+    """
+
+    def __init__(self, input_rate: int = 16000, channels: int = 1, telemetry: SessionTelemetry | None = None):
+        self.input_rate = input_rate
+        self.channels = channels
+        self._telemetry = telemetry
+        # (sample_rate, channels) ごとの変換(チャンクをまたいで状態を持つ)
+        self._converters: dict[tuple[int, int], AudioConverter] = {}
+        self.rejected = 0
+        self.normalized = 0
+
+    def check(self, event) -> dict:
+        """イベントの形式を検証し、既知のフィールドだけのイベントを返す(音声の変換はしない)
+
+        Raises:
+            InputError: 受け付けないイベント
+        """
+        if not isinstance(event, dict):
+            raise InputError("malformed", "event must be a JSON object")
+        event_type = event.get("type")
+        if event_type == AUDIO_INPUT:
+            return self._check_audio(event, trusted=False)
+        if event_type == framing.SILENCE_EVENT_TYPE:
+            return self._check_silence(event)
+        if event_type == TEXT_INPUT:
+            return self._check_text(event)
+        if event_type == IMAGE_INPUT:
+            return self._check_image(event)
+        raise InputError("unknown_type", f"unsupported event type: {event_type!r}",
+                         event_type if isinstance(event_type, str) else "unknown")
+
+    def check_frame(self, event: dict) -> dict:
+        """バイナリフレームから作ったイベントを検証する(フィールドの型と base64 は正しいので値だけ見る)"""
+        if event["type"] == framing.SILENCE_EVENT_TYPE:
+            return self._check_silence(event)
+        return self._check_audio(event, trusted=True)
+
+    def check_decoded(self, event: dict) -> None:
+        """Opus を復号した PCM の長さを確認する(復号前は長さが分からないため)"""
+        _check_duration(framing.audio_size(event), event["sample_rate"], event["channels"])
+
+    async def normalize(self, event: dict) -> dict:
+        """検証済みのイベントをモデルに渡す形にする(無音マーカーの展開・音声の形式の変換)"""
+        event_type = event["type"]
+        if event_type == framing.SILENCE_EVENT_TYPE:
+            return self._expand_silence(event)
+        if event_type != AUDIO_INPUT:
+            return event
+        key = (event["sample_rate"], event["channels"])
+        if key == (self.input_rate, self.channels):
+            return event
+        converter = self._converters.get(key)
+        if converter is None:
+            converter = self._converters[key] = AudioConverter(*key, self.input_rate, self.channels)
+            print(f"[Input] Converting client audio ({converter})")
+        pcm = await codec.run_in_worker(converter.convert, base64.b64decode(event["audio"]))
+        self.normalized += 1
+        return {
+            "type": AUDIO_INPUT,
+            "audio": base64.b64encode(pcm).decode("ascii"),
+            "format": "pcm",
+            "sample_rate": self.input_rate,
+            "channels": self.channels,
+        }
+
+    def record(self, event_type: str, started: float) -> None:
+        """started(time.perf_counter())からの検証・正規化の時間を記録する"""
+        if self._telemetry:
+            self._telemetry.record_validation(event_type, (time.perf_counter() - started) * 1000)
+
+    def reject(self, error: InputError) -> bool:
+        """拒否を記録する。接続を閉じるべきなら True"""
+        self.rejected += 1
+        if self._telemetry:
+            self._telemetry.record_rejected(error.event_type, error.reason)
+        print(f"[Input] Rejected {error.event_type} ({error.reason}): {error}")
+        return MAX_REJECTIONS > 0 and self.rejected >= MAX_REJECTIONS
+
+    def stats(self) -> dict:
+        return {"rejected": self.rejected, "normalized": self.normalized}
+
+    # --- 種類ごとの検証 --------------------------------------------------
+
+    def _check_audio(self, event: dict, trusted: bool) -> dict:
+        audio_format = event.get("format")
+        if audio_format not in AUDIO_FORMATS:
+            raise InputError("unsupported_format", f"unsupported format: {audio_format!r}", AUDIO_INPUT)
+        sample_rate = _int_field(event, "sample_rate", SAMPLE_RATES, AUDIO_INPUT)
+        channels = _int_field(event, "channels", CHANNELS, AUDIO_INPUT)
+        audio = event["audio"] if trusted else _str_field(event, "audio", AUDIO_INPUT)
+        if audio_format == "pcm":
+            _check_duration(framing.audio_size(event), sample_rate, channels)
+        elif not codec.OPUS_AVAILABLE:
+            raise InputError("unsupported_format", "opus is not available on this server", AUDIO_INPUT)
+        elif sample_rate not in OPUS_SAMPLE_RATES:
+            raise InputError("invalid_field", f"sample_rate {sample_rate} is not supported for opus", AUDIO_INPUT)
+        if (sample_rate, channels) != (self.input_rate, self.channels) and not NUMPY_AVAILABLE:
+            raise InputError("unsupported_format",
+                             f"expected {self.input_rate} Hz x{self.channels} audio", AUDIO_INPUT)
+        if not trusted:
+            try:
+                # 長さの確認の後で、文字の妥当性を見る(モデルには base64 のまま渡す)
+                binascii.a2b_base64(audio, strict_mode=True)
+            except (binascii.Error, ValueError):
+                raise InputError("invalid_field", "audio is not valid base64", AUDIO_INPUT) from None
+        return {"type": AUDIO_INPUT, "audio": audio, "format": audio_format,
+                "sample_rate": sample_rate, "channels": channels}
+
+    def _check_silence(self, event: dict) -> dict:
+        event_type = framing.SILENCE_EVENT_TYPE
+        if event.get("format", "pcm") != "pcm":
+            raise InputError("unsupported_format", "silence is only supported for pcm", event_type)
+        sample_rate = _int_field(event, "sample_rate", SAMPLE_RATES, event_type)
+        channels = _int_field(event, "channels", CHANNELS, event_type)
+        frames = event.get("frames")
+        if type(frames) is not int or frames < 0:
+            raise InputError("invalid_field", "frames must be a non-negative integer", event_type)
+        if frames * 1000 > MAX_SILENCE_MS * sample_rate:
+            raise InputError("too_long", f"silence is {frames * 1000 // sample_rate} ms (max {MAX_SILENCE_MS})",
+                             event_type)
+        return {"type": event_type, "frames": frames, "format": "pcm",
+                "sample_rate": sample_rate, "channels": channels}
+
+    def _check_text(self, event: dict) -> dict:
+        text = _str_field(event, "text", TEXT_INPUT)
+        if not text.strip():
+            raise InputError("invalid_field", "text is empty", TEXT_INPUT)
+        if len(text) > MAX_TEXT_CHARS:
+            raise InputError("too_long", f"text is {len(text)} characters (max {MAX_TEXT_CHARS})", TEXT_INPUT)
+        role = event.get("role", "user")
+        if role != "user":
+            raise InputError("invalid_field", f"role must be 'user': {role!r}", TEXT_INPUT)
+        return {"type": TEXT_INPUT, "text": text, "role": role}
+
+    def _check_image(self, event: dict) -> dict:
+        image = _str_field(event, "image", IMAGE_INPUT)
+        mime_type = event.get("mime_type")
+        if mime_type not in IMAGE_MIME_TYPES:
+            raise InputError("unsupported_format", f"unsupported mime_type: {mime_type!r}", IMAGE_INPUT)
+        return {"type": IMAGE_INPUT, "image": image, "mime_type": mime_type}
+
+    def _expand_silence(self, event: dict) -> dict:
+        """無音マーカーをモデルの形式のゼロPCMに展開する"""
+        frames = event["frames"]
+        if event["sample_rate"] != self.input_rate:
+            frames = round(frames * self.input_rate / event["sample_rate"])
+        return framing.expand_silence({**event, "frames": frames, "sample_rate": self.input_rate,
+                                       "channels": self.channels})
@@ -0,0 +1,111 @@
+"""
+JSONイベントのエンコード/デコード
+
+WebSocket 上の JSON イベント(テキストフレーム)の大半は base64 の音声を含む
+bidi_audio_input / bidi_audio_stream で、標準の json はその長い文字列を毎回走査・エスケープする。
+ここでは次の2つで1イベントあたりのコストを下げる。
+
+- 音声イベントはテンプレートで組み立て・分解する。type / format / sample_rate / channels の
+  組み合わせごとに前半部分を1度だけ作り、base64(エスケープ不要なASCII)を連結するだけにする。
+
+      {"type":"bidi_audio_stream","format":"pcm","sample_rate":16000,"channels":1,"audio":"<base64>"}
+
+- それ以外のイベントは orjson があれば orjson で、無ければ標準の json で処理する。
+
+バックエンドは環境変数 BIDI_JSON_CODEC("auto" / "orjson" / "json")で選ぶ。
+bench_json_codec.py(test/)で変更前後の1イベントあたりのコストを比較できる。
+
+このモジュールは test/ 配下のクライアントからも読み込まれる。
+"""
+import json
+import os
+from functools import lru_cache
+
+# orjsonのインポート（高速なJSON、オプション）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 使用するバックエンド("auto" は orjson があれば orjson)
+BACKEND = os.environ.get("BIDI_JSON_CODEC", "auto")
+
+# テンプレートで扱う音声イベント
+_AUDIO_EVENT_TYPES = ("bidi_audio_input", "bidi_audio_stream")
+_AUDIO_KEYS = frozenset(("type", "audio", "format", "sample_rate", "channels"))
+
+_AUDIO_PREFIX = '{"type":"bidi_audio_'
+_AUDIO_FIELD = '"audio":"'
+_AUDIO_SUFFIX = '"}'
+
+
+@lru_cache(maxsize=64)
+def _audio_template(event_type: str, format: str, sample_rate: int, channels: int) -> str:
+    """音声イベントの "audio" より前の部分"""
+    header = json.dumps(
+        {"type": event_type, "format": format, "sample_rate": sample_rate, "channels": channels},
+        separators=(",", ":"),
+    )
+    return header[:-1] + "," + _AUDIO_FIELD
+
+
+@lru_cache(maxsize=64)
+def _parse_audio_header(header: str) -> dict:
+    """テンプレートの前半部分を固定フィールドの dict に戻す"""
+    return json.loads(header[:-len(_AUDIO_FIELD) - 1] + "}")
+
+
+class JsonCodec:
+    """JSONイベントのエンコーダ/デコーダ
+
+    Args:
+        backend: "auto"(orjson があれば orjson)/ "orjson" / "json"
+    """
+
+    def __init__(self, backend: str = BACKEND):
+        if backend == "auto":
+            backend = "orjson" if ORJSON_AVAILABLE else "json"
+        if backend == "orjson" and not ORJSON_AVAILABLE:
+            raise RuntimeError("orjson is not installed (pip install orjson)")
+        if backend not in ("orjson", "json"):
+            raise ValueError(f"Unknown JSON codec backend: {backend}")
+        self.backend = backend
+
+    def encode(self, event: dict) -> str:
+        """イベントをJSONテキストにする(音声イベントはテンプレートを使う)"""
+        if event.get("type") in _AUDIO_EVENT_TYPES and event.keys() == _AUDIO_KEYS:
+            return self.encode_audio(
+                event["type"], event["audio"], event["format"], event["sample_rate"], event["channels"])
+        if self.backend == "orjson":
+            try:
+                return orjson.dumps(event).decode("utf-8")
+            except orjson.JSONEncodeError:
+                # orjson が扱えない値(64bitを超える整数等)は標準の json に任せる
+                pass
+        return json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+
+    def encode_audio(self, event_type: str, audio: str, format: str, sample_rate: int, channels: int) -> str:
+        """音声イベント(audio は base64)をテンプレートからJSONテキストにする"""
+        return _audio_template(event_type, format, sample_rate, channels) + audio + _AUDIO_SUFFIX
+
+    def decode(self, text: str | bytes) -> dict:
+        """JSONテキストをイベントにする(encode_audio の形式の音声イベントはテンプレートで分解する)"""
+        if isinstance(text, str) and text.startswith(_AUDIO_PREFIX) and text.endswith(_AUDIO_SUFFIX):
+            index = text.find(_AUDIO_FIELD)
+            audio = text[index + len(_AUDIO_FIELD):-len(_AUDIO_SUFFIX)]
+            # base64 に '"' と '\\' は現れないため、含まれていればテンプレートの形式ではない
+            if index > 0 and '"' not in audio and "\\" not in audio:
+                return {**_parse_audio_header(text[:index + len(_AUDIO_FIELD)]), "audio": audio}
+        if self.backend == "orjson":
+            return orjson.loads(text)
+        return json.loads(text)
+
+
+def utf8_length(text: str) -> int:
+    """UTF-8 でのバイト数(ASCII のみなら encode しない)"""
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+# プロセス共通のコーデック
+default_codec = JsonCodec()
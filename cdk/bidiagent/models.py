@@ -0,0 +1,35 @@
+"""
+モデルの選択
+
+環境変数 BIDI_MODEL でサーバーが使うモデルを切り替える。
+
+    nova  Nova Sonic(既定、Bedrock に接続する)
+    fake  オフライン用のフェイクモデル(fake_model.py)。ベンチマーク・負荷試験用
+
+main.py / agent.py / test/simple_ws_server.py から共通で使う。
+"""
+import os
+
+MODEL_ID = "amazon.nova-2-sonic-v1:0"
+
+# 使用するモデル("nova" / "fake")
+BIDI_MODEL = os.environ.get("BIDI_MODEL", "nova")
+
+
+def create_model(voice: str = "tiffany"):
+    """BIDI_MODEL に応じたモデルを生成する
+
+    Args:
+        voice: Nova Sonic の音声(利用可能: "tiffany", "matthew", "ruth")
+    """
+    provider_config = {"audio": {"voice": voice}}
+
+    if BIDI_MODEL == "fake":
+        from fake_model import FakeBidiModel
+        return FakeBidiModel(provider_config=provider_config)
+    if BIDI_MODEL != "nova":
+        raise ValueError(f"Unknown BIDI_MODEL: {BIDI_MODEL} (expected 'nova' or 'fake')")
+
+    # Note: Nova Sonicはus-east-1, us-west-2, ap-northeast-1等で利用可能
+    from strands.experimental.bidi.models.nova_sonic import BidiNovaSonicModel
+    return BidiNovaSonicModel(model_id=MODEL_ID, provider_config=provider_config)
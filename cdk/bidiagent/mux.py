@@ -0,0 +1,103 @@
+"""
+多重化WebSocketプロトコル(bidi.mux.v1)
+
+通常は1つの WebSocket 接続が1つの BidiAgent セッションに対応し、通話ごとに
+SigV4 署名付きURLの生成と WebSocket のハンドシェイクが必要になる。サブプロトコル
+bidi.mux.v1 をネゴシエーションした接続では、1つの接続の上で複数の独立したセッション
+(ストリーム)を開閉できる。
+
+テキストフレームはすべて "stream"(クライアントが決める正の整数)を持つJSONオブジェクト。
+ストリーム内のイベントは通常の接続と同じ(bidi_audio_input / bidi_text_input / bridge_config、
+bidi_audio_stream / bidi_transcript_stream ...)。加えて、ストリームの制御に次のメッセージを使う。
+
+    クライアント → サーバー
+        {"type": "mux_open", "stream": 1, "binary": true, "transcripts": "final", ...}
+            ストリームを開く。binary=true(既定)なら音声をバイナリフレームで送受信する。
+            events / transcripts / usage は通常の接続のクエリパラメータと同じ(event_filter.py)
+        {"type": "mux_close", "stream": 1}
+            ストリームを閉じる(サーバーのセッションを終了する)
+
+    サーバー → クライアント
+        {"type": "mux_opened", "stream": 1, "subprotocol": "bidi.binary.v1"}
+        {"type": "mux_closed", "stream": 1, "code": 1000, "reason": "..."}
+            セッションの終了。受け入れられなかった場合は code=1013(admission.py)等
+
+    双方向(フロー制御)
+        {"type": "mux_pause", "stream": 1} / {"type": "mux_resume", "stream": 1}
+            受信側が処理しきれないとき、そのストリームの送信を止めてもらう。
+            他のストリームは止まらない
+
+バイナリフレームは、ストリームID(uint32, ネットワークバイトオーダー)の後に
+framing.py のフレームを続けたもの。
+
+    stream (uint32) | version | kind | format | channels | sample_rate | payload
+
+大きさの上限(input_validation.py の BIDI_INPUT_MAX_EVENT_BYTES)を超えるテキストフレームは
+JSON をデコードせずに断る。"stream" がメッセージの先頭にあれば(tag_json の形)、そのストリームに
+bidi_error を返す。
+
+このモジュールは標準ライブラリのみに依存し、test/ 配下のクライアントからも読み込まれる。
+"""
+import re
+import struct
+
+SUBPROTOCOL_MUX = "bidi.mux.v1"
+
+# ストリームの制御メッセージ
+MUX_OPEN = "mux_open"
+MUX_OPENED = "mux_opened"
+MUX_CLOSE = "mux_close"
+MUX_CLOSED = "mux_closed"
+MUX_PAUSE = "mux_pause"
+MUX_RESUME = "mux_resume"
+
+CONTROL_TYPES = frozenset((MUX_OPEN, MUX_OPENED, MUX_CLOSE, MUX_CLOSED, MUX_PAUSE, MUX_RESUME))
+
+# mux_open のうちセッションの設定として渡す項目(event_filter.py)
+STREAM_OPTIONS = ("events", "transcripts", "usage")
+
+_STREAM_ID = struct.Struct("!I")
+STREAM_HEADER_SIZE = _STREAM_ID.size
+MAX_STREAM_ID = 2**32 - 1
+
+# tag_json の形のメッセージの先頭の "stream"
+_LEADING_STREAM = re.compile(r'\{\s*"stream"\s*:\s*(\d{1,10})\s*[,}]')
+
+
+class MuxError(ValueError):
+    """多重化プロトコルに合わないメッセージを受信した"""
+
+
+def stream_id(value) -> int:
+    """メッセージの stream を検証する"""
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= MAX_STREAM_ID:
+        raise MuxError(f"Invalid stream id: {value!r}")
+    return value
+
+
+def encode_stream_frame(stream: int, frame: bytes) -> bytes:
+    """framing.py のフレームにストリームIDを付ける"""
+    return _STREAM_ID.pack(stream) + frame
+
+
+def decode_stream_frame(data: bytes) -> tuple[int, bytes]:
+    """ストリームIDと framing.py のフレームに分ける"""
+    if len(data) <= STREAM_HEADER_SIZE:
+        raise MuxError(f"Frame too short: {len(data)} bytes")
+    return stream_id(_STREAM_ID.unpack_from(data)[0]), data[STREAM_HEADER_SIZE:]
+
+
+def peek_stream_id(text: str) -> int | None:
+    """メッセージ全体をデコードせずに、先頭の "stream" を読む(無ければ None)"""
+    match = _LEADING_STREAM.match(text, 0, 64)
+    if match is None:
+        return None
+    value = int(match.group(1))
+    return value if 0 < value <= MAX_STREAM_ID else None
+
+
+def tag_json(stream: int, text: str) -> str:
+    """シリアライズ済みのJSONオブジェクトに "stream" を加える(再シリアライズしない)"""
+    if text == "{}":
+        return f'{{"stream":{stream}}}'
+    return f'{{"stream":{stream},{text[1:]}'
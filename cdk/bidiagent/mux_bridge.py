@@ -0,0 +1,287 @@
+"""
+多重化接続(mux.py)のサーバー側
+
+MuxConnection は bidi.mux.v1 の WebSocket 接続を1つ受け持ち、受信したフレームを
+ストリームごとに振り分ける。ストリームは MuxStreamSocket として見え、
+Starlette の WebSocket と同じメソッド(accept / receive / send_text / send_bytes / close)を持つため、
+通常の接続と同じ WebSocketBridge・OutputChannel・セッション処理(agent.py)をそのまま使える。
+
+フロー制御:
+
+- 下り: クライアントが mux_pause を送ったストリームは送信を止める。そのストリームの出力キュー
+  (output_channel.py)に溜まり、キューが上限に達するとそのストリームのエージェントだけが待つ
+- 上り: ストリームの受信キューが BIDI_MUX_INBOX_HIGH を超えたらクライアントに mux_pause を送り、
+  1/4 まで減ったら mux_resume を送る。それでも送られ続けて2倍を超えた音声は捨てる
+  (接続全体の受信を止めないため)
+
+1接続あたりのストリーム数の上限は BIDI_MUX_MAX_STREAMS。
+
+大きさの上限を超えるテキストフレームはデコードせず、ストリームが分かればそのストリームに
+大きさだけを渡す(WebSocketBridge が bidi_error を返し、拒否として数える)。
+"""
+import asyncio
+import os
+from collections import Counter
+from typing import Awaitable, Callable
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import framing
+import mux
+from input_validation import InputError, check_size
+from json_codec import JsonCodec, default_codec, utf8_length
+
+# 1接続あたりのストリーム数の上限
+MUX_MAX_STREAMS = int(os.environ.get("BIDI_MUX_MAX_STREAMS", "32"))
+
+# ストリームの受信キューで mux_pause を送るイベント数
+MUX_INBOX_HIGH = int(os.environ.get("BIDI_MUX_INBOX_HIGH", "200"))
+
+_AUDIO_INPUT_TYPES = frozenset(("bidi_audio_input", framing.SILENCE_EVENT_TYPE))
+
+
+class MuxStreamSocket:
+    """多重化接続の1ストリーム(WebSocketBridge から見た WebSocket)
+
+    Args:
+        connection: ストリームが属する接続
+        stream: ストリームID
+        options: mux_open の内容(binary と、イベントの選択 events / transcripts / usage)
+    """
+
+    def __init__(self, connection: "MuxConnection", stream: int, options: dict):
+        self._connection = connection
+        self.stream = stream
+        binary = options.get("binary", True) is not False
+        # WebSocketBridge / agent.py はここからサブプロトコル(音声をバイナリで送るか)を選ぶ
+        self.scope = {"subprotocols": [framing.SUBPROTOCOL_BINARY] if binary else []}
+        self.query_params = {name: options[name] for name in mux.STREAM_OPTIONS if name in options}
+        self._inbox: asyncio.Queue[dict] = asyncio.Queue()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._paused_client = False
+        self.closed = False
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        await self._connection.send_control(mux.MUX_OPENED, self.stream, subprotocol=subprotocol)
+
+    async def receive(self) -> dict:
+        message = await self._inbox.get()
+        if self._paused_client and self._inbox.qsize() <= self._connection.inbox_high // 4:
+            self._paused_client = False
+            # mux_pause と同じ経路で送り、順序を入れ替えない
+            self._connection.send_control_soon(mux.MUX_RESUME, self.stream)
+        return message
+
+    async def send_text(self, text: str) -> None:
+        await self._writable.wait()
+        await self._connection.send_text(mux.tag_json(self.stream, text))
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self._writable.wait()
+        await self._connection.send_bytes(mux.encode_stream_frame(self.stream, data))
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._connection.release(self.stream)
+        await self._connection.send_control(mux.MUX_CLOSED, self.stream, code=code, reason=reason or "")
+
+    # --- MuxConnection から呼ばれる ------------------------------------------
+
+    def deliver(self, message: dict, audio: bool) -> bool:
+        """受信したメッセージを受信キューに入れる(捨てた場合は False)"""
+        depth = self._inbox.qsize()
+        high = self._connection.inbox_high
+        if audio and depth >= high * 2:
+            return False
+        self._inbox.put_nowait(message)
+        if depth + 1 >= high and not self._paused_client:
+            self._paused_client = True
+            self._connection.send_control_soon(mux.MUX_PAUSE, self.stream)
+        return True
+
+    def disconnect(self, code: int = 1000) -> None:
+        """ストリーム(または接続)が閉じられた。セッション側には切断として見える"""
+        self._writable.set()
+        self._inbox.put_nowait({"type": "websocket.disconnect", "code": code})
+
+    def set_paused(self, paused: bool) -> None:
+        if paused:
+            self._writable.clear()
+        else:
+            self._writable.set()
+
+
+class MuxConnection:
+    """多重化された1つの WebSocket 接続(accept 済み)
+
+    Args:
+        websocket: bidi.mux.v1 で accept した WebSocket
+        run_stream: 開かれたストリームのセッションを実行する関数(終了までを担当する)
+        max_streams: 同時に開けるストリーム数
+        inbox_high: ストリームの受信キューで mux_pause を送るイベント数
+        json_codec: JSONイベントのエンコーダ/デコーダ(Noneならプロセス共通のもの)
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        run_stream: Callable[[MuxStreamSocket], Awaitable[None]],
+        max_streams: int = MUX_MAX_STREAMS,
+        inbox_high: int = MUX_INBOX_HIGH,
+        json_codec: JsonCodec | None = None,
+    ):
+        self._websocket = websocket
+        self._run_stream = run_stream
+        self.max_streams = max_streams
+        self.inbox_high = inbox_high
+        self._json = json_codec or default_codec
+        self._streams: dict[int, MuxStreamSocket] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # 複数のストリームの送信が1つのフレームの途中で混ざらないようにする
+        self._send_lock = asyncio.Lock()
+        self._closed = False
+        self.counts = Counter()
+
+    async def run(self) -> None:
+        """接続が閉じるまでフレームを受信してストリームに振り分ける"""
+        try:
+            while True:
+                message = await self._websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                try:
+                    if message.get("bytes") is not None:
+                        self._on_frame(message["bytes"])
+                    else:
+                        await self._on_text(message["text"])
+                except (mux.MuxError, framing.FrameError, ValueError) as e:
+                    self.counts["errors"] += 1
+                    print(f"[Mux] Invalid message: {e}")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # 接続が切れたら全ストリームのセッションを終わらせる
+            self._closed = True
+            for stream in list(self._streams.values()):
+                stream.disconnect(1001)
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            print(f"[Mux] Connection closed: {self.stats()}")
+
+    async def send_text(self, text: str) -> None:
+        if self._closed:
+            raise WebSocketDisconnect(1001)
+        async with self._send_lock:
+            await self._websocket.send_text(text)
+
+    async def send_bytes(self, data: bytes) -> None:
+        if self._closed:
+            raise WebSocketDisconnect(1001)
+        async with self._send_lock:
+            await self._websocket.send_bytes(data)
+
+    async def send_control(self, message_type: str, stream: int, **fields) -> None:
+        if self._closed:
+            return
+        try:
+            await self.send_text(self._json.encode({"type": message_type, "stream": stream, **fields}))
+        except Exception:
+            # 制御メッセージは接続が閉じかけていれば送れなくてよい
+            pass
+
+    def send_control_soon(self, message_type: str, stream: int) -> None:
+        """受信ループを止めずに制御メッセージを送る"""
+        self.counts[message_type] += 1
+        self._spawn(self.send_control(message_type, stream))
+
+    def release(self, stream: int) -> None:
+        """ストリームのセッションが終了した"""
+        self._streams.pop(stream, None)
+
+    def stats(self) -> dict:
+        return {"open_streams": len(self._streams), **self.counts}
+
+    # --- 受信 ----------------------------------------------------------------
+
+    def _on_frame(self, data: bytes) -> None:
+        stream_id, frame = mux.decode_stream_frame(data)
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            self.counts["unknown_stream"] += 1
+            return
+        message = {"type": "websocket.receive", "bytes": frame}
+        if not stream.deliver(message, audio=True):
+            self.counts["dropped_audio"] += 1
+
+    async def _on_text(self, text: str) -> None:
+        size = utf8_length(text)
+        try:
+            # デコードする前に大きさで断る
+            check_size(size)
+        except InputError as error:
+            self._on_oversized(text, size, error)
+            return
+        event = self._json.decode(text)
+        if not isinstance(event, dict):
+            raise mux.MuxError("Message is not a JSON object")
+        stream_id = mux.stream_id(event.pop("stream", None))
+        event_type = event.get("type")
+
+        if event_type == mux.MUX_OPEN:
+            await self._open(stream_id, event)
+            return
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            self.counts["unknown_stream"] += 1
+            return
+        if event_type == mux.MUX_CLOSE:
+            stream.disconnect(1000)
+        elif event_type == mux.MUX_PAUSE:
+            stream.set_paused(True)
+        elif event_type == mux.MUX_RESUME:
+            stream.set_paused(False)
+        else:
+            # 解釈済みのイベントを渡す(bridge.py で再度デコードしない)
+            message = {"type": "websocket.receive", "event": event, "size": size}
+            if not stream.deliver(message, audio=event_type in _AUDIO_INPUT_TYPES):
+                self.counts["dropped_audio"] += 1
+
+    def _on_oversized(self, text: str, size: int, error: InputError) -> None:
+        """上限を超えたテキストフレーム: ストリームが分かれば、大きさだけをそのストリームに渡す"""
+        self.counts["too_large"] += 1
+        stream = self._streams.get(mux.peek_stream_id(text))
+        if stream is None:
+            print(f"[Mux] Invalid message: {error}")
+            return
+        # イベントは渡さない(WebSocketBridge が size で拒否し、bidi_error を返す)
+        stream.deliver({"type": "websocket.receive", "event": None, "size": size}, audio=False)
+
+    async def _open(self, stream_id: int, options: dict) -> None:
+        if stream_id in self._streams:
+            self.counts["rejected"] += 1
+            await self.send_control(mux.MUX_CLOSED, stream_id, code=1008, reason="stream already open")
+            return
+        if len(self._streams) >= self.max_streams:
+            self.counts["rejected"] += 1
+            await self.send_control(mux.MUX_CLOSED, stream_id, code=1013, reason="too many streams")
+            return
+        stream = self._streams[stream_id] = MuxStreamSocket(self, stream_id, options)
+        self.counts["opened"] += 1
+        self._spawn(self._run(stream))
+
+    async def _run(self, stream: MuxStreamSocket) -> None:
+        try:
+            await self._run_stream(stream)
+        except Exception as e:
+            print(f"[Mux] Stream {stream.stream} failed: {e}")
+        finally:
+            # セッション側で閉じていなければここで mux_closed を送る
+            await stream.close(1011 if not stream.closed else 1000)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,254 @@
+"""
+サーバーの出力キュー
+
+agent.run / run_session の outputs に bridge.send を直接渡すと、クライアントへの送信を
+1イベントずつ待つため、遅い回線の1クライアントがエージェントのループ全体を止めてしまう。
+また、ユーザーが割り込んだ時点で生成済みの音声も送られ続け、クライアント側で捨てることになる。
+
+OutputChannel は outputs に渡す put() と、別タスクで送信する部分に分け、その間を上限付きの
+キューでつなぐ。
+
+- 割り込み(bidi_interruption / stop_reason="interrupted" の bidi_response_complete)を受け取ると、
+  キューに残っている bidi_audio_stream をその場で捨てる(もう再生されない音声を送らない)
+- キューが上限(max_events)に達したときの音声の扱いは policy で選ぶ
+
+      block        空きができるまで put() を待たせる(エージェントへのバックプレッシャー、既定)。
+                   キューが埋まってから BIDI_OUTPUT_BLOCK_TIMEOUT_MS 待っても空かなければ、空きができるまで
+                   drop_oldest と同じく待たずに一番古い音声を捨てる
+      drop_oldest  キューの一番古い音声を捨てて追加する(遅延を増やさない)
+      drop_newest  追加しようとした音声を捨てる
+
+  put() はエージェントのイベントを1つずつ順に受け取る(session.py)ため、put() が待っている間は
+  その後ろの bidi_interruption も届かない。block で待ち続けると、ペーシング(bridge.py)で実時間でしか
+  空かないキューの後ろで割り込みが止まり、割り込み後も音声が送られ続ける。待つ時間に上限を設けるのはこのため
+
+  音声以外のイベント(トランスクリプト・ツール・完了通知等)は順序が重要で小さいため、
+  上限を超えても捨てずに追加する。
+
+キューの深さと捨てた音声のバイト数・長さは telemetry(telemetry.py)に記録する。
+
+bridge.py の音声ペーシング(audio_lead_ms)を使う場合、クライアントの再生より先に生成された音声は
+このキューで待つ。割り込み時にはそれがまとめて捨てられ、送らずに済んだ音声として数えられる。
+応答全体がキューに収まるよう、上限は長めにしてある。
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Awaitable, Callable
+
+import framing
+from telemetry import SessionTelemetry
+
+# キューの上限(イベント数。Nova Sonic の音声イベントで約40秒分)
+OUTPUT_QUEUE_SIZE = int(os.environ.get("BIDI_OUTPUT_QUEUE_SIZE", "1000"))
+
+# キューが上限に達したときの音声の扱い
+OVERFLOW_POLICY = os.environ.get("BIDI_OUTPUT_OVERFLOW", "block")
+
+POLICIES = ("block", "drop_oldest", "drop_newest")
+
+# block でキューの空きを待つ時間の上限(ms)。超えたら一番古い音声を捨てる
+BLOCK_TIMEOUT_MS = int(os.environ.get("BIDI_OUTPUT_BLOCK_TIMEOUT_MS", "500"))
+
+# セッション終了時に未送信のイベントを送り切るまで待つ時間(秒)
+DRAIN_TIMEOUT = float(os.environ.get("BIDI_OUTPUT_DRAIN_TIMEOUT", "2.0"))
+
+_AUDIO_EVENT_TYPE = "bidi_audio_stream"
+
+
+def _is_interruption(event: dict) -> bool:
+    event_type = event.get("type")
+    return event_type == "bidi_interruption" or (
+        event_type == "bidi_response_complete" and event.get("stop_reason") == "interrupted"
+    )
+
+
+class OutputChannel:
+    """上限付きの出力キュー
+
+    Args:
+        send: 1イベントを送信する非同期関数(bridge.send)
+        max_events: キューの上限(イベント数)
+        policy: 上限に達したときの音声の扱い("block" / "drop_oldest" / "drop_newest")
+        telemetry: キューの深さと破棄の記録先(Noneなら記録しない)
+        on_interrupt: 割り込みを受け取ったときに呼ぶ関数(bridge.interrupt。ペーシング中の音声を止める)
+        block_timeout_ms: block で空きを待つ時間の上限(ms)
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[None]],
+        max_events: int = OUTPUT_QUEUE_SIZE,
+        policy: str = OVERFLOW_POLICY,
+        telemetry: SessionTelemetry | None = None,
+        on_interrupt: Callable[[], None] | None = None,
+        block_timeout_ms: int = BLOCK_TIMEOUT_MS,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy} (expected one of {POLICIES})")
+        self._send = send
+        self.max_events = max_events
+        self.policy = policy
+        self._telemetry = telemetry
+        self._on_interrupt = on_interrupt
+        self.block_timeout_ms = block_timeout_ms
+        # block でキューが埋まった時刻と、待ちきれなかったか(キューに空きができるまで古い音声を捨てる)
+        self._full_since: float | None = None
+        self._overflowing = False
+        self._queue: deque[dict] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: asyncio.Task | None = None
+
+        # カウンタ
+        self.max_depth = 0
+        self.dropped_events = 0
+        self.dropped_bytes = 0
+        self.dropped_ms = 0.0
+        self.interrupt_drops = 0
+        self.overflow_drops = 0
+        self.block_timeouts = 0
+
+    @property
+    def depth(self) -> int:
+        """キューに残っているイベント数"""
+        return len(self._queue)
+
+    async def put(self, event: dict) -> None:
+        """イベントをキューに追加する(agent.run の output)"""
+        self._check_sender()
+
+        if _is_interruption(event):
+            self._drop_queued_audio()
+            if self._on_interrupt:
+                self._on_interrupt()
+        elif event.get("type") == _AUDIO_EVENT_TYPE:
+            if len(self._queue) < self.max_events:
+                self._full_since = None
+                self._overflowing = False
+            while len(self._queue) >= self.max_events:
+                if self.policy == "block" and not self._overflowing:
+                    # 上限はキューが埋まってから待った時間の合計(1件ずつ空くたびに数え直さない)
+                    now = asyncio.get_running_loop().time()
+                    if self._full_since is None:
+                        self._full_since = now
+                    remaining = self._full_since + self.block_timeout_ms / 1000 - now
+                    if remaining > 0:
+                        self._not_full.clear()
+                        try:
+                            await asyncio.wait_for(self._not_full.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        self._check_sender()
+                        continue
+                    # これ以上エージェントを止めない(後ろの割り込みを届ける)
+                    self._overflowing = True
+                    self.block_timeouts += 1
+                    print(f"[Output] Queue full for {self.block_timeout_ms}ms, dropping oldest audio")
+                if self.policy == "drop_newest":
+                    self._record_drop(event, interrupted=False)
+                    return
+                elif not self._drop_oldest_audio():
+                    # キューが音声以外で埋まっている場合は追加する
+                    break
+
+        self._queue.append(event)
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+        if self._telemetry:
+            self._telemetry.record_output_queue(len(self._queue))
+        self._not_empty.set()
+        self._idle.clear()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, drain_timeout: float = DRAIN_TIMEOUT) -> None:
+        """未送信のイベントを送り切ってから(最大 drain_timeout 秒)送信タスクを止める"""
+        if self._task and not self._task.done():
+            try:
+                await asyncio.wait_for(self._idle.wait(), drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"[Output] Drain timed out ({len(self._queue)} events left)")
+            self._task.cancel()
+        if self._task:
+            # 送信エラー(切断等)は put() 側で扱い済み
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        print(f"[Output] Stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "policy": self.policy,
+            "dropped_events": self.dropped_events,
+            "dropped_bytes": self.dropped_bytes,
+            "dropped_ms": round(self.dropped_ms),
+            "interrupt_drops": self.interrupt_drops,
+            "overflow_drops": self.overflow_drops,
+            "block_timeouts": self.block_timeouts,
+        }
+
+    # --- 内部 ------------------------------------------------------------
+
+    async def _run(self) -> None:
+        """キューのイベントを順に送信する"""
+        try:
+            while True:
+                while not self._queue:
+                    self._idle.set()
+                    self._not_empty.clear()
+                    await self._not_empty.wait()
+                event = self._queue.popleft()
+                self._not_full.set()
+                await self._send(event)
+        finally:
+            # 送信できなくなったら、待っている put() / close() を起こす
+            self._not_full.set()
+            self._idle.set()
+
+    def _check_sender(self) -> None:
+        """送信タスクが異常終了していれば、その例外を put() の呼び出し元に伝える"""
+        if self._task is not None and self._task.done():
+            self._task.result()
+            raise RuntimeError("output channel is closed")
+
+    def _drop_queued_audio(self) -> None:
+        """割り込み: キューに残っている音声をすべて捨てる"""
+        kept = deque()
+        for queued in self._queue:
+            if queued.get("type") == _AUDIO_EVENT_TYPE:
+                self._record_drop(queued, interrupted=True)
+            else:
+                kept.append(queued)
+        self._queue = kept
+        self._full_since = None
+        self._overflowing = False
+        self._not_full.set()
+
+    def _drop_oldest_audio(self) -> bool:
+        """キューの一番古い音声を捨てる(音声が無ければ False)"""
+        for index, queued in enumerate(self._queue):
+            if queued.get("type") == _AUDIO_EVENT_TYPE:
+                del self._queue[index]
+                self._record_drop(queued, interrupted=False)
+                return True
+        return False
+
+    def _record_drop(self, event: dict, interrupted: bool) -> None:
+        size = framing.audio_size(event)
+        duration_ms = framing.pcm_duration(event) * 1000
+        self.dropped_events += 1
+        self.dropped_bytes += size
+        self.dropped_ms += duration_ms
+        if interrupted:
+            self.interrupt_drops += 1
+        else:
+            self.overflow_drops += 1
+        if self._telemetry:
+            self._telemetry.record_output_drop("interrupted" if interrupted else "overflow", size, duration_ms)
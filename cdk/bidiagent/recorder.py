@@ -0,0 +1,147 @@
+"""
+セッションの送受信イベントの記録
+
+1セッション分の上り(クライアント → サーバー)と下り(サーバー → クライアント)の
+メッセージを、受信・送信した時刻とともにファイルに書き出す。記録したファイルは
+test/replay_session.py で同じタイミング(または N 倍速)で再生できる。
+
+サーバー(bridge.py, 環境変数 BIDI_RECORD_DIR)とクライアント(--record)の両方から使う。
+
+ファイル形式(ネットワークバイトオーダー):
+
+    "BIDIREC1" | メタデータ長 (uint32) | メタデータ (JSON)
+    レコード × N:
+        direction (uint8) | kind (uint8) | 経過時間 μs (uint64) | 長さ (uint32) | ペイロード
+
+    direction: 0=上り, 1=下り
+    kind: 0=JSONテキスト, 1=音声のバイナリフレーム(framing.py の形式)
+
+音声イベントは転送方式(バイナリ/JSON)に関わらずバイナリフレームとして保存する
+(base64 を展開した生の音声なので、JSONのまま保存するより約25%小さい)。
+
+このモジュールは標準ライブラリのみに依存し、test/ 配下のクライアントからも読み込まれる。
+"""
+import json
+import struct
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import framing
+
+MAGIC = b"BIDIREC1"
+
+# 方向
+UPLINK = 0    # クライアント → サーバー
+DOWNLINK = 1  # サーバー → クライアント
+
+# ペイロードの種類
+KIND_JSON = 0
+KIND_FRAME = 1
+
+_LENGTH = struct.Struct("!I")
+_RECORD = struct.Struct("!BBQI")
+
+# 音声としてバイナリフレームで保存するイベント
+_AUDIO_EVENT_TYPES = ("bidi_audio_input", "bidi_audio_stream", framing.SILENCE_EVENT_TYPE)
+
+
+class Record(NamedTuple):
+    """記録した1メッセージ"""
+    time: float          # 記録開始からの経過時間(秒)
+    direction: int       # UPLINK / DOWNLINK
+    message: str | bytes  # JSONテキスト、または音声のバイナリフレーム
+
+    def event(self) -> dict:
+        """イベント(dict, 音声は base64)に戻す"""
+        if isinstance(self.message, bytes):
+            return framing.frame_to_event(self.message)
+        return json.loads(self.message)
+
+
+def _event_to_frame(event: dict) -> bytes:
+    if event["type"] == framing.SILENCE_EVENT_TYPE:
+        return framing.encode_silence_frame(
+            int(event["frames"]), int(event["sample_rate"]), int(event["channels"]), event.get("format", "pcm"))
+    return framing.event_to_frame(event)
+
+
+class SessionRecorder:
+    """1セッション分の記録
+
+    Args:
+        path: 書き出すファイルのパス
+        metadata: ファイル先頭に保存する情報(記録元、サブプロトコル等)
+    """
+
+    def __init__(self, path: str, metadata: dict | None = None):
+        self.path = path
+        self.records = 0
+        self._started = time.perf_counter()
+        self._file = open(path, "wb", buffering=64 * 1024)
+        header = json.dumps({
+            "version": 1,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            **(metadata or {}),
+        }).encode("utf-8")
+        self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+
+    def record(self, direction: int, message: str | bytes | dict) -> None:
+        """送受信したメッセージを1つ記録する
+
+        message はWebSocketのメッセージ(JSONテキスト / バイナリフレーム)か、
+        そのイベント(dict)。base64 の音声はバイナリフレームに変換して保存する。
+        """
+        if self._file is None:
+            return
+        elapsed_us = int((time.perf_counter() - self._started) * 1_000_000)
+
+        if isinstance(message, str) and '"audio"' in message:
+            # base64 入りの音声イベントかもしれない
+            message = json.loads(message)
+        if isinstance(message, dict):
+            if message.get("type") in _AUDIO_EVENT_TYPES:
+                message = _event_to_frame(message)
+            else:
+                message = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+        if isinstance(message, bytes):
+            kind, payload = KIND_FRAME, message
+        else:
+            kind, payload = KIND_JSON, message.encode("utf-8")
+        self._file.write(_RECORD.pack(direction, kind, elapsed_us, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"[Recorder] Saved {self.records} messages to {self.path}")
+
+
+def read_recording(path: str) -> tuple[dict, list[Record]]:
+    """記録ファイルを (メタデータ, レコードのリスト) として読み込む"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path}: not a session recording")
+
+    offset = len(MAGIC)
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    metadata = json.loads(data[offset:offset + length])
+    offset += length
+
+    records = []
+    while offset + _RECORD.size <= len(data):
+        direction, kind, elapsed_us, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        payload = data[offset:offset + length]
+        if len(payload) != length:
+            # 書き込み途中で終了したファイルの末尾は捨てる
+            break
+        offset += length
+        message = payload if kind == KIND_FRAME else payload.decode("utf-8")
+        records.append(Record(elapsed_us / 1_000_000, direction, message))
+    return metadata, records
@@ -0,0 +1,161 @@
+"""
+16bit PCM のリサンプリングとチャンネル数の変換(NumPy)
+
+サーバー(input_validation.py: クライアントが送ってきた音声をモデルの形式に揃える)と
+クライアント(test/audio_pipeline.py: デバイスのネイティブの形式とモデルの形式の変換)で共通に使う。
+NumPy が無い環境では NUMPY_AVAILABLE が False になり、同じ形式どうしの AudioConverter だけが使える。
+"""
+import math
+
+# NumPyのインポート（オプション）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+def mix_channels(samples: "np.ndarray", channels: int) -> "np.ndarray":
+    """(フレーム数, チャンネル数) の音声のチャンネル数を変える
+
+    モノラルにするときは全チャンネルの平均、モノラルから増やすときは同じ音声を複製する。
+    それ以外（例: 4ch → 2ch）は一度モノラルにしてから複製する。
+    """
+    if samples.shape[1] == channels:
+        return samples
+    if samples.shape[1] > 1:
+        samples = samples.mean(axis=1, keepdims=True)
+    return samples if channels == 1 else np.repeat(samples, channels, axis=1)
+
+
+class StreamingResampler:
+    """チャンクごとに呼び出せるポリフェーズのリサンプラ（NumPyが必要）
+
+    変換比を既約分数 up/down にし、窓付きsincの低域通過フィルタ（カットオフは低い方のレートの
+    ナイキスト周波数の rolloff 倍）を up 個の位相に分けて持つ。出力1サンプルは、入力の直近 taps
+    サンプルとその位相のフィルタ係数の内積で、チャンク内の全出力をまとめて計算する。
+
+    - 前のチャンクの末尾 taps - 1 サンプルと出力位置の端数を持ち越すため、チャンクの境目で音が途切れない
+    - フィルタ係数は最初に作っておき、1チャンクの計算量は「出力サンプル数 × taps」で決まる
+      （taps は変換比だけで決まり、チャンクの長さや内容によらない）
+    - 遅延は taps / 2 入力サンプル（48kHz → 16kHz で 0.5ms）
+
+    Args:
+        in_rate: 入力のサンプリングレート
+        out_rate: 出力のサンプリングレート
+        channels: チャンネル数
+        zero_crossings: フィルタの片側の長さ（低い方のレートのサンプル数）
+        rolloff: カットオフ周波数（低い方のレートのナイキスト周波数に対する比）
+        beta: カイザー窓のβ
+    """
+
+    def __init__(
+        self,
+        in_rate: int,
+        out_rate: int,
+        channels: int = 1,
+        zero_crossings: int = 8,
+        rolloff: float = 0.9,
+        beta: float = 8.0,
+    ):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for resampling (pip install numpy)")
+        divisor = math.gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+
+        # 1位相あたりのタップ数（入力サンプル数）。ダウンサンプリングでは比に応じて長くする
+        self.taps = 2 * math.ceil(zero_crossings * max(1.0, in_rate / out_rate))
+        length = self.taps * self.up
+        # up 倍に補間したレートでのカットオフ（サイクル/サンプル）
+        cutoff = 0.5 * rolloff * min(in_rate, out_rate) / (in_rate * self.up)
+        t = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, beta)
+        prototype *= self.up / prototype.sum()
+        # bank[phase] は入力窓 x[c - taps + 1 .. c] に掛ける係数（古い順）
+        self._bank = prototype.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+        self._history = np.zeros((self.taps - 1, channels), dtype=np.float32)
+        # 次の出力サンプルの位置（up 倍のレート、次のチャンクの先頭を 0 とする）
+        self._next = 0
+
+    def process(self, samples: "np.ndarray") -> "np.ndarray":
+        """(フレーム数, チャンネル数) の float32 を変換する（出力の長さは入力の長さ × 比 前後）"""
+        frames = len(samples)
+        if frames == 0:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        extended = np.concatenate((self._history, samples.astype(np.float32, copy=False)))
+        end = frames * self.up
+        positions = np.arange(self._next, end, self.down)
+        # 入力のどのサンプルまでを使うか（c）と、フィルタの位相
+        centers, phases = np.divmod(positions, self.up)
+        windows = np.lib.stride_tricks.sliding_window_view(extended, self.taps, axis=0)[centers]
+        out = np.einsum("nck,nk->nc", windows, self._bank[phases])
+        self._next = (positions[-1] + self.down - end) if len(positions) else self._next - end
+        self._history = extended[-(self.taps - 1):].copy()
+        return out
+
+    def reset(self) -> None:
+        """持ち越している音声を捨てる（割り込みで再生を止めたとき）"""
+        self._history[:] = 0
+        self._next = 0
+
+
+class AudioConverter:
+    """16bit PCM のサンプリングレートとチャンネル数をチャンクごとに変換する
+
+    デバイスのネイティブの形式（44.1kHz / 48kHz、ステレオ等）と、モデルの形式（16kHz モノラル）の間の変換に使う。
+    チャンネル数を減らす場合は先にまとめ、増やす場合は後で複製するため、リサンプラはチャンネル数の少ない方で動く。
+    同じ形式どうしならそのまま返す（NumPyも不要）。
+
+    Args:
+        in_rate: 入力のサンプリングレート
+        in_channels: 入力のチャンネル数
+        out_rate: 出力のサンプリングレート
+        out_channels: 出力のチャンネル数
+    """
+
+    def __init__(self, in_rate: int, in_channels: int, out_rate: int, out_channels: int):
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.out_rate = out_rate
+        self.out_channels = out_channels
+        self.passthrough = in_rate == out_rate and in_channels == out_channels
+        self._resampler = None
+        if not self.passthrough:
+            if not NUMPY_AVAILABLE:
+                raise RuntimeError("NumPy is required for audio conversion (pip install numpy)")
+            if in_rate != out_rate:
+                self._resampler = StreamingResampler(in_rate, out_rate, min(in_channels, out_channels))
+        self._partial = b""
+
+    def __repr__(self) -> str:
+        return f"{self.in_rate} Hz x{self.in_channels} -> {self.out_rate} Hz x{self.out_channels}"
+
+    def convert(self, pcm: bytes) -> bytes:
+        """16bit PCM のチャンクを変換する（フレームの途中で切れた端数は次のチャンクに回す）"""
+        if self.passthrough:
+            return pcm
+        frame_bytes = 2 * self.in_channels
+        if self._partial:
+            pcm = self._partial + pcm
+        usable = len(pcm) // frame_bytes * frame_bytes
+        self._partial = pcm[usable:]
+        samples = np.frombuffer(pcm, dtype=np.int16, count=usable // 2).reshape(-1, self.in_channels)
+        if self.out_channels < self.in_channels:
+            samples = mix_channels(samples.astype(np.float32), self.out_channels)
+        else:
+            samples = samples.astype(np.float32)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        samples = mix_channels(samples, self.out_channels)
+        return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+
+    def reset(self) -> None:
+        """持ち越している音声を捨てる"""
+        self._partial = b""
+        if self._resampler is not None:
+            self._resampler.reset()
+
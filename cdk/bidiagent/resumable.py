@@ -0,0 +1,355 @@
+"""
+再開できるセッション(resume.py)のサーバー側
+
+ResumableSocket はセッションの間ずっと同じ WebSocketBridge に渡され、その下の実際の WebSocket 接続を
+差し替える。Starlette の WebSocket と同じメソッド(accept / receive / send_text / send_bytes / close)を持つため、
+ブリッジ・出力キュー・セッション処理(agent.py)は接続が切れたことを意識しない。
+
+- 接続が切れると(close code 1000 / 1001 以外)、セッションを終了せずに保留する。
+  エージェントとモデル接続はそのまま残り、モデルには入力待ちで切られないよう無音を送り続ける
+- 保留中の送信は再開まで待つ。その間の出力は手前の出力キュー(output_channel.py)に溜まり、
+  キューが上限に達すると、エージェントが待つ(block では上限時間を過ぎると古い音声を捨てる)
+- 送ったメッセージは直近 BIDI_RESUME_REPLAY_EVENTS 件を保持し、再開時にクライアントが受信済みの件数より
+  後のもの(切断の直前に送ったが届かなかった分)を送り直す
+- BIDI_RESUME_GRACE_S 秒以内に再開されなければ、切断として扱いセッションを終了する(0 なら再開しない)
+
+再開の接続が、前の接続の切断をサーバーが検知する前に来た場合(モバイル回線の切り替え等)は、
+前の接続を閉じて新しい接続に切り替える。
+
+セッションはワーカー(workers.py)のプロセス内に保持されるため、BIDI_WORKERS > 1 で
+再接続が別のワーカーに割り振られると再開できない(close code 4404 になり、クライアントは新しいセッションで始める)。
+
+再開の回数は telemetry の bidi.session.resumes(属性 result)、切断から再開までの時間は
+bidi.session.resume_gap、再開から最初の音声までの時間は bidi.session.resume_first_audio で記録する。
+"""
+import asyncio
+import os
+import secrets
+import time
+from collections import Counter, deque
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import framing
+import resume
+import telemetry as telemetry_module
+from json_codec import JsonCodec, default_codec
+from telemetry import SessionTelemetry
+
+# 切断したセッションを保持する時間(秒。0 なら再開しない)
+RESUME_GRACE_S = float(os.environ.get("BIDI_RESUME_GRACE_S", "30"))
+
+# 再開時に送り直せるよう保持する送信済みメッセージ数
+RESUME_REPLAY_EVENTS = int(os.environ.get("BIDI_RESUME_REPLAY_EVENTS", "256"))
+
+# 保留中にモデルへ送る無音の間隔(ms)
+KEEPALIVE_SILENCE_MS = 100
+
+# 保留中の無音の形式(Nova Sonic の入力)
+_SILENCE_SAMPLE_RATE = 16000
+_SILENCE_CHANNELS = 1
+
+_AUDIO_TEXT_PREFIX = '{"type":"bidi_audio_stream"'
+
+
+def _is_audio(message: str | bytes) -> bool:
+    # バイナリフレームは常に音声、JSON の音声はテンプレート(json_codec.py)の形
+    return isinstance(message, bytes) or message.startswith(_AUDIO_TEXT_PREFIX)
+
+
+class ResumableSocket:
+    """切断をまたいで続く1セッション(WebSocketBridge から見た WebSocket)
+
+    Args:
+        websocket: 最初の接続(accept 前)
+        sessions: セッションの登録先
+        telemetry: セッションの計測(Noneなら記録しない)
+    """
+
+    def __init__(self, websocket: WebSocket, sessions: "ResumableSessions",
+                 telemetry: SessionTelemetry | None = None):
+        self.token = secrets.token_urlsafe(18)
+        self.scope = websocket.scope
+        self.query_params = websocket.query_params
+        self.subprotocol: str | None = None
+        self._sessions = sessions
+        self._telemetry = telemetry
+        self._json: JsonCodec = sessions.json_codec
+        self._websocket: WebSocket | None = websocket
+        self._attached = asyncio.Event()
+        self._attached.set()
+        # 現在の接続が切り替わった・終わったときに set される(再開した接続のハンドラが待つ)
+        self._detached = asyncio.Event()
+        self._resume_lock = asyncio.Lock()
+        self._replay: deque[tuple[int, str | bytes]] = deque(maxlen=sessions.replay_events)
+        self._expiry: asyncio.TimerHandle | None = None
+        self._parked_at: float | None = None
+        self._closing: set[asyncio.Task] = set()
+        self.sent = 0
+        self.resumes = 0
+        self.closed = False
+
+    @property
+    def parked(self) -> bool:
+        """切断して再開を待っている"""
+        return self._websocket is None and not self.closed
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        self.subprotocol = subprotocol
+        await self._websocket.accept(subprotocol=subprotocol)
+        self._sessions.add(self)
+        await self._send_control(self._websocket, {
+            "type": resume.BRIDGE_SESSION,
+            "resume_token": self.token,
+            "resume_grace_s": self._sessions.grace_s,
+        })
+
+    async def receive(self) -> dict:
+        while True:
+            websocket = self._websocket
+            if websocket is None:
+                if await self._wait_attached(KEEPALIVE_SILENCE_MS / 1000):
+                    continue
+                if self.closed:
+                    return {"type": "websocket.disconnect", "code": 1001}
+                # 保留中はモデルに無音を送り、入力待ちで切られないようにする
+                frames = _SILENCE_SAMPLE_RATE * KEEPALIVE_SILENCE_MS // 1000
+                event = framing.silence_event(frames, _SILENCE_SAMPLE_RATE, _SILENCE_CHANNELS)
+                return {"type": "websocket.receive", "event": event, "size": 0}
+
+            try:
+                message = await websocket.receive()
+            except Exception:
+                # 閉じた接続からの受信(RuntimeError 等)
+                message = {"type": "websocket.disconnect", "code": 1006}
+            if message["type"] != "websocket.disconnect":
+                return message
+            if websocket is not self._websocket:
+                # 再開で切り替え済みの古い接続
+                continue
+            code = message.get("code", 1006)
+            if code in resume.FINAL_CLOSE_CODES or self.closed:
+                self._finish()
+                return message
+            self._park(websocket, f"code {code}")
+
+    async def send_text(self, text: str) -> None:
+        await self._send(text)
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self._send(data)
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        """セッションを終了する(現在の接続があれば閉じる)"""
+        websocket = self._websocket
+        self._finish()
+        if websocket is not None:
+            try:
+                await websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+
+    async def resume(self, websocket: WebSocket, received: int) -> None:
+        """再開の接続に切り替え、その接続が切れるかセッションが終わるまで待つ
+
+        Args:
+            websocket: 再開の接続(accept 前)
+            received: クライアントが受信済みのメッセージ数
+        """
+        async with self._resume_lock:
+            if self.closed:
+                self._sessions.record("failed")
+                await _close_failed(websocket, "session closed")
+                return
+            previous = self._websocket
+            if previous is not None:
+                # 前の接続の切断をまだ検知していない
+                self._park(previous, "replaced")
+            self._cancel_expiry()
+
+            # クライアントが受け取っていないメッセージ(保持している範囲)
+            received = min(received, self.sent)
+            oldest = self.sent - len(self._replay) + 1
+            missed = [message for seq, message in self._replay if seq > received]
+            lost = max(0, oldest - 1 - received)
+            self._replay.clear()
+            self.sent = received
+            try:
+                await websocket.accept(subprotocol=self.subprotocol)
+                await self._send_control(websocket, {
+                    "type": resume.BRIDGE_RESUMED, "replayed": len(missed), "lost": lost})
+                for message in missed:
+                    await self._write(websocket, message)
+                    self._log(message)
+            except Exception:
+                # 再開の接続もすぐに切れた: 残りは次の再開で送り直す
+                for message in missed[self.sent - received:]:
+                    self._log(message)
+                self._park(websocket, "failed during replay")
+                self._sessions.record("failed")
+                return
+
+            gap_ms = (time.perf_counter() - self._parked_at) * 1000 if self._parked_at else 0.0
+            self._parked_at = None
+            self.resumes += 1
+            self._sessions.record("resumed")
+            if self._telemetry:
+                self._telemetry.resumed(gap_ms)
+                if any(_is_audio(message) for message in missed):
+                    self._telemetry.resumed_audio()
+            print(f"[Resume] Session resumed after {gap_ms:.0f} ms "
+                  f"(replayed {len(missed)}, lost {lost}, resumes {self.resumes})")
+            self._websocket = websocket
+            self._detached = detached = asyncio.Event()
+            self._attached.set()
+        await detached.wait()
+
+    # --- 内部 ------------------------------------------------------------
+
+    async def _send(self, message: str | bytes) -> None:
+        while True:
+            websocket = self._websocket
+            if websocket is None:
+                if not await self._wait_attached(None):
+                    raise WebSocketDisconnect(1001)
+                continue
+            try:
+                await self._write(websocket, message)
+            except Exception:
+                if self.closed:
+                    raise WebSocketDisconnect(1001)
+                if websocket is self._websocket:
+                    self._park(websocket, "send failed")
+                continue
+            self._log(message)
+            return
+
+    async def _write(self, websocket: WebSocket, message: str | bytes) -> None:
+        if isinstance(message, bytes):
+            await websocket.send_bytes(message)
+        else:
+            await websocket.send_text(message)
+
+    async def _send_control(self, websocket: WebSocket, event: dict) -> None:
+        # セッションの制御メッセージは受信済みメッセージ数に数えない(保持もしない)
+        await websocket.send_text(self._json.encode(event))
+
+    def _log(self, message: str | bytes) -> None:
+        self.sent += 1
+        self._replay.append((self.sent, message))
+
+    async def _wait_attached(self, timeout: float | None) -> bool:
+        """接続されるまで待つ(セッションが終了した・timeout 秒経った場合は False)"""
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self._attached.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self.closed
+
+    def _park(self, websocket: WebSocket, reason: str) -> None:
+        """接続が切れた: 再開を待つ"""
+        if websocket is self._websocket:
+            self._websocket = None
+            self._attached.clear()
+            self._detached.set()
+        if self._parked_at is None:
+            self._parked_at = time.perf_counter()
+        if self._expiry is None and not self.closed:
+            self._expiry = asyncio.get_running_loop().call_later(self._sessions.grace_s, self._expire)
+        print(f"[Resume] Session parked ({reason}, sent {self.sent}, grace {self._sessions.grace_s:.0f}s)")
+        # 切断を検知していない接続(ハーフオープン)もここで閉じる
+        task = asyncio.create_task(_close_quietly(websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _expire(self) -> None:
+        self._expiry = None
+        if self.parked:
+            print("[Resume] Grace period expired")
+            self._sessions.record("expired")
+            self._finish()
+
+    def _cancel_expiry(self) -> None:
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def _finish(self) -> None:
+        """セッションの終了: 待っている送受信と再開した接続のハンドラを起こす"""
+        if self.closed:
+            return
+        self.closed = True
+        self._cancel_expiry()
+        self._attached.set()
+        self._detached.set()
+        self._sessions.remove(self)
+
+
+class ResumableSessions:
+    """このワーカーの再開できるセッション(トークン → ResumableSocket)
+
+    Args:
+        grace_s: 切断したセッションを保持する時間(秒。0 なら再開しない)
+        replay_events: 再開時に送り直せるよう保持する送信済みメッセージ数
+        json_codec: 制御メッセージのエンコーダ(Noneならプロセス共通のもの)
+    """
+
+    def __init__(self, grace_s: float = RESUME_GRACE_S, replay_events: int = RESUME_REPLAY_EVENTS,
+                 json_codec: JsonCodec | None = None):
+        self.grace_s = grace_s
+        self.replay_events = replay_events
+        self.json_codec = json_codec or default_codec
+        self._sessions: dict[str, ResumableSocket] = {}
+        self.counts = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.grace_s > 0
+
+    def open(self, websocket: WebSocket, telemetry: SessionTelemetry | None = None) -> ResumableSocket:
+        """新しい接続を再開できるセッションにする(accept は戻り値の ResumableSocket で行う)"""
+        return ResumableSocket(websocket, self, telemetry)
+
+    async def resume(self, websocket: WebSocket, offer: resume.ResumeOffer) -> None:
+        """再開の接続: トークンのセッションに切り替え、この接続が終わるまで待つ"""
+        session = self._sessions.get(offer.token)
+        offered = websocket.scope.get("subprotocols", [])
+        if session is None:
+            self.record("failed")
+            print("[Resume] Unknown or expired resume token")
+            await _close_failed(websocket, "unknown or expired resume token")
+            return
+        if session.subprotocol is not None and session.subprotocol not in offered:
+            self.record("failed")
+            await _close_failed(websocket, "subprotocol mismatch")
+            return
+        await session.resume(websocket, offer.received)
+
+    def add(self, session: ResumableSocket) -> None:
+        self._sessions[session.token] = session
+
+    def remove(self, session: ResumableSocket) -> None:
+        self._sessions.pop(session.token, None)
+
+    def record(self, result: str) -> None:
+        self.counts[result] += 1
+        telemetry_module.record_resume(result)
+
+    def stats(self) -> dict:
+        parked = sum(1 for session in self._sessions.values() if session.parked)
+        return {"sessions": len(self._sessions), "parked": parked, **self.counts}
+
+
+async def _close_failed(websocket: WebSocket, reason: str) -> None:
+    # accept 前に閉じると close code が伝わらないため、accept してから閉じる
+    await websocket.accept()
+    await websocket.close(code=resume.RESUME_FAILED_CLOSE_CODE, reason=reason)
+
+
+async def _close_quietly(websocket: WebSocket) -> None:
+    try:
+        await websocket.close(code=1001)
+    except Exception:
+        pass
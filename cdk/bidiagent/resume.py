@@ -0,0 +1,97 @@
+"""
+セッションの再開(resume)プロトコル
+
+WebSocket が切れてもサーバーはセッション(エージェントと会話の状態)を猶予時間のあいだ保持し、
+クライアントは再接続して続きから再開できる。サーバー側の実装は resumable.py。
+
+サブプロトコルで申し出る(SigV4 で署名された URL を変えずに済むよう、クエリパラメータは使わない)。
+
+    新しいセッション
+        クライアントは通常のサブプロトコル(framing.py)に加えて bidi.resume.v1 を提示する。
+        サーバーは accept 直後に再開用のトークンを送る(選択するサブプロトコルは変わらない)
+
+            {"type": "bridge_session", "resume_token": "...", "resume_grace_s": 30}
+
+    再開
+        クライアントは bidi.resume.v1 と、トークンと受信済みメッセージ数を載せた
+        bidi.resume-token.<token>.<received> を提示する。サーバーは accept 直後に
+
+            {"type": "bridge_resumed", "replayed": 3, "lost": 0}
+
+        を送り、続けてクライアントが受け取っていなかったメッセージ(replayed 件)を送り直す。
+        保持している範囲より前のメッセージが抜けていた場合は lost に件数が入る。
+        切断中に生成された出力は、その後に通常どおり送られる。
+        bridge_config で決めた設定(音声フォーマット等)は引き継がれるため送り直さない。
+        トークンが無効(猶予時間切れ等)の場合は close code 4404 で閉じる。
+        クライアントは新しいセッションとして接続し直す
+
+受信済みメッセージ数は、サーバーから受信したメッセージ(テキスト・バイナリとも1件)のうち
+bridge_session / bridge_resumed を除いた数。
+
+クライアントが close code 1000 / 1001 で閉じた場合はセッションを終了する(再開しない)。
+
+このモジュールは標準ライブラリのみに依存し、test/ 配下のクライアントからも読み込まれる。
+"""
+import json
+
+SUBPROTOCOL_RESUME = "bidi.resume.v1"
+
+# トークンを載せるサブプロトコルの接頭辞
+TOKEN_PREFIX = "bidi.resume-token."
+
+# セッションの制御メッセージ(受信済みメッセージ数に数えない)
+BRIDGE_SESSION = "bridge_session"
+BRIDGE_RESUMED = "bridge_resumed"
+
+SESSION_TYPES = frozenset((BRIDGE_SESSION, BRIDGE_RESUMED))
+
+# 再開できないトークンの close code(アプリケーション定義の範囲)
+RESUME_FAILED_CLOSE_CODE = 4404
+
+# クライアントがこの close code で閉じたらセッションを終了する
+FINAL_CLOSE_CODES = frozenset((1000, 1001))
+
+_SESSION_PREFIX = '{"type":"bridge_'
+
+
+class ResumeOffer:
+    """クライアントが提示した再開の申し出
+
+    Attributes:
+        token: 再開するセッションのトークン(新しいセッションなら None)
+        received: クライアントが受信済みのメッセージ数
+    """
+
+    def __init__(self, token: str | None = None, received: int = 0):
+        self.token = token
+        self.received = received
+
+    def __repr__(self) -> str:
+        return f"ResumeOffer(token={'...' if self.token else None}, received={self.received})"
+
+
+def offer_subprotocols(token: str | None = None, received: int = 0) -> list[str]:
+    """再開に対応することを示すサブプロトコル(token を渡すとそのセッションの再開)"""
+    if token is None:
+        return [SUBPROTOCOL_RESUME]
+    return [SUBPROTOCOL_RESUME, f"{TOKEN_PREFIX}{token}.{received}"]
+
+
+def parse_offer(offered: list[str] | tuple[str, ...]) -> ResumeOffer | None:
+    """提示されたサブプロトコルから再開の申し出を取り出す(申し出が無ければ None)"""
+    if SUBPROTOCOL_RESUME not in offered:
+        return None
+    for subprotocol in offered:
+        if subprotocol.startswith(TOKEN_PREFIX):
+            token, _, received = subprotocol[len(TOKEN_PREFIX):].rpartition(".")
+            if token and received.isdigit():
+                return ResumeOffer(token, int(received))
+    return ResumeOffer()
+
+
+def session_event(message: str | bytes) -> dict | None:
+    """受信したメッセージが bridge_session / bridge_resumed ならその内容を返す(クライアント用)"""
+    if isinstance(message, bytes) or not message.startswith(_SESSION_PREFIX):
+        return None
+    event = json.loads(message)
+    return event if event.get("type") in SESSION_TYPES else None
@@ -0,0 +1,82 @@
+"""
+セッション実行ループ
+
+BidiAgent.run() はモデル接続(agent.start)を確立してから入出力の中継を始めるため、
+Nova Sonic とのハンドシェイク時間がそのまま最初の応答までの遅延に乗る。
+ここでは agent.run() と同じ中継を agent.send / agent.receive で行い、
+モデル接続を WebSocket の accept と並行して開始できるようにする。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from strands.experimental.bidi.agent import BidiAgent
+
+
+async def start_agent(agent: BidiAgent) -> float:
+    """モデル接続を確立し、ハンドシェイクにかかった時間(ms)を返す"""
+    start = time.perf_counter()
+    await agent.start()
+    handshake_ms = (time.perf_counter() - start) * 1000
+    print(f"[Server] Model connected (handshake: {handshake_ms:.0f} ms)")
+    return handshake_ms
+
+
+async def run_session(
+    agent: BidiAgent,
+    inputs: list[Callable[[], Awaitable[dict]]],
+    outputs: list[Callable[[dict], Awaitable[None]]],
+    start_task: asyncio.Task | None = None,
+) -> None:
+    """agent.run() 相当の中継を行う
+
+    Args:
+        agent: 未開始のエージェント
+        inputs: 入力イベントを1つ返す非同期関数のリスト
+        outputs: 出力イベントを1つ受け取る非同期関数のリスト
+        start_task: 先行して開始済みの start_agent() タスク。
+            None の場合はここでモデル接続を開始する。
+            入力の読み込みは接続の完了を待たずに始め、届いたイベントは接続完了後に送る。
+
+    Note:
+        エージェントの停止(agent.stop)は呼び出し側で行う。
+    """
+    if start_task is None:
+        start_task = asyncio.create_task(start_agent(agent))
+
+    async def run_inputs() -> None:
+        async def task(input_) -> None:
+            while True:
+                event = await input_()
+                await start_task
+                await agent.send(event)
+
+        await asyncio.gather(*[task(input_) for input_ in inputs])
+
+    async def run_outputs() -> None:
+        await start_task
+        async for event in agent.receive():
+            for output in outputs:
+                await output(event)
+
+    inputs_task = asyncio.create_task(run_inputs())
+    outputs_task = asyncio.create_task(run_outputs())
+
+    try:
+        # どちらかが終了するまで待機(出力側の正常終了 = stop_conversation 等による会話終了)
+        done, _ = await asyncio.wait(
+            [inputs_task, outputs_task],
+            return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        # 残りのタスクをキャンセル(呼び出し元がキャンセルされた場合も含む)
+        for task in (inputs_task, outputs_task):
+            if not task.done():
+                task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    for task in done:
+        task.result()
@@ -0,0 +1,446 @@
+"""
+セッションごとのレイテンシ計測(OpenTelemetry)
+
+コンテナは opentelemetry-instrument 配下で動くため、ここで作ったメトリクスとスパンは
+既存のOTelパイプライン(ADOT)からそのままエクスポートされる。
+opentelemetry が無い環境では何も記録しない(print のサマリーのみ)。
+
+メトリクス(単位はすべて ms / バイト / 回):
+
+    bidi.session.agent_ready       accept からモデル接続完了まで
+    bidi.session.first_audio       accept から最初の bidi_audio_stream まで
+    bidi.turn.response_start       ユーザー発話の終了から bidi_response_start まで
+    bidi.turn.first_audio          ユーザー発話の終了からその応答の最初の音声まで
+    bidi.tool.duration             ツール実行時間(tool_use_stream → tool_result, 属性 tool)
+    bidi.session.bytes             WebSocketで送受信したバイト数(属性 direction)
+    bidi.session.events            イベント数(属性 direction, type。direction=filtered はクライアントが購読せず送らなかったもの。
+                                   受信イベントの未知の type は unknown)
+    bidi.output.queue_depth        出力キュー(output_channel.py)の最大の深さ(応答ごと, イベント数)
+    bidi.output.dropped_bytes      出力キューで捨てた音声のバイト数(属性 reason: interrupted / overflow)
+    bidi.output.dropped_audio      同じく捨てた音声の長さ(ms, 属性 reason)
+    bidi.tool.queue_wait           ツールの実行待ち時間(tool_executor.py, 属性 tool)
+    bidi.tool.execution            ツールのスレッドでの実行時間(属性 tool, status)
+    bidi.loop.lag                  閾値を超えたイベントループの遅延(ms)
+    bidi.tool.loop_blocks          イベントループの遅延時にループ上で動いていたツール(属性 tool)
+    bidi.server.sessions           ワーカーの同時セッション数(ゲージ, 属性 worker, admission.py)
+    bidi.loop.current_lag          ワーカーのイベントループの遅延(ゲージ, ms, 減衰させた最大値, 属性 worker)
+    bidi.admission.rejected        受け入れなかった接続(属性 reason: worker sessions / sessions / loop lag)
+    bidi.http.cache                http_request のレスポンスキャッシュ(http_client.py, 属性 result: hit / miss / bypass / store / evict)
+    bidi.session.resumes           切断したセッションの再開(resumable.py, 属性 result: resumed / failed / expired)
+    bidi.session.resume_gap        切断から再開の接続まで
+    bidi.session.resume_first_audio 再開の接続から最初の bidi_audio_stream(送り直した音声を含む)まで
+    bidi.input.validation          入力イベントの検証・正規化の時間の最大値(集計の反映ごと, 属性 type, input_validation.py)
+    bidi.input.validation_time     同じく時間の合計(ms, 属性 type)
+    bidi.input.rejected            拒否した入力イベント(属性 type, reason)
+
+ユーザー発話の終了は、サーバー側で観測できる最も近いイベントとして
+ユーザーの最終トランスクリプト(role=user, is_final=True)の受信時刻を使う。
+
+イベントごとの記録はセッション内の dict への加算だけにとどめ、
+OTelへの反映は応答の完了時とセッション終了時にまとめて行う。
+"""
+import time
+from collections import Counter
+from typing import Callable
+
+# OpenTelemetryのインポート（オプション）
+try:
+    from opentelemetry import metrics, trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+_instruments: dict | None = None
+
+# 受信イベントの type として属性に使う値。type はクライアントが決めるため、
+# それ以外は "unknown" にまとめる(任意の文字列でメトリクスの系列や集計が増えないように)
+INPUT_EVENT_TYPES = frozenset((
+    "bidi_audio_input", "bidi_audio_silence", "bidi_text_input", "bidi_image_input", "bridge_config",
+))
+
+
+def input_type(event_type) -> str:
+    """受信イベントの type をメトリクスの属性の値にする"""
+    return event_type if isinstance(event_type, str) and event_type in INPUT_EVENT_TYPES else "unknown"
+
+
+def _get_instruments() -> dict:
+    """メトリクスの計器を作る(プロセスで1回)"""
+    global _instruments
+    if _instruments is None:
+        meter = metrics.get_meter("bidiagent")
+        _instruments = {
+            "agent_ready": meter.create_histogram(
+                "bidi.session.agent_ready", unit="ms", description="WebSocket accept to model connected"),
+            "first_audio": meter.create_histogram(
+                "bidi.session.first_audio", unit="ms", description="WebSocket accept to first bidi_audio_stream"),
+            "response_start": meter.create_histogram(
+                "bidi.turn.response_start", unit="ms", description="End of user speech to bidi_response_start"),
+            "turn_first_audio": meter.create_histogram(
+                "bidi.turn.first_audio", unit="ms", description="End of user speech to first audio of the response"),
+            "tool_duration": meter.create_histogram(
+                "bidi.tool.duration", unit="ms", description="Tool execution time"),
+            "bytes": meter.create_counter(
+                "bidi.session.bytes", unit="By", description="Bytes sent/received on the WebSocket"),
+            "events": meter.create_counter(
+                "bidi.session.events", unit="1", description="Events sent/received by type"),
+            "queue_depth": meter.create_histogram(
+                "bidi.output.queue_depth", unit="1", description="Maximum output queue depth per response"),
+            "dropped_bytes": meter.create_counter(
+                "bidi.output.dropped_bytes", unit="By", description="Audio bytes dropped by the output queue"),
+            "dropped_audio": meter.create_counter(
+                "bidi.output.dropped_audio", unit="ms", description="Audio duration dropped by the output queue"),
+            "tool_queue_wait": meter.create_histogram(
+                "bidi.tool.queue_wait", unit="ms", description="Time a tool call waited for a worker"),
+            "tool_execution": meter.create_histogram(
+                "bidi.tool.execution", unit="ms", description="Tool execution time on the worker thread"),
+            "loop_lag": meter.create_histogram(
+                "bidi.loop.lag", unit="ms", description="Event loop lag above the warning threshold"),
+            "loop_blocks": meter.create_counter(
+                "bidi.tool.loop_blocks", unit="1", description="Tools running on the event loop while it lagged"),
+            "admission_rejected": meter.create_counter(
+                "bidi.admission.rejected", unit="1", description="WebSocket connections rejected by admission control"),
+            "http_cache": meter.create_counter(
+                "bidi.http.cache", unit="1", description="HTTP response cache lookups and stores by result"),
+            "resumes": meter.create_counter(
+                "bidi.session.resumes", unit="1", description="Session resume attempts by result"),
+            "resume_gap": meter.create_histogram(
+                "bidi.session.resume_gap", unit="ms", description="Disconnect to resumed connection"),
+            "resume_first_audio": meter.create_histogram(
+                "bidi.session.resume_first_audio", unit="ms",
+                description="Resumed connection to first bidi_audio_stream"),
+            "input_validation": meter.create_histogram(
+                "bidi.input.validation", unit="ms",
+                description="Maximum input event validation and normalization time per flush"),
+            "input_validation_time": meter.create_counter(
+                "bidi.input.validation_time", unit="ms", description="Total input event validation time"),
+            "input_rejected": meter.create_counter(
+                "bidi.input.rejected", unit="1", description="Input events rejected by validation"),
+        }
+    return _instruments
+
+
+def record_tool_run(tool: str, queue_wait_ms: float, execution_ms: float, status: str) -> None:
+    """ツールの実行(tool_executor.py)。セッションに依存しないためプロセス単位で記録する"""
+    if OTEL_AVAILABLE:
+        instruments = _get_instruments()
+        instruments["tool_queue_wait"].record(queue_wait_ms, {"tool": tool})
+        instruments["tool_execution"].record(execution_ms, {"tool": tool, "status": status})
+
+
+def record_loop_lag(lag_ms: float, tools: list[str]) -> None:
+    """閾値を超えたイベントループの遅延と、その時ループ上で動いていたツール"""
+    if OTEL_AVAILABLE:
+        instruments = _get_instruments()
+        instruments["loop_lag"].record(lag_ms)
+        for tool in tools:
+            instruments["loop_blocks"].add(1, {"tool": tool})
+
+
+def record_admission_rejected(reason: str) -> None:
+    """受け入れ制御(admission.py)で拒否した接続"""
+    if OTEL_AVAILABLE:
+        _get_instruments()["admission_rejected"].add(1, {"reason": reason})
+
+
+def observe_server(sessions: Callable[[], int], loop_lag_ms: Callable[[], float], worker: int) -> None:
+    """ワーカーの同時セッション数とイベントループの遅延をゲージとして登録する(プロセスで1回)"""
+    if not OTEL_AVAILABLE:
+        return
+    meter = metrics.get_meter("bidiagent")
+    attributes = {"worker": worker}
+    meter.create_observable_gauge(
+        "bidi.server.sessions", unit="1", description="Concurrent sessions on the worker",
+        callbacks=[lambda options: [metrics.Observation(sessions(), attributes)]])
+    meter.create_observable_gauge(
+        "bidi.loop.current_lag", unit="ms", description="Event loop lag of the worker (decayed peak)",
+        callbacks=[lambda options: [metrics.Observation(loop_lag_ms(), attributes)]])
+
+
+def record_http_cache(result: str) -> None:
+    """http_request のレスポンスキャッシュの結果(http_client.py)"""
+    if OTEL_AVAILABLE:
+        _get_instruments()["http_cache"].add(1, {"result": result})
+
+
+def record_resume(result: str) -> None:
+    """切断したセッションの再開(resumable.py)"""
+    if OTEL_AVAILABLE:
+        _get_instruments()["resumes"].add(1, {"result": result})
+
+
+def _elapsed_ms(start: float, end: float | None = None) -> float:
+    return ((end if end is not None else time.perf_counter()) - start) * 1000
+
+
+class SessionTelemetry:
+    """1セッション分の計測
+
+    websocket_handler で生成し、accepted() / agent_ready() / end() を呼ぶ。
+    送受信イベントは WebSocketBridge から record_input() / record_output() で渡される。
+
+    Args:
+        session_id: セッションID(スパンの属性に付ける)
+    """
+
+    def __init__(self, session_id: str | None = None):
+        self.session_id = session_id
+        self._enabled = OTEL_AVAILABLE
+        self._started = time.perf_counter()
+        self._accepted: float | None = None
+        self._ready: float | None = None
+        self._first_audio: float | None = None
+        self._resumed: float | None = None
+        self._speech_end: float | None = None
+        self._turn_audio_seen = False
+        self._turn_response_seen = False
+        self._tools: dict[str, tuple[str, float, object]] = {}
+
+        # OTelへ未反映の集計
+        self._bytes = Counter()
+        self._events = Counter()
+        self._histograms: list[tuple[str, float, dict]] = []
+        self._queue_depth: int | None = None
+        self._dropped = Counter()
+        self._dropped_ms = Counter()
+        self._validation_ms = Counter()
+        self._validation_max: dict[str, float] = {}
+        self._rejected = Counter()
+
+        # サマリー表示用
+        self.summary: dict[str, float] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.turns = 0
+        self.max_queue_depth = 0
+        self.dropped_bytes = 0
+        self.dropped_ms = 0.0
+        self.filtered_events = 0
+        self.resumes = 0
+        self.rejected_events = 0
+        self.max_validation_ms = 0.0
+
+        self._span = None
+        self._turn_span = None
+        if self._enabled:
+            tracer = trace.get_tracer("bidiagent")
+            self._tracer = tracer
+            self._span = tracer.start_span(
+                "bidi.session", attributes={"session.id": session_id or ""})
+
+    # --- ライフサイクル -------------------------------------------------
+
+    def accepted(self) -> None:
+        """WebSocket を accept した"""
+        self._accepted = time.perf_counter()
+        if self._ready is not None:
+            # モデル接続が accept より先に終わっていた(プール + 早期接続)
+            self._record("agent_ready", 0.0)
+
+    def agent_ready(self) -> None:
+        """モデル接続(agent.start)が完了した"""
+        self._ready = time.perf_counter()
+        if self._accepted is not None:
+            self._record("agent_ready", _elapsed_ms(self._accepted, self._ready))
+        self._add_span_event("agent_ready")
+
+    def resumed(self, gap_ms: float) -> None:
+        """切断したセッションを再開した(resumable.py)"""
+        self.resumes += 1
+        self._resumed = time.perf_counter()
+        self._record("resume_gap", gap_ms)
+        self._add_span_event("resumed")
+
+    def resumed_audio(self) -> None:
+        """再開後の最初の音声を送った"""
+        if self._resumed is not None:
+            self._record("resume_first_audio", _elapsed_ms(self._resumed))
+            self._resumed = None
+
+    def end(self, error: BaseException | None = None) -> None:
+        """セッション終了: 未反映の集計をOTelへ反映し、スパンを閉じる"""
+        for _, _, span in self._tools.values():
+            if span:
+                span.end()
+        self._tools.clear()
+        self._end_turn()
+        self._flush()
+        if self._span:
+            self._span.set_attribute("bidi.turns", self.turns)
+            if error is not None:
+                self._span.record_exception(error)
+                self._span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+            self._span.end()
+        print(f"[Telemetry] Session summary: {self.as_dict()}")
+
+    # --- イベント --------------------------------------------------------
+
+    def record_input(self, event_type: str, size: int) -> None:
+        """クライアントから受信したイベント(変換前)"""
+        self.bytes_in += size
+        self._bytes["in"] += size
+        self._events[("in", input_type(event_type))] += 1
+
+    def record_output(self, event: dict, size: int) -> None:
+        """クライアントへ送信したイベント"""
+        self.bytes_out += size
+        self._bytes["out"] += size
+        self._events[("out", event.get("type", ""))] += 1
+        self._observe(event)
+
+    def record_filtered(self, event: dict) -> None:
+        """クライアントが購読していないため送らなかったイベント(レイテンシ等の計測には使う)"""
+        self.filtered_events += 1
+        self._events[("filtered", event.get("type", ""))] += 1
+        self._observe(event)
+
+    def _observe(self, event: dict) -> None:
+        event_type = event.get("type", "")
+        if event_type == "bidi_audio_stream":
+            now = time.perf_counter()
+            if self._first_audio is None and self._accepted is not None:
+                self._first_audio = now
+                self._record("first_audio", _elapsed_ms(self._accepted, now))
+                self._add_span_event("first_audio")
+            self.resumed_audio()
+            if not self._turn_audio_seen and self._speech_end is not None:
+                self._turn_audio_seen = True
+                self._record("turn_first_audio", _elapsed_ms(self._speech_end, now))
+
+        elif event_type == "bidi_transcript_stream":
+            if event.get("role") == "user" and event.get("is_final"):
+                # ユーザー発話の終了(サーバーで観測できる最も近い時点)
+                self._end_turn()
+                self._speech_end = time.perf_counter()
+                self._turn_audio_seen = False
+                self._turn_response_seen = False
+                if self._enabled:
+                    self._turn_span = self._tracer.start_span(
+                        "bidi.turn", context=trace.set_span_in_context(self._span))
+
+        elif event_type == "bidi_response_start":
+            # ツール使用後の2回目以降の応答は数えない
+            if not self._turn_response_seen and self._speech_end is not None:
+                self._turn_response_seen = True
+                self._record("response_start", _elapsed_ms(self._speech_end))
+
+        elif event_type == "tool_use_stream":
+            tool_use = event.get("current_tool_use") or {}
+            tool_use_id = tool_use.get("toolUseId")
+            if tool_use_id and tool_use_id not in self._tools:
+                name = tool_use.get("name", "unknown")
+                span = None
+                if self._enabled:
+                    parent = self._turn_span or self._span
+                    span = self._tracer.start_span(
+                        f"bidi.tool {name}", context=trace.set_span_in_context(parent),
+                        attributes={"tool.name": name})
+                self._tools[tool_use_id] = (name, time.perf_counter(), span)
+
+        elif event_type == "tool_result":
+            tool_result = event.get("tool_result") or {}
+            entry = self._tools.pop(tool_result.get("toolUseId"), None)
+            if entry:
+                name, started, span = entry
+                self._record("tool_duration", _elapsed_ms(started), {"tool": name})
+                if span:
+                    span.set_attribute("tool.status", tool_result.get("status", ""))
+                    span.end()
+
+        elif event_type == "bidi_response_complete":
+            self.turns += 1
+            self._end_turn()
+            self._flush()
+
+    def record_output_queue(self, depth: int) -> None:
+        """出力キューの深さ(イベントを追加した直後)"""
+        if self._queue_depth is None or depth > self._queue_depth:
+            self._queue_depth = depth
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def record_output_drop(self, reason: str, size: int, duration_ms: float) -> None:
+        """送らずに捨てた音声(reason: interrupted / overflow)"""
+        self.dropped_bytes += size
+        self.dropped_ms += duration_ms
+        self._dropped[reason] += size
+        self._dropped_ms[reason] += duration_ms
+
+    def record_validation(self, event_type: str, duration_ms: float) -> None:
+        """入力イベントの検証・正規化にかかった時間"""
+        event_type = input_type(event_type)
+        self._validation_ms[event_type] += duration_ms
+        if duration_ms > self._validation_max.get(event_type, 0.0):
+            self._validation_max[event_type] = duration_ms
+        if duration_ms > self.max_validation_ms:
+            self.max_validation_ms = duration_ms
+
+    def record_rejected(self, event_type: str, reason: str) -> None:
+        """検証で拒否した入力イベント"""
+        self.rejected_events += 1
+        self._rejected[(input_type(event_type), reason)] += 1
+
+    # --- 内部 ------------------------------------------------------------
+
+    def _record(self, name: str, value_ms: float, attributes: dict | None = None) -> None:
+        self.summary[name] = round(value_ms, 1)
+        if self._enabled:
+            self._histograms.append((name, value_ms, attributes or {}))
+
+    def _add_span_event(self, name: str) -> None:
+        if self._span:
+            self._span.add_event(name)
+
+    def _end_turn(self) -> None:
+        if self._turn_span:
+            self._turn_span.end()
+            self._turn_span = None
+
+    def _flush(self) -> None:
+        """溜めた集計をOTelの計器に反映する"""
+        if not self._enabled:
+            return
+        instruments = _get_instruments()
+        for name, value, attributes in self._histograms:
+            instruments[name].record(value, attributes)
+        self._histograms.clear()
+        for direction, size in self._bytes.items():
+            instruments["bytes"].add(size, {"direction": direction})
+        self._bytes.clear()
+        for (direction, event_type), count in self._events.items():
+            instruments["events"].add(count, {"direction": direction, "type": event_type})
+        self._events.clear()
+        if self._queue_depth is not None:
+            instruments["queue_depth"].record(self._queue_depth)
+            self._queue_depth = None
+        for reason, size in self._dropped.items():
+            instruments["dropped_bytes"].add(size, {"reason": reason})
+        self._dropped.clear()
+        for reason, duration_ms in self._dropped_ms.items():
+            instruments["dropped_audio"].add(duration_ms, {"reason": reason})
+        self._dropped_ms.clear()
+        for event_type, duration_ms in self._validation_max.items():
+            instruments["input_validation"].record(duration_ms, {"type": event_type})
+        self._validation_max.clear()
+        for event_type, duration_ms in self._validation_ms.items():
+            instruments["input_validation_time"].add(duration_ms, {"type": event_type})
+        self._validation_ms.clear()
+        for (event_type, reason), count in self._rejected.items():
+            instruments["input_rejected"].add(count, {"type": event_type, "reason": reason})
+        self._rejected.clear()
+
+    def as_dict(self) -> dict:
+        return {
+            "duration_ms": round(_elapsed_ms(self._started)),
+            "turns": self.turns,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "filtered_events": self.filtered_events,
+            "resumes": self.resumes,
+            "max_queue_depth": self.max_queue_depth,
+            "dropped_bytes": self.dropped_bytes,
+            "dropped_ms": round(self.dropped_ms),
+            "rejected_events": self.rejected_events,
+            "max_validation_ms": round(self.max_validation_ms, 2),
+            **self.summary,
+        }
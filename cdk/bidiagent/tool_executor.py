@@ -0,0 +1,271 @@
+"""
+ツール実行の隔離
+
+calculator / http_request(strands_tools)は同期関数で、Strands は asyncio.to_thread で
+プロセス共通のデフォルトスレッドプールに投げる。プールには上限付きの待ち行列が無く、DNS解決等とも共有のため、
+多数のセッションで遅い HTTP リクエストが重なると他の処理(全セッションの音声中継)が詰まる。
+
+ToolExecutor はツールをラップし、次のように実行する。
+
+- offload=True のツールは専用のスレッドプール(BIDI_TOOL_WORKERS)で実行する。
+  ツールの stream をワーカースレッドのイベントループで最後まで回すため、ツール内の
+  to_thread もそのワーカー上で実行される(デフォルトのプールを使わない)
+- ツールごとの同時実行数(BIDI_TOOL_LIMITS)とタイムアウト(BIDI_TOOL_TIMEOUTS / BIDI_TOOL_TIMEOUT)。
+  タイムアウトしたツールはエラーの結果をモデルに返す(スレッドは止められないため、
+  終了するまで同時実行数の枠は空かない)
+- 待ち時間(枠とスレッドが空くまで)と実行時間を telemetry に記録する
+- イベントループの遅延を監視し(monitor)、閾値を超えたらその時ループ上で実行中のツール
+  (offload=False のツール)を警告に出す
+
+    BIDI_TOOL_LIMITS="http_request=4,calculator=8"
+    BIDI_TOOL_TIMEOUTS="http_request=15"
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import threading
+import time
+from collections import Counter
+from types import ModuleType
+from typing import Any, Callable
+
+from strands.tools.loader import load_tools_from_module
+from strands.types._events import ToolResultEvent
+from strands.types.tools import AgentTool, ToolGenerator, ToolSpec, ToolUse
+
+import telemetry
+
+# ツール実行用のスレッド数(プロセス共通)
+TOOL_WORKERS = int(os.environ.get("BIDI_TOOL_WORKERS", "8"))
+
+# ツールのタイムアウト(秒)の既定値
+TOOL_TIMEOUT = float(os.environ.get("BIDI_TOOL_TIMEOUT", "30"))
+
+# イベントループの遅延の監視間隔と警告の閾値(ms)
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("BIDI_LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_LAG_WARN_MS = float(os.environ.get("BIDI_LOOP_LAG_WARN_MS", "100"))
+
+
+def parse_limits(value: str | None) -> dict[str, float]:
+    """"name=value,name=value" を dict にする"""
+    limits = {}
+    for item in (value or "").split(","):
+        name, _, limit = item.partition("=")
+        if name.strip() and limit.strip():
+            limits[name.strip()] = float(limit)
+    return limits
+
+
+# ツールごとの同時実行数(未指定のツールは TOOL_WORKERS)とタイムアウト(秒)
+TOOL_LIMITS = {name: int(limit) for name, limit in parse_limits(os.environ.get("BIDI_TOOL_LIMITS")).items()}
+TOOL_TIMEOUTS = parse_limits(os.environ.get("BIDI_TOOL_TIMEOUTS"))
+
+
+class _InlineExecutor(concurrent.futures.ThreadPoolExecutor):
+    """呼び出し元のスレッドでその場で実行する Executor(ワーカー内の to_thread 用)
+
+    set_default_executor が ThreadPoolExecutor しか受け付けないため継承している(スレッドは作らない)。
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+_local = threading.local()
+
+
+def _drain_in_thread(stream: ToolGenerator) -> list:
+    """ワーカースレッドのイベントループでツールの stream を最後まで回し、イベントを返す"""
+    loop = getattr(_local, "loop", None)
+    if loop is None:
+        loop = _local.loop = asyncio.new_event_loop()
+        loop.set_default_executor(_InlineExecutor())
+
+    async def collect() -> list:
+        return [event async for event in stream]
+
+    return loop.run_until_complete(collect())
+
+
+def _error_result(tool_use: ToolUse, message: str) -> ToolResultEvent:
+    return ToolResultEvent({
+        "toolUseId": tool_use["toolUseId"],
+        "status": "error",
+        "content": [{"text": message}],
+    })
+
+
+class ExecutorTool(AgentTool):
+    """ToolExecutor 経由で実行するツールのラッパー(名前・仕様は元のツールのまま)"""
+
+    def __init__(self, tool: AgentTool, executor: "ToolExecutor", offload: bool):
+        super().__init__()
+        self._tool = tool
+        self._executor = executor
+        self._offload = offload
+
+    @property
+    def tool_name(self) -> str:
+        return self._tool.tool_name
+
+    @property
+    def tool_spec(self) -> ToolSpec:
+        return self._tool.tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self._tool.tool_type
+
+    async def stream(self, tool_use: ToolUse, invocation_state: dict[str, Any], **kwargs: Any) -> ToolGenerator:
+        if self._offload:
+            for event in await self._executor.run(self._tool, tool_use, invocation_state, **kwargs):
+                yield event
+        else:
+            with self._executor.on_loop(self.tool_name):
+                async for event in self._tool.stream(tool_use, invocation_state, **kwargs):
+                    yield event
+
+
+class ToolExecutor:
+    """ツールの実行先(プロセスで1つ)
+
+    Args:
+        workers: スレッド数
+        limits: ツールごとの同時実行数
+        timeouts: ツールごとのタイムアウト(秒)
+        default_timeout: timeouts に無いツールのタイムアウト(秒)
+    """
+
+    def __init__(
+        self,
+        workers: int = TOOL_WORKERS,
+        limits: dict[str, int] | None = None,
+        timeouts: dict[str, float] | None = None,
+        default_timeout: float = TOOL_TIMEOUT,
+    ):
+        self.workers = workers
+        self.limits = TOOL_LIMITS if limits is None else limits
+        self.timeouts = TOOL_TIMEOUTS if timeouts is None else timeouts
+        self.default_timeout = default_timeout
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="bidi-tool")
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        # ループ上で実行中のツール(offload=False)と、監視の1周期の間にループ上で動いたツール
+        self._on_loop = Counter()
+        self._seen_on_loop: set[str] = set()
+
+        # カウンタ
+        self.calls = Counter()
+        self.timeouts_hit = Counter()
+        self.loop_blocks = Counter()
+
+    def wrap(self, tools: list, offload: bool = True) -> list[AgentTool]:
+        """BidiAgent の tools に渡すツール(モジュール / @tool / AgentTool)をラップする"""
+        wrapped = []
+        for tool in tools:
+            if isinstance(tool, ModuleType):
+                loaded = load_tools_from_module(tool, tool.__name__.split(".")[-1])
+            else:
+                loaded = [tool]
+            wrapped.extend(ExecutorTool(agent_tool, self, offload) for agent_tool in loaded)
+        return wrapped
+
+    async def run(self, tool: AgentTool, tool_use: ToolUse, invocation_state: dict[str, Any], **kwargs: Any) -> list:
+        """ツールを専用のスレッドで実行し、イベントのリストを返す"""
+        name = tool.tool_name
+        timeout = self.timeouts.get(name, self.default_timeout)
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            semaphore = self._semaphores[name] = asyncio.Semaphore(self.limits.get(name, self.workers))
+        self.calls[name] += 1
+
+        queued = time.perf_counter()
+        times = {}
+
+        def work() -> list:
+            times["started"] = time.perf_counter()
+            try:
+                return _drain_in_thread(tool.stream(tool_use, invocation_state, **kwargs))
+            finally:
+                times["finished"] = time.perf_counter()
+
+        status = "cancelled"
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+            future = asyncio.get_running_loop().run_in_executor(self._pool, work)
+            # スレッドが終わるまで枠を返さない(タイムアウト後も実行は続くため)
+            future.add_done_callback(lambda _: semaphore.release())
+            remaining = timeout - (time.perf_counter() - queued)
+            events = await asyncio.wait_for(asyncio.shield(future), max(remaining, 0))
+            status = "success"
+            return events
+        except asyncio.TimeoutError:
+            status = "timeout"
+            self.timeouts_hit[name] += 1
+            print(f"[ToolExecutor] {name} timed out after {timeout:.0f} s")
+            return [_error_result(tool_use, f"Tool {name} timed out after {timeout:.0f} seconds")]
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            started = times.get("started", time.perf_counter())
+            finished = times.get("finished", time.perf_counter())
+            telemetry.record_tool_run(
+                name, (started - queued) * 1000, (finished - started) * 1000 if "started" in times else 0.0, status)
+
+    @contextlib.contextmanager
+    def on_loop(self, name: str):
+        """ループ上でツールを実行している間、名前を登録しておく(遅延の原因の候補)"""
+        self._on_loop[name] += 1
+        self._seen_on_loop.add(name)
+        try:
+            yield
+        finally:
+            self._on_loop[name] -= 1
+            if not self._on_loop[name]:
+                del self._on_loop[name]
+
+    async def monitor(
+        self,
+        interval_ms: float = LOOP_LAG_INTERVAL_MS,
+        warn_ms: float = LOOP_LAG_WARN_MS,
+        on_lag: Callable[[float], None] | None = None,
+    ) -> None:
+        """イベントループの遅延を監視する(サーバーの lifespan でタスクとして動かす)
+
+        on_lag には測定のたびに遅延(ms)を渡す(受け入れ制御 admission.py 用)。
+        """
+        loop = asyncio.get_running_loop()
+        interval = interval_ms / 1000
+        while True:
+            started = loop.time()
+            self._seen_on_loop = set(self._on_loop)
+            await asyncio.sleep(interval)
+            lag_ms = max((loop.time() - started - interval) * 1000, 0.0)
+            if on_lag:
+                on_lag(lag_ms)
+            if lag_ms < warn_ms:
+                continue
+            # この周期の間にループ上で動いたツールを候補とする
+            suspects = sorted(self._seen_on_loop)
+            for name in suspects:
+                self.loop_blocks[name] += 1
+            telemetry.record_loop_lag(lag_ms, suspects)
+            print(f"[ToolExecutor] Event loop blocked for {lag_ms:.0f} ms "
+                  f"(tools on the loop: {suspects or 'none'})")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "calls": dict(self.calls),
+            "timeouts": dict(self.timeouts_hit),
+            "loop_blocks": dict(self.loop_blocks),
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
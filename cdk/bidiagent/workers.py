@@ -0,0 +1,175 @@
+"""
+マルチワーカー起動
+
+app.run() は1プロセス・1イベントループで動くため、全セッションの base64 / JSON の処理や
+Opus の変換が1つの GIL を取り合い、ARM64 ホストの複数コアを使えない。
+BIDI_WORKERS > 1 の場合は、起動時に BIDI_WORKERS 個のワーカープロセスを立ち上げる。
+
+- 各ワーカーは SO_REUSEPORT で同じポート(8080)に bind し、自分のソケットで accept する。
+  1つのソケットを共有すると、イベントループが空いているワーカーが接続をまとめて accept して
+  偏るため、接続の割り振りはカーネル(接続元アドレス・ポートのハッシュ)に任せる
+- ワーカーは spawn で起動し、それぞれ agent.py を import して lifespan(エージェントプール、
+  ツールの監視等)を持つ。親プロセスは OpenTelemetry の自動計装のスレッドを持つため fork はしない。
+  自動計装は環境変数で子プロセスにも引き継がれる
+- spawn の子プロセスは親の __main__ を __mp_main__ として import し直すため、親はこのモジュール
+  (agent.py を import しない)から起動する。agent.py から起動すると、子プロセスで agent.py の
+  モジュールレベルの構築(エージェントプール、ツールのスレッドプール、HTTPクライアント等)が2回行われ、
+  片方は使われない。python -m agent で BIDI_WORKERS > 1 の場合は、このモジュールで起動し直す
+- ポートで待ち受けるのは lifespan の開始(エージェントプールの充填開始)の後
+- 異常終了したワーカーは親プロセスが起動し直す。SIGTERM / SIGINT は全ワーカーに伝える
+
+ワーカーごとの同時セッション数の上限は BIDI_MAX_SESSIONS_PER_WORKER(0 なら上限なし)。
+上限に達したワーカーは新しい接続を close code 1013(Try Again Later)で閉じる
+(再接続すると接続元ポートが変わり、別のワーカーに割り振られうる)。
+各ワーカーのセッション数は共有メモリに書き、コンテナ全体の上限(admission.py)の判定に使う。
+
+    BIDI_WORKERS=4 python -m workers
+    BIDI_WORKERS=auto python -m workers    # CPU数
+
+プロセスごとにメモリ(Strands 等の import とエージェントプール)が増えるため、
+ワーカー数はコンテナのメモリに合わせて決める。test/bench_workers.py でワーカー数ごとの
+セッション数の上限を比較できる。
+"""
+import importlib
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import TYPE_CHECKING
+
+import uvicorn
+
+if TYPE_CHECKING:
+    from bedrock_agentcore.runtime import BedrockAgentCoreApp
+
+# ワーカープロセス数("auto" または 0 で CPU数)
+WORKERS = os.environ.get("BIDI_WORKERS", "1")
+
+# ワーカーごとの同時セッション数の上限(0 なら上限なし)
+MAX_SESSIONS_PER_WORKER = int(os.environ.get("BIDI_MAX_SESSIONS_PER_WORKER", "0"))
+
+
+# 全ワーカーのセッション数(親プロセスが作る共有メモリ)と、このワーカーの番号。1プロセスで動く場合は None / 0
+_shared_sessions = None
+_worker_index = 0
+
+
+def worker_index() -> int:
+    return _worker_index
+
+
+def worker_slots() -> int:
+    """ワーカー数(1プロセスなら1)"""
+    return len(_shared_sessions) if _shared_sessions is not None else 1
+
+
+def report_sessions(count: int) -> None:
+    """このワーカーの同時セッション数を共有メモリに書く"""
+    if _shared_sessions is not None:
+        _shared_sessions[_worker_index] = count
+
+
+def total_sessions(local: int) -> int:
+    """全ワーカーの同時セッション数(1プロセスなら local)"""
+    if _shared_sessions is None:
+        return local
+    return sum(_shared_sessions)
+
+
+def worker_count(value: str | int = WORKERS) -> int:
+    """BIDI_WORKERS の値を解釈する"""
+    if str(value).strip().lower() in ("auto", "0"):
+        return os.cpu_count() or 1
+    return max(int(value), 1)
+
+
+def load_app(import_string: str) -> "BedrockAgentCoreApp":
+    """"module:attribute" 形式のアプリを import する"""
+    module_name, _, attribute = import_string.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+def serve(app: "BedrockAgentCoreApp | None" = None, import_string: str = "agent:app", port: int = 8080,
+          workers: str | int = WORKERS) -> None:
+    """サーバーを起動する(ワーカー数が1なら従来どおり app.run())
+
+    Args:
+        app: サーバーのアプリ(1プロセスで動く場合に使う。Noneなら import_string から import する)
+        import_string: ワーカーが import するアプリ(親プロセスでは import しない)
+        port: 待ち受けるポート
+        workers: ワーカー数(BIDI_WORKERS と同じ書式)
+    """
+    count = worker_count(workers)
+    if count == 1:
+        (app or load_app(import_string)).run(port=port)
+        return
+
+    # app.run() と同じ既定値(コンテナ内では全インターフェースで待ち受ける)
+    if os.path.exists("/.dockerenv") or os.environ.get("DOCKER_CONTAINER"):
+        host = "0.0.0.0"  # nosec B104
+    else:
+        host = "127.0.0.1"
+    print(f"[Workers] Starting {count} workers on {host}:{port} "
+          f"(max sessions per worker: {MAX_SESSIONS_PER_WORKER or 'unlimited'})")
+    _supervise(count, import_string, host, port)
+
+
+def _run_worker(index: int, shared_sessions, import_string: str, host: str, port: int) -> None:
+    """ワーカープロセスの本体: 自分のソケット(SO_REUSEPORT)でサーバーを動かす"""
+    global _shared_sessions, _worker_index
+    _shared_sessions, _worker_index = shared_sessions, index
+    # 異常終了したワーカーの値を引き継がない
+    shared_sessions[index] = 0
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    # agent.py はこのプロセスで1回だけ import される(__mp_main__ はこのモジュール)
+    app = load_app(import_string)
+    # app.run() と同じログの設定
+    config = uvicorn.Config(app, host=host, port=port, access_log=app.debug,
+                            log_level="info" if app.debug else "warning")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _supervise(count: int, import_string: str, host: str, port: int) -> None:
+    """ワーカーを起動し、終了したものを起動し直す。SIGTERM / SIGINT で全ワーカーを止める"""
+    context = multiprocessing.get_context("spawn")
+    shared_sessions = context.RawArray("i", count)
+    stopping = False
+
+    def start(index: int) -> multiprocessing.Process:
+        process = context.Process(
+            target=_run_worker, args=(index, shared_sessions, import_string, host, port),
+            name=f"bidi-worker-{index}")
+        process.start()
+        return process
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = [start(index) for index in range(count)]
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not stopping:
+                    print(f"[Workers] Worker pid {process.pid} exited with {process.exitcode}, restarting")
+                    processes[index] = start(index)
+    finally:
+        # uvicorn は SIGTERM で待ち受けを止め、接続を閉じて lifespan の終了処理を行ってから止まる
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        print("[Workers] All workers stopped")
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,23 +1,26 @@
 import asyncio
+import os
+import sys
 
 from strands.experimental.bidi import BidiAgent
 from strands.experimental.bidi.io import BidiAudioIO, BidiTextIO
-from strands.experimental.bidi.models import BidiNovaSonicModel
 from strands.experimental.bidi.tools import stop_conversation
 
 from strands_tools import http_request, calculator
 
+# モデルの選択はデプロイ用サーバー(cdk/bidiagent)と共通
+# (BIDI_MODEL=fake で Bedrock に接続しないフェイクモデル)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cdk", "bidiagent"))
+from models import create_model
+
 # 双方向ストリーミングでは @app.websocket を用いる
 from bedrock_agentcore import BedrockAgentCoreApp
 app = BedrockAgentCoreApp()
 
 @app.websocket
 async def main() -> None:
-    # モデルはNova 2 Sonicを使う
-    model = BidiNovaSonicModel(
-        model_id='amazon.nova-2-sonic-v1:0',
-        provider_config={"audio": {"voice": "tiffany",}},
-    )
+    # モデルはNova 2 Sonicを使う(BIDI_MODEL=fake でオフライン用のフェイクモデル)
+    model = create_model(voice="tiffany")
 
     # stop_conversation toolは、ユーザーがエージェントの実行を口頭で停止できるようにします。
     agent = BidiAgent(
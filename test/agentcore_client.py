@@ -16,6 +16,38 @@ SigV4認証を使用してWebSocket接続を確立し、音声でやり取りす
 
     # リージョン指定
     python test/agentcore_client.py --region us-west-2
+
+    # 音声をbase64入りJSONで送受信する（バイナリフレームを使わない）
+    python test/agentcore_client.py --transport json
+
+    # 送信音声を100msずつまとめて送る（autoならRTTに合わせて20〜100msで調整）
+    python test/agentcore_client.py --frame-ms 100
+    python test/agentcore_client.py --frame-ms auto
+
+    # 無音区間の音声を送らない（VAD、要numpy）
+    python test/agentcore_client.py --vad
+
+    # 音声をOpusで圧縮して送受信する（要opuslib + libopus）
+    python test/agentcore_client.py --codec opus
+
+    # 送受信したメッセージを記録する（test/replay_session.py で再生できる）
+    python test/agentcore_client.py --record session.bidirec
+
+    # 応答音声を再生位置の300ms先までに絞って送ってもらう（割り込み時に捨てる音声を減らす）
+    python test/agentcore_client.py --audio-lead-ms 300
+
+    # 使用量・途中のトランスクリプトも含めてすべてのイベントを受け取る（既定では要求しない）
+    python test/agentcore_client.py --all-events
+
+    # 接続が切れても再接続しない（既定では自動で再接続し、サーバーのセッションを再開する）
+    python test/agentcore_client.py --no-resume
+
+    # WebSocketを先に開いておき、最初の発話から接続の待ち時間をなくす（署名は常に事前に用意する）
+    python test/agentcore_client.py --warm
+
+    # マイク・スピーカーを48kHzステレオで開く（既定はデバイスのネイティブのレート・モノラル。
+    # モデルの16kHzモノラルとの変換はクライアントで行う、要numpy）
+    python test/agentcore_client.py --device-rate 48000 --device-channels 2
 """
 import asyncio
 import websockets
@@ -23,11 +55,29 @@ import json
 import base64
 import sys
 import os
-import queue
-import threading
-
-# AgentCore Runtime SDK
-from bedrock_agentcore.runtime import AgentCoreRuntimeClient
+import uuid
+
+# サーバー(cdk/bidiagent)と共通のバイナリフレーム定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import codec
+import control
+import framing
+from json_codec import default_codec
+from recorder import DOWNLINK, UPLINK, SessionRecorder
+from resume_client import ResumeState, run_with_resume
+from connection_manager import ConnectionManager, runtime_client
+
+from audio_pipeline import (
+    NUMPY_AVAILABLE,
+    AdaptiveFrameSize,
+    AudioConverter,
+    FrameCoalescer,
+    JitterBuffer,
+    MessageRateMeter,
+    VoiceActivityDetector,
+    adapt_frame_size,
+    device_format,
+)
 
 # PyAudioのインポート（音声入出力用）
 try:
@@ -41,93 +91,102 @@ except ImportError:
 
 # オーディオ設定
 # Nova Sonicは入出力ともに16kHz
+# （モデルとやり取りする形式。デバイスはネイティブの形式で開き、AudioConverter で変換する）
 SAMPLE_RATE = 16000  # 16kHz
 INPUT_SAMPLE_RATE = SAMPLE_RATE
 OUTPUT_SAMPLE_RATE = SAMPLE_RATE
 CHANNELS = 1         # モノラル
-CHUNK_SIZE = 512     # フレームサイズ
+CHUNK_SIZE = 512     # フレームサイズ（モデルのレートで。デバイスでは同じ長さ(32ms)になるフレーム数）
 FORMAT = pyaudio.paInt16 if PYAUDIO_AVAILABLE else None  # 16bit PCM
 
+# 再接続の間に溜めておくマイク音声の長さ（秒、超えたら古いものから捨てる）
+MAX_BUFFERED_AUDIO_S = 10
+
 
 class AudioPlayer:
-    """受信した音声データを再生するクラス（非同期再生対応）
+    """受信した音声データを再生するクラス（コールバック方式・ジッタバッファ付き）
+
+    受信した音声はリングバッファ(JitterBuffer)に書き込むだけで即座に戻り、
+    PyAudio のコールバックスレッドが必要な分だけ取り出して再生する。
+    割り込み時にはバッファを O(1) で破棄して即座に再生を停止できる。
 
-    別スレッドで音声を再生することで、メインの受信処理をブロックしない。
-    割り込み時にはキューをクリアして即座に再生を停止できる。
+    出力デバイスは device_rate / device_channels（None ならネイティブのレート）で開き、
+    受信した音声はその形式に変換してからバッファに書き込む（受信した形式が変わったら変換も作り直す）。
     """
 
-    def __init__(self, sample_rate: int = OUTPUT_SAMPLE_RATE):
+    def __init__(self, device_rate: int | None = None, device_channels: int = 1):
         if not PYAUDIO_AVAILABLE:
             return
 
         self.pa = pyaudio.PyAudio()
-        self._sample_rate = sample_rate
+        self._sample_rate, self._channels = device_format(
+            self.pa, True, OUTPUT_SAMPLE_RATE, device_rate, device_channels)
+        self._frame_bytes = self._channels * self.pa.get_sample_size(FORMAT)
+        self.buffer = JitterBuffer(self._sample_rate, self._channels, self.pa.get_sample_size(FORMAT))
+        self.converter = AudioConverter(OUTPUT_SAMPLE_RATE, CHANNELS, self._sample_rate, self._channels)
+        self.stream = None
+        self._running = True
+        print(f"[AudioPlayer] Initialized with sample_rate={self._sample_rate}, channels={self._channels}")
+
+    def start(self):
+        """コールバック方式で再生ストリームを開始"""
+        if not PYAUDIO_AVAILABLE:
+            return
         self.stream = self.pa.open(
             format=FORMAT,
-            channels=CHANNELS,
-            rate=sample_rate,
+            channels=self._channels,
+            rate=self._sample_rate,
             output=True,
-            frames_per_buffer=CHUNK_SIZE  # 小さめのバッファで遅延を減らす
+            frames_per_buffer=CHUNK_SIZE * self._sample_rate // OUTPUT_SAMPLE_RATE,  # 小さめのバッファで遅延を減らす
+            stream_callback=self._playback_callback
         )
-        self._running = True
-        self._audio_queue = queue.Queue()
-        self._playback_thread = None
-        print(f"[AudioPlayer] Initialized with sample_rate={sample_rate}")
+        self.stream.start_stream()
+        print("[AudioPlayer] Playback stream started")
 
-    def start(self):
-        """再生スレッドを開始"""
+    def _playback_callback(self, in_data, frame_count, time_info, status):
+        """PyAudioのコールバック（別スレッドで実行）: バッファから1回分を取り出す"""
+        return (self.buffer.read(frame_count * self._frame_bytes), pyaudio.paContinue)
+
+    @property
+    def latency_ms(self) -> float:
+        """今受け取った音声が再生されるまでの時間(ms): バッファ + 出力デバイスの遅延"""
         if not PYAUDIO_AVAILABLE:
-            return
-        self._playback_thread = threading.Thread(target=self._playback_loop, daemon=True)
-        self._playback_thread.start()
-        print("[AudioPlayer] Playback thread started")
+            return 0.0
+        device_ms = self.stream.get_output_latency() * 1000 if self.stream else 0.0
+        return self.buffer.buffered_ms + device_ms
 
-    def _playback_loop(self):
-        """別スレッドで音声を再生（ブロッキングをメインスレッドから分離）"""
-        while self._running:
-            try:
-                # タイムアウト付きでキューから取得（停止時にスレッドが終了できるように）
-                audio_bytes = self._audio_queue.get(timeout=0.1)
-                if audio_bytes is None:  # 終了シグナル
-                    break
-                self.stream.write(audio_bytes)
-            except queue.Empty:
-                continue
-            except Exception as e:
-                if self._running:
-                    print(f"[AudioPlayer] Playback error: {e}")
+    def stats(self) -> dict:
+        """ジッタバッファの状態（遅延・目標深さ・アンダーラン/オーバーラン回数）"""
+        if not PYAUDIO_AVAILABLE:
+            return {}
+        return {"latency_ms": round(self.latency_ms), **self.buffer.stats()}
 
-    def play(self, audio_bytes: bytes):
-        """音声データをキューに追加（ノンブロッキング）"""
+    def play(self, audio_bytes: bytes, sample_rate: int = OUTPUT_SAMPLE_RATE, channels: int = CHANNELS):
+        """音声データを出力デバイスの形式に変換してバッファに追加（ノンブロッキング）"""
         if not PYAUDIO_AVAILABLE or not self._running:
             return
-        self._audio_queue.put(audio_bytes)
+        if sample_rate != self.converter.in_rate or channels != self.converter.in_channels:
+            self.converter = AudioConverter(sample_rate, channels, self._sample_rate, self._channels)
+        self.buffer.write(self.converter.convert(audio_bytes))
 
     def clear(self):
-        """割り込み時にキューをクリアして再生を即座に停止"""
+        """割り込み時に未再生の音声を破棄して再生を即座に停止"""
         if not PYAUDIO_AVAILABLE:
             return
-        cleared_count = 0
-        while not self._audio_queue.empty():
-            try:
-                self._audio_queue.get_nowait()
-                cleared_count += 1
-            except queue.Empty:
-                break
-        if cleared_count > 0:
-            print(f"[AudioPlayer] Cleared {cleared_count} audio chunks (interrupted)")
+        self.converter.reset()
+        cleared_ms = self.buffer.clear()
+        if cleared_ms > 0:
+            print(f"[AudioPlayer] Cleared {cleared_ms:.0f} ms of audio (interrupted)")
 
     def stop(self):
         """再生を停止"""
         self._running = False
-        # 終了シグナルを送る
-        self._audio_queue.put(None)
-        if self._playback_thread and self._playback_thread.is_alive():
-            self._playback_thread.join(timeout=1.0)
         if PYAUDIO_AVAILABLE:
+            print(f"[AudioPlayer] Stats: {self.stats()}")
             try:
-                self.stream.stop_stream()
-                self.stream.close()
+                if self.stream:
+                    self.stream.stop_stream()
+                    self.stream.close()
                 self.pa.terminate()
             except Exception:
                 pass
@@ -135,39 +194,67 @@ class AudioPlayer:
 
 
 class AudioRecorder:
-    """マイクから音声を録音するクラス"""
+    """マイクから音声を録音するクラス
+
+    入力デバイスは device_rate / device_channels（None ならネイティブのレート）で開き、
+    コールバックスレッドでモデルの形式（INPUT_SAMPLE_RATE のモノラル）に変換してからキューに入れる。
+    """
 
-    def __init__(self):
+    def __init__(self, device_rate: int | None = None, device_channels: int = 1):
         if not PYAUDIO_AVAILABLE:
             return
 
         self.pa = pyaudio.PyAudio()
-        self.audio_queue = queue.Queue()
+        self._sample_rate, self._channels = device_format(
+            self.pa, False, INPUT_SAMPLE_RATE, device_rate, device_channels)
+        self.converter = AudioConverter(self._sample_rate, self._channels, INPUT_SAMPLE_RATE, CHANNELS)
+        self.audio_queue: asyncio.Queue | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
         self._running = False
         self._stream = None
+        # 再接続中など送信が止まっている間に溜められるチャンク数
+        self.max_chunks = int(MAX_BUFFERED_AUDIO_S * INPUT_SAMPLE_RATE / CHUNK_SIZE)
+        self.dropped_chunks = 0
 
     def _audio_callback(self, in_data, frame_count, time_info, status):
-        """PyAudioのコールバック（別スレッドで実行）"""
+        """PyAudioのコールバック（別スレッドで実行）
+
+        イベントループのキューへ call_soon_threadsafe で渡し、
+        送信側を音声の到着と同時に起こす。
+        """
         if self._running:
-            self.audio_queue.put(in_data)
+            try:
+                self._loop.call_soon_threadsafe(self._enqueue, self.converter.convert(in_data))
+            except RuntimeError:
+                # 停止処理中にイベントループが閉じられた
+                pass
         return (None, pyaudio.paContinue)
 
     def start(self):
-        """録音を開始"""
+        """録音を開始（イベントループ上で呼ぶ）"""
         if not PYAUDIO_AVAILABLE:
             return
 
+        self._loop = asyncio.get_running_loop()
+        self.audio_queue = asyncio.Queue()
         self._running = True
         self._stream = self.pa.open(
             format=FORMAT,
-            channels=CHANNELS,
-            rate=INPUT_SAMPLE_RATE,
+            channels=self._channels,
+            rate=self._sample_rate,
             input=True,
-            frames_per_buffer=CHUNK_SIZE,
+            frames_per_buffer=CHUNK_SIZE * self._sample_rate // INPUT_SAMPLE_RATE,
             stream_callback=self._audio_callback
         )
         self._stream.start_stream()
-        print("[AudioRecorder] Started recording")
+        print(f"[AudioRecorder] Started recording ({self.converter})")
+
+    def _enqueue(self, chunk: bytes):
+        """キューに追加する（上限を超えたら一番古いチャンクを捨てる）"""
+        if self.audio_queue.qsize() >= self.max_chunks:
+            self.audio_queue.get_nowait()
+            self.dropped_chunks += 1
+        self.audio_queue.put_nowait(chunk)
 
     def stop(self):
         """録音を停止"""
@@ -183,34 +270,59 @@ class AudioRecorder:
                 self.pa.terminate()
             except Exception:
                 pass
+        if self.dropped_chunks:
+            print(f"[AudioRecorder] Dropped {self.dropped_chunks} buffered chunks while disconnected")
         print("[AudioRecorder] Stopped recording")
 
-    def get_audio_chunk(self) -> bytes | None:
-        """キューから音声チャンクを取得（ノンブロッキング）"""
-        try:
-            return self.audio_queue.get_nowait()
-        except queue.Empty:
-            return None
+    async def get_audio_chunks(self) -> list[bytes]:
+        """音声チャンクが届くまで待ち、キューに溜まっている分をまとめて取得"""
+        chunks = [await self.audio_queue.get()]
+        while not self.audio_queue.empty():
+            chunks.append(self.audio_queue.get_nowait())
+        return chunks
 
 
-def get_websocket_connection(region: str, runtime_arn: str):
+def get_websocket_connection(region: str, runtime_arn: str, session_id: str | None = None):
     """
     AgentCore RuntimeへのWebSocket接続情報を取得
 
     Args:
         region: AWSリージョン
         runtime_arn: AgentCore RuntimeのARN
+        session_id: ランタイムのセッションID（Noneなら新しく生成される）。
+            再接続で同じIDを使うと、同じセッション（コンテナ）に振り分けられる
 
     Returns:
         (ws_url, headers): WebSocket URLと認証ヘッダー
+
+    ランタイムクライアント（解決済みの認証情報）はリージョンごとに使い回す（connection_manager.py）。
     """
-    client = AgentCoreRuntimeClient(region=region)
-    ws_url, headers = client.generate_ws_connection(runtime_arn=runtime_arn)
+    client = runtime_client(region)
+    ws_url, headers = client.generate_ws_connection(runtime_arn=runtime_arn, session_id=session_id)
     return ws_url, headers
 
 
-async def audio_session(region: str, runtime_arn: str):
-    """マイク入力を使った音声対話セッション"""
+async def audio_session(region: str, runtime_arn: str, transport: str = "binary", frame_ms: str = "0",
+                        vad: bool = False, audio_codec: str = "pcm", record: str | None = None,
+                        audio_lead_ms: int | None = None, all_events: bool = False, resume: bool = True,
+                        warm: bool = False, device_rate: int | None = None, device_channels: int = 1):
+    """マイク入力を使った音声対話セッション
+
+    transport="binary" の場合はサブプロトコルでバイナリフレームを提示し、
+    サーバーが対応していなければJSONにフォールバックする。
+    frame_ms は送信音声を何msずつまとめるか（"0" でまとめない、"auto" でRTTに合わせる）。
+    vad=True の場合は無音区間の音声を送らず、無音マーカーで長さだけを送る。
+    audio_codec="opus" の場合は、サーバーが対応していれば音声をOpusで圧縮して送受信する。
+    record を指定すると、送受信したメッセージをそのファイルに記録する（test/replay_session.py で再生できる）。
+    audio_lead_ms を指定すると、サーバーに応答音声を再生位置のその長さ先までに絞って送るよう要求する。
+    all_events=False の場合は、表示に使わないイベント（使用量、途中のトランスクリプト）を送らないよう要求する。
+    resume=True の場合は、接続が切れたら再接続してサーバーのセッションを再開する（resume_client.py）。
+    再接続の間のマイク音声は溜めておき、再接続後にまとめて送る。
+    接続情報（署名）は ConnectionManager で先に用意し、期限前に署名し直す（再接続でも署名を待たない）。
+    warm=True の場合は WebSocket も先に開いておく。
+    マイク・スピーカーは device_rate / device_channels（None ならネイティブのレート）で開き、
+    モデルの形式（16kHz モノラル）との変換はクライアントで行う（audio_pipeline.AudioConverter）。
+    """
     if not PYAUDIO_AVAILABLE:
         print("[Error] PyAudio is required for audio session.")
         print("Install with: pip install pyaudio")
@@ -221,54 +333,139 @@ async def audio_session(region: str, runtime_arn: str):
     print("=" * 60)
     #print(f"Runtime ARN: {runtime_arn}")
     print(f"Region: {region}")
+    print(f"Transport: {transport}")
+    print(f"Frame: {frame_ms} ms")
+    print(f"VAD: {'on' if vad else 'off'}")
+    print(f"Codec: {audio_codec}")
+    print(f"Resume: {'on' if resume else 'off'}")
+    print(f"Warm connection: {'on' if warm else 'off'}")
+    if audio_lead_ms is not None:
+        print(f"Audio lead: {audio_lead_ms} ms")
     print("Speak into your microphone to interact with the agent.")
     print("Press Ctrl+C to disconnect.")
     print("=" * 60)
 
-    # WebSocket接続情報を取得
+    # 再接続でも同じランタイムセッション（同じコンテナ）に振り分けてもらう
+    runtime_session_id = str(uuid.uuid4())
+
+    # JSONの場合も bidi.json.v1 を提示し、無音マーカー等に対応したサーバーか判別する
+    subprotocols = list(framing.SUPPORTED_SUBPROTOCOLS) if transport == "binary" else [framing.SUBPROTOCOL_JSON]
+    resume_state = ResumeState()
+
+    # WebSocket接続情報を用意する（署名・warm の接続はオーディオデバイスの初期化と並行して進める）
     print("\n[Connecting] Generating WebSocket connection...")
+    connection_manager = ConnectionManager(region, runtime_arn, runtime_session_id, warm=warm,
+                                           open_timeout=60, close_timeout=10)
+    preparing = asyncio.create_task(
+        connection_manager.start(subprotocols + (resume_state.subprotocols() if resume else [])))
+
+    recorder = AudioRecorder(device_rate, device_channels)
+    player = AudioPlayer(device_rate, device_channels)
+    session_recorder = None
     try:
-        ws_url, headers = get_websocket_connection(region, runtime_arn)
+        await preparing
         print(f"[Connecting] WebSocket URL obtained")
-        # print(f"[Debug] URL: {ws_url[:80]}...")
     except Exception as e:
         print(f"[Error] Failed to generate WebSocket connection: {e}")
+        await connection_manager.close()
         return
+    if audio_codec == "opus" and not codec.OPUS_AVAILABLE:
+        print("[Codec] opuslib (libopus) not installed. Using pcm.")
+        audio_codec = "pcm"
 
-    recorder = AudioRecorder()
-    player = AudioPlayer()
+    # セッション（再開した接続を含む）を通して使う状態。新しいセッションを始めるたびに作り直す
+    encoder = decoder = coalescer = adaptive = detector = None
+    audio_started = False
 
-    try:
+    async def connect(resume_subprotocols: list[str]):
         print("[Connecting] Establishing WebSocket connection (timeout: 60s)...")
-        async with websockets.connect(
-            ws_url,
-            additional_headers=headers,
-            open_timeout=60,
-            close_timeout=10,
-        ) as websocket:
-            print("[Connected] WebSocket connection established\n")
+        return await connection_manager.connect(subprotocols + (resume_subprotocols if resume else []))
+
+    async def run_connection(websocket, resumed: bool):
+        nonlocal session_recorder, encoder, decoder, coalescer, adaptive, detector, audio_started
+        binary = websocket.subprotocol == framing.SUBPROTOCOL_BINARY
+        print(f"[Connected] WebSocket connection established (transport: {'binary' if binary else 'json'}"
+              f"{', resumed' if resumed else ''})\n")
+
+        if record and session_recorder is None:
+            session_recorder = SessionRecorder(record, {"source": "client", "subprotocol": websocket.subprotocol})
+
+        if not resumed:
+            # 音声コーデック・ペーシング・受け取るイベントのネゴシエーション（対応サーバーのみ）
+            # 再開した接続ではサーバーが設定を引き継いでいるため送り直さない
+            audio_format = "pcm"
+            options = {
+                "audio_format": "opus" if audio_codec == "opus" else None,
+                "audio_lead_ms": audio_lead_ms,
+                # receive_messages は使用量を読まず、トランスクリプトも最終結果しか表示しない
+                "transcripts": None if all_events else "final",
+                "usage": None if all_events else "none",
+            }
+            if websocket.subprotocol is None:
+                if audio_codec == "opus" or audio_lead_ms is not None:
+                    print("[Codec] Server does not support bridge_config negotiation. Using pcm without pacing.")
+            elif any(value is not None for value in options.values()):
+                ack = await control.negotiate(websocket, **options)
+                audio_format = ack.get("audio_format", "pcm")
+                if session_recorder:
+                    session_recorder.record(UPLINK, control.config_event(**options))
+                    session_recorder.record(DOWNLINK, ack)
+                print(f"[Codec] audio_format={audio_format}, audio_lead_ms={ack.get('audio_lead_ms', 0)}, "
+                      f"transcripts={ack.get('transcripts', 'all')}, usage={ack.get('usage', 'all')}")
+            encoder = codec.OpusEncoder(INPUT_SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+            decoder = codec.OpusDecoder(OUTPUT_SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+
+            # 送信音声のまとめ方（frame_ms="auto" ならRTTに合わせて調整）
+            adaptive = AdaptiveFrameSize() if frame_ms == "auto" else None
+            coalescer = FrameCoalescer(
+                adaptive.frame_ms if adaptive else float(frame_ms), INPUT_SAMPLE_RATE, CHANNELS
+            )
 
-            # 録音と再生を開始
+            # VAD（無音マーカーを解釈できるサーバーの場合のみ）
+            detector = None
+            if vad and not NUMPY_AVAILABLE:
+                print("[VAD] NumPy not installed. VAD disabled.")
+            elif vad and websocket.subprotocol is None:
+                print("[VAD] Server does not support silence markers. VAD disabled.")
+            elif vad:
+                detector = VoiceActivityDetector(INPUT_SAMPLE_RATE, CHANNELS)
+
+        # 録音と再生を開始（再接続の間も止めず、マイク音声はキューに溜まる）
+        if not audio_started:
+            audio_started = True
             recorder.start()
             player.start()
 
-            # 送信タスクと受信タスクを並行実行
-            send_task = asyncio.create_task(send_audio(websocket, recorder))
-            receive_task = asyncio.create_task(receive_messages(websocket, player))
+        rtt_task = asyncio.create_task(adapt_frame_size(websocket, coalescer, adaptive)) if adaptive else None
 
+        # 送信タスクと受信タスクを並行実行
+        send_task = asyncio.create_task(send_audio(websocket, recorder, binary, coalescer, detector, encoder,
+                                                   session_recorder))
+        receive_task = asyncio.create_task(receive_messages(websocket, player, decoder, session_recorder))
+
+        tasks = [send_task, receive_task] + ([rtt_task] if rtt_task else [])
+        try:
             # どちらかが終了するまで待機
-            done, pending = await asyncio.wait(
+            done, _ = await asyncio.wait(
                 [send_task, receive_task],
                 return_when=asyncio.FIRST_COMPLETED
             )
-
-            # 残りのタスクをキャンセル
-            for task in pending:
+        finally:
+            # 残りのタスクをキャンセル（Ctrl+C で呼び出し元がキャンセルされた場合も含む）
+            for task in tasks:
                 task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # 切断（ConnectionClosed）は run_with_resume に伝えて再接続する
+        for task in done:
+            task.result()
+
+    try:
+        if resume:
+            await run_with_resume(connect, run_connection, resume_state)
+        else:
+            websocket = await connect([])
+            async with websocket:
+                await run_connection(websocket, False)
 
     except websockets.exceptions.ConnectionClosed as e:
         print(f"\n[Connection closed] {e}")
@@ -281,38 +478,107 @@ async def audio_session(region: str, runtime_arn: str):
     finally:
         recorder.stop()
         player.stop()
+        if session_recorder:
+            session_recorder.close()
+        await connection_manager.close()
+        print(f"[Connect] Stats: {connection_manager.stats()}")
         print("[Disconnected]")
 
 
-async def send_audio(websocket, recorder: AudioRecorder):
-    """マイクからの音声をWebSocketに送信"""
-    try:
-        while True:
-            # 音声チャンクを取得
-            audio_chunk = recorder.get_audio_chunk()
+async def send_audio(websocket, recorder: AudioRecorder, binary: bool = False,
+                     coalescer: FrameCoalescer | None = None,
+                     vad: VoiceActivityDetector | None = None,
+                     encoder: codec.OpusEncoder | None = None,
+                     session_recorder: SessionRecorder | None = None):
+    """マイクからの音声をWebSocketに送信
 
-            if audio_chunk:
-                # BidiAudioInputEvent形式で送信
-                message = {
-                    "type": "bidi_audio_input",
-                    "audio": base64.b64encode(audio_chunk).decode("utf-8"),
-                    "format": "pcm",
-                    "sample_rate": INPUT_SAMPLE_RATE,
-                    "channels": CHANNELS
-                }
-                await websocket.send(json.dumps(message))
+    音声が届くまで待機し、届いたらキューに溜まっている分をすべて送信する。
+    coalescer を渡すと、目標フレーム長までまとめてから1メッセージとして送る。
+    vad を渡すと、無音区間の音声は送らず、長さだけを無音マーカーで送る。
+    encoder を渡すと、Opus で圧縮して送る。
+    session_recorder を渡すと、送信したメッセージを記録する。
+    """
+    if coalescer is None:
+        coalescer = FrameCoalescer(0, INPUT_SAMPLE_RATE, CHANNELS)
+    meter = MessageRateMeter()
+
+    async def send_payload(payload: bytes, audio_format: str):
+        if binary:
+            # ヘッダ + 音声データのバイナリフレームで送信
+            message = framing.encode_audio_frame(
+                framing.KIND_AUDIO_INPUT, payload, audio_format, INPUT_SAMPLE_RATE, CHANNELS
+            )
+        else:
+            # BidiAudioInputEvent形式で送信（固定部分はテンプレートを使う）
+            message = default_codec.encode_audio(
+                "bidi_audio_input", base64.b64encode(payload).decode("ascii"), audio_format, INPUT_SAMPLE_RATE, CHANNELS
+            )
+        await websocket.send(message)
+        meter.record(len(message))
+        if session_recorder:
+            session_recorder.record(UPLINK, message)
+
+    async def send_frame(frame: bytes):
+        if encoder:
+            # Opusで圧縮（1パケットに満たない端数は次回に持ち越す）
+            payload = encoder.encode(frame)
+            if payload:
+                await send_payload(payload, "opus")
+        else:
+            await send_payload(frame, "pcm")
+
+    async def send_silence(frames: int):
+        # 無音区間の長さだけを送る（サーバーがゼロPCMに展開する）
+        if binary:
+            message = framing.encode_silence_frame(frames, INPUT_SAMPLE_RATE, CHANNELS)
+        else:
+            message = default_codec.encode(framing.silence_event(frames, INPUT_SAMPLE_RATE, CHANNELS))
+        await websocket.send(message)
+        meter.record(len(message))
+        if session_recorder:
+            session_recorder.record(UPLINK, message)
 
-            # 少し待機（CPU負荷軽減）
-            await asyncio.sleep(0.01)
+    try:
+        while True:
+            # 音声チャンクを取得（届くまで待機）
+            for audio_chunk in await recorder.get_audio_chunks():
+                # VADで無音区間を間引く（無効ならそのまま送る）
+                for item in vad.process(audio_chunk) if vad else (audio_chunk,):
+                    if isinstance(item, int):
+                        # 時間順を保つため、まとめ中の音声を先に送ってからマーカーを送る
+                        frame = coalescer.flush()
+                        if frame is not None:
+                            await send_frame(frame)
+                        if encoder:
+                            payload = encoder.flush()
+                            if payload:
+                                await send_payload(payload, "opus")
+                        await send_silence(item)
+                        continue
+
+                    frame = coalescer.push(item)
+                    if frame is not None:
+                        await send_frame(frame)
+
+            # 実効メッセージレートを定期的に表示
+            rate = meter.report()
+            if rate:
+                print(f"[Uplink] {rate[0]:.1f} msg/s, {rate[1]:.1f} KB/s (frame: {coalescer.frame_ms:.0f} ms)")
 
     except asyncio.CancelledError:
         pass
     except Exception as e:
         print(f"[Send Error] {e}")
         raise
+    finally:
+        msg_per_sec, kb_per_sec = meter.summary()
+        print(f"[Uplink] total {meter.messages} messages ({msg_per_sec:.1f} msg/s, {kb_per_sec:.1f} KB/s)")
+        if vad:
+            print(f"[VAD] {vad.stats()}")
 
 
-async def receive_messages(websocket, player: AudioPlayer):
+async def receive_messages(websocket, player: AudioPlayer, decoder: codec.OpusDecoder | None = None,
+                           session_recorder: SessionRecorder | None = None):
     """WebSocketからメッセージを受信して処理
 
     Strandsの出力イベント形式に対応:
@@ -321,23 +587,50 @@ async def receive_messages(websocket, player: AudioPlayer):
     - bidi_connection_start: 接続開始
     - bidi_response_start/complete: レスポンス開始/終了
     - bidi_error: エラー
+
+    バイナリフレーム(音声)とJSONテキストフレーム(その他)の両方を受け付ける。
+    Opus の音声は decoder で PCM に戻してから再生する（再生側で出力デバイスの形式に変換する）。
+    session_recorder を渡すと、受信したメッセージを記録する。
     """
+    # 受信した音声の形式（変わったときに表示する）
+    shown_format = None
     try:
         async for message in websocket:
+            if session_recorder:
+                session_recorder.record(DOWNLINK, message)
+            if isinstance(message, bytes):
+                # バイナリフレーム (bidi_audio_stream)
+                try:
+                    _, audio_format, sample_rate, channels, audio_bytes = framing.decode_audio_frame(message)
+                except framing.FrameError as e:
+                    print(f"[Receive] Invalid frame: {e}")
+                    continue
+                if (audio_format, sample_rate, channels) != shown_format:
+                    shown_format = (audio_format, sample_rate, channels)
+                    print(f"[Audio Format] format={audio_format}, sample_rate={sample_rate}, channels={channels} (binary)")
+                if audio_format == "opus":
+                    audio_bytes = decoder.decode(audio_bytes)
+                player.play(audio_bytes, sample_rate, channels)
+                continue
+
             try:
-                data = json.loads(message)
+                data = default_codec.decode(message)
                 msg_type = data.get("type", "")
 
                 # 音声ストリーム (Strands BidiAudioStreamEvent)
                 if msg_type == "bidi_audio_stream":
                     audio_data = data.get("audio", "")
-                    # 音声形式情報を表示（初回のみ）
-                    if not hasattr(receive_messages, '_audio_format_shown'):
-                        receive_messages._audio_format_shown = True
-                        print(f"[Audio Format] format={data.get('format')}, sample_rate={data.get('sample_rate')}, channels={data.get('channels')}")
+                    # 音声形式情報を表示（変わったときのみ）
+                    sample_rate = data.get("sample_rate", OUTPUT_SAMPLE_RATE)
+                    channels = data.get("channels", CHANNELS)
+                    if (data.get("format"), sample_rate, channels) != shown_format:
+                        shown_format = (data.get("format"), sample_rate, channels)
+                        print(f"[Audio Format] format={data.get('format')}, sample_rate={sample_rate}, channels={channels}")
                     if audio_data:
                         audio_bytes = base64.b64decode(audio_data)
-                        player.play(audio_bytes)
+                        if data.get("format") == "opus":
+                            audio_bytes = decoder.decode(audio_bytes)
+                        player.play(audio_bytes, sample_rate, channels)
 
                 # トランスクリプト (Strands BidiTranscriptStreamEvent)
                 elif msg_type == "bidi_transcript_stream":
@@ -364,6 +657,8 @@ async def receive_messages(websocket, player: AudioPlayer):
                         print("[Agent] (interrupted)")
                         # 割り込み時は未再生の音声データをクリアして即座に停止
                         player.clear()
+                    else:
+                        print(f"[AudioPlayer] {player.stats()}")
 
                 # エラー (Strands BidiErrorEvent)
                 elif msg_type == "bidi_error":
@@ -392,8 +687,11 @@ async def receive_messages(websocket, player: AudioPlayer):
         raise
 
 
-async def text_session(region: str, runtime_arn: str):
-    """テキスト入力セッション（音声なし、デバッグ用）"""
+async def text_session(region: str, runtime_arn: str, warm: bool = False):
+    """テキスト入力セッション（音声なし、デバッグ用）
+
+    warm=True の場合は、入力を待つ間に WebSocket を開いておく。
+    """
     print("=" * 60)
     print("AgentCore Runtime Client - Text Mode (Debug)")
     print("=" * 60)
@@ -403,17 +701,19 @@ async def text_session(region: str, runtime_arn: str):
     print("Type 'quit' or 'exit' to disconnect.")
     print("=" * 60)
 
-    # WebSocket接続情報を取得
+    # WebSocket接続情報を用意する
     print("\n[Connecting] Generating WebSocket connection...")
+    connection_manager = ConnectionManager(region, runtime_arn, str(uuid.uuid4()), warm=warm)
     try:
-        ws_url, headers = get_websocket_connection(region, runtime_arn)
+        await connection_manager.start()
         print(f"[Connecting] WebSocket URL obtained")
     except Exception as e:
         print(f"[Error] Failed to generate WebSocket connection: {e}")
+        await connection_manager.close()
         return
 
     try:
-        async with websockets.connect(ws_url, additional_headers=headers) as websocket:
+        async with await connection_manager.connect() as websocket:
             print("[Connected] WebSocket connection established\n")
 
             # 受信タスクを開始
@@ -454,6 +754,8 @@ async def text_session(region: str, runtime_arn: str):
         print(f"\n[Error] Connection refused.")
     except Exception as e:
         print(f"\n[Error] {type(e).__name__}: {e}")
+    finally:
+        await connection_manager.close()
 
 
 async def receive_text_messages(websocket):
@@ -482,6 +784,29 @@ def main():
     parser.add_argument("--text", action="store_true", help="Use text mode instead of audio")
     parser.add_argument("--region", default="ap-northeast-1", help="AWS region (default: ap-northeast-1)")
     parser.add_argument("--arn", help="Agent Runtime ARN (or set AGENT_ARN env var)")
+    parser.add_argument("--frame-ms", default="0",
+                        help="Coalesce microphone audio into frames of this many ms, or 'auto' to follow measured RTT (default: 0 = no coalescing)")
+    parser.add_argument("--vad", action="store_true",
+                        help="Skip silent microphone audio and send compact silence markers instead (requires numpy)")
+    parser.add_argument("--codec", choices=["pcm", "opus"], default="pcm",
+                        help="Audio codec on the WebSocket: opus is used if the server supports it (requires opuslib and libopus)")
+    parser.add_argument("--transport", choices=["binary", "json"], default="binary",
+                        help="Audio transport: binary frames (falls back to json if unsupported) or base64 json (default: binary)")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Record sent/received messages with timestamps to this file (replay with test/replay_session.py)")
+    parser.add_argument("--all-events", action="store_true",
+                        help="Receive every event (by default usage and non-final transcripts are not requested)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Do not reconnect and resume the server session when the connection drops")
+    parser.add_argument("--device-rate", type=int,
+                        help="Open the microphone and speaker at this sample rate and convert to/from 16 kHz in the client "
+                             "(default: the devices' native rate; requires numpy unless it is 16000)")
+    parser.add_argument("--device-channels", type=int, default=1,
+                        help="Channels to open the microphone and speaker with, e.g. 2 for stereo-only devices (default: 1)")
+    parser.add_argument("--warm", action="store_true",
+                        help="Open the WebSocket before the session starts so the first utterance does not wait for it")
+    parser.add_argument("--audio-lead-ms", type=int,
+                        help="Ask the server to send response audio at most this many ms ahead of playback (0 disables pacing)")
     args = parser.parse_args()
 
     # Runtime ARNを取得
@@ -497,9 +822,11 @@ def main():
     region = args.region
 
     if args.text:
-        asyncio.run(text_session(region, runtime_arn))
+        asyncio.run(text_session(region, runtime_arn, args.warm))
     else:
-        asyncio.run(audio_session(region, runtime_arn))
+        asyncio.run(audio_session(region, runtime_arn, args.transport, args.frame_ms, args.vad, args.codec,
+                                  args.record, args.audio_lead_ms, args.all_events, not args.no_resume,
+                                  args.warm, args.device_rate, args.device_channels))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,482 @@
+"""
+クライアント側の音声パイプライン部品
+
+AudioRecorder と送信処理(send_audio)の間に挟む処理(VAD・フレームのまとめ送り)と、
+受信音声の再生バッファ、デバイスを開く形式の決定をまとめたモジュール。
+デバイスの形式とモデルの形式の変換(AudioConverter)はサーバーと共通の cdk/bidiagent/resample.py にある。
+test/agentcore_client.py と test/websocket_agent_client.py の両方から読み込まれる。
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# サーバー(cdk/bidiagent)と共通のリサンプラ
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+from resample import AudioConverter  # noqa: F401  (クライアントはここから読み込む)
+
+# NumPyのインポート（VAD・リサンプリング用、オプション）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class VoiceActivityDetector:
+    """エネルギーとゼロ交差率による簡易VAD（NumPyが必要）
+
+    録音チャンクを sub_frame_ms ごとのサブフレームに分け、各サブフレームの
+    エネルギー(dBFS)とゼロ交差率をまとめて計算する。いずれかのサブフレームが
+    以下を満たせばチャンク全体を発話とみなす。
+
+    - エネルギーが energy_threshold_db 以上
+    - または、エネルギーが energy_threshold_db - 10 以上かつゼロ交差率が zcr_threshold 以上
+      （「さ」「し」等の小さく高周波な無声子音を取りこぼさないため）
+
+    発話が終わってからも hangover_ms の間は音声をそのまま送り（語尾の切り捨て防止）、
+    無音中は直近 preroll_ms 分を手元に残しておき、発話が始まったら先に送る（語頭の切り捨て防止）。
+    それより古い無音は送らず、長さだけを keepalive_ms ごとの無音マーカーにまとめる。
+
+    process() の戻り値は送信する順に並んだリストで、bytes は音声、int は無音マーカー
+    （無音のフレーム数）を表す。
+
+    Args:
+        sample_rate: サンプリングレート
+        channels: チャンネル数（16bit PCMを想定）
+        energy_threshold_db: 発話とみなすエネルギーの閾値(dBFS)
+        zcr_threshold: 無声子音とみなすゼロ交差率の閾値(0〜1)
+        hangover_ms: 発話終了後も音声を送り続ける時間(ms)
+        preroll_ms: 発話開始前に遡って送る時間(ms)
+        keepalive_ms: 無音マーカーをまとめる長さ(ms)
+        sub_frame_ms: 判定に使うサブフレームの長さ(ms)
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int = 1,
+        energy_threshold_db: float = -45.0,
+        zcr_threshold: float = 0.25,
+        hangover_ms: float = 300,
+        preroll_ms: float = 200,
+        keepalive_ms: float = 500,
+        sub_frame_ms: float = 10,
+    ):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for VAD (pip install numpy)")
+        self._channels = channels
+        self._frame_bytes = channels * 2
+        self._frames_per_ms = sample_rate / 1000
+        self._sub_frame = max(1, int(sub_frame_ms * self._frames_per_ms))
+        self.energy_threshold_db = energy_threshold_db
+        self.zcr_threshold = zcr_threshold
+        self.hangover_ms = hangover_ms
+        self.preroll_ms = preroll_ms
+        self.keepalive_frames = int(keepalive_ms * self._frames_per_ms)
+
+        self._active = False
+        self._hangover_left = 0.0
+        self._preroll: deque[bytes] = deque()
+        self._preroll_frames = 0
+        self._pending_frames = 0
+
+        # カウンタ
+        self.bytes_in = 0
+        self.bytes_dropped = 0
+        self.markers = 0
+
+    def is_speech(self, chunk: bytes) -> bool:
+        """チャンクに発話が含まれるか"""
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        if self._channels > 1:
+            samples = samples.reshape(-1, self._channels).mean(axis=1)
+        count = len(samples) // self._sub_frame * self._sub_frame
+        if count == 0:
+            frames = samples.astype(np.float32).reshape(1, -1)
+        else:
+            frames = samples[:count].astype(np.float32).reshape(-1, self._sub_frame)
+        if frames.size == 0:
+            return False
+
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        energy_db = 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1) if frames.shape[1] > 1 else np.zeros(len(frames))
+
+        voiced = energy_db >= self.energy_threshold_db
+        unvoiced = (energy_db >= self.energy_threshold_db - 10) & (zcr >= self.zcr_threshold)
+        return bool(np.any(voiced | unvoiced))
+
+    def process(self, chunk: bytes) -> list[bytes | int]:
+        """録音チャンクを1つ判定し、送信するもの（音声 / 無音マーカー）を返す"""
+        self.bytes_in += len(chunk)
+        duration_ms = len(chunk) / self._frame_bytes / self._frames_per_ms
+        out: list[bytes | int] = []
+
+        if self.is_speech(chunk):
+            if not self._active:
+                # 発話開始: 先に溜まっている無音の長さを伝え、プリロール分を送る
+                self._active = True
+                if self._pending_frames:
+                    out.append(self._take_marker())
+                out.extend(self._preroll)
+                self._preroll.clear()
+                self._preroll_frames = 0
+            self._hangover_left = self.hangover_ms
+            out.append(chunk)
+            return out
+
+        if self._active:
+            # ハングオーバー中は無音でも送る
+            out.append(chunk)
+            self._hangover_left -= duration_ms
+            if self._hangover_left <= 0:
+                self._active = False
+            return out
+
+        # 無音: プリロールに残し、あふれた分は送らずに長さだけ数える
+        self._preroll.append(chunk)
+        self._preroll_frames += len(chunk) // self._frame_bytes
+        preroll_limit = self.preroll_ms * self._frames_per_ms
+        while self._preroll and self._preroll_frames - len(self._preroll[0]) // self._frame_bytes >= preroll_limit:
+            dropped = self._preroll.popleft()
+            self._preroll_frames -= len(dropped) // self._frame_bytes
+            self._pending_frames += len(dropped) // self._frame_bytes
+            self.bytes_dropped += len(dropped)
+        if self._pending_frames >= self.keepalive_frames:
+            out.append(self._take_marker())
+        return out
+
+    def _take_marker(self) -> int:
+        frames = self._pending_frames
+        self._pending_frames = 0
+        self.markers += 1
+        return frames
+
+    def stats(self) -> dict:
+        saved = self.bytes_dropped / self.bytes_in * 100 if self.bytes_in else 0.0
+        return {
+            "bytes_saved": self.bytes_dropped,
+            "saved_percent": round(saved, 1),
+            "markers": self.markers,
+        }
+
+
+class FrameCoalescer:
+    """録音チャンクを目標の長さまでまとめてから1メッセージとして送るためのバッファ
+
+    CHUNK_SIZE = 512 (16kHz) のままだと 1秒あたり約31メッセージになり、
+    JSONの場合は毎回 format / sample_rate / channels も一緒に送ることになる。
+    目標長(frame_ms)以上の音声が溜まった時点でまとめて取り出すことで、
+    数十msの遅延と引き換えにメッセージ数とメッセージごとのオーバーヘッドを減らす。
+
+    取り出す単位は録音チャンクの倍数になるため、録音チャンクより短い目標長は
+    「まとめない」と同じ動作になる。
+
+    Args:
+        frame_ms: 目標フレーム長(ms)。0 ならまとめずにそのまま返す
+        sample_rate: サンプリングレート
+        channels: チャンネル数
+        sample_width: 1サンプルのバイト数(16bit PCMなら2)
+    """
+
+    def __init__(self, frame_ms: float, sample_rate: int, channels: int = 1, sample_width: int = 2):
+        self._bytes_per_ms = sample_rate * channels * sample_width / 1000
+        self._buffer = bytearray()
+        self.frame_ms = frame_ms
+
+    @property
+    def frame_ms(self) -> float:
+        return self._frame_ms
+
+    @frame_ms.setter
+    def frame_ms(self, value: float) -> None:
+        self._frame_ms = max(0.0, value)
+        self._frame_bytes = int(self._frame_ms * self._bytes_per_ms)
+
+    @property
+    def buffered_ms(self) -> float:
+        """まだ送っていない音声の長さ(ms)"""
+        return len(self._buffer) / self._bytes_per_ms
+
+    def push(self, chunk: bytes) -> bytes | None:
+        """チャンクを追加し、目標長に達していればまとめた音声を返す"""
+        self._buffer += chunk
+        if len(self._buffer) < self._frame_bytes:
+            return None
+        return self.flush()
+
+    def flush(self) -> bytes | None:
+        """溜まっている音声をすべて取り出す(空なら None)"""
+        if not self._buffer:
+            return None
+        frame = bytes(self._buffer)
+        self._buffer.clear()
+        return frame
+
+
+class AdaptiveFrameSize:
+    """計測したRTTからフレーム長を決める
+
+    RTTが大きい経路ほど、数十msまとめて送っても体感遅延に占める割合は小さく、
+    メッセージ数を減らす効果の方が大きい。RTTを指数移動平均で平滑化し、
+    その ratio 倍を [min_ms, max_ms] に収めた値をフレーム長とする。
+
+    Args:
+        min_ms: フレーム長の下限(ms)
+        max_ms: フレーム長の上限(ms)
+        ratio: RTTに対するフレーム長の比率
+        smoothing: 指数移動平均の係数(新しい値の重み)
+    """
+
+    def __init__(self, min_ms: float = 20, max_ms: float = 100, ratio: float = 0.25, smoothing: float = 0.3):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.ratio = ratio
+        self.smoothing = smoothing
+        self.rtt_ms: float | None = None
+
+    def update(self, rtt_ms: float) -> float:
+        """RTTの計測値を反映し、新しいフレーム長(ms)を返す"""
+        if self.rtt_ms is None:
+            self.rtt_ms = rtt_ms
+        else:
+            self.rtt_ms += self.smoothing * (rtt_ms - self.rtt_ms)
+        return self.frame_ms
+
+    @property
+    def frame_ms(self) -> float:
+        if self.rtt_ms is None:
+            return self.min_ms
+        return round(min(self.max_ms, max(self.min_ms, self.rtt_ms * self.ratio)))
+
+
+async def adapt_frame_size(websocket, coalescer: FrameCoalescer, adaptive: AdaptiveFrameSize, interval: float = 5.0):
+    """WebSocketの ping/pong でRTTを定期的に計測し、coalescer のフレーム長を調整する"""
+    try:
+        while True:
+            start = time.perf_counter()
+            pong_waiter = await websocket.ping()
+            await pong_waiter
+            rtt_ms = (time.perf_counter() - start) * 1000
+
+            frame_ms = adaptive.update(rtt_ms)
+            if frame_ms != coalescer.frame_ms:
+                coalescer.frame_ms = frame_ms
+                print(f"[Uplink] RTT {adaptive.rtt_ms:.0f} ms -> frame {frame_ms:.0f} ms")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        # 接続断などでRTTが測れなくなったら、最後のフレーム長のまま続ける
+        print(f"[Uplink] RTT measurement stopped: {e}")
+
+
+class MessageRateMeter:
+    """送信メッセージ数とバイト数から実効メッセージレートを求める
+
+    Args:
+        interval: report() がレートを返す間隔(秒)
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.messages = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._window_started = self._started
+        self._window_messages = 0
+        self._window_bytes = 0
+
+    def record(self, size: int) -> None:
+        """1メッセージ分を記録する"""
+        self.messages += 1
+        self.bytes += size
+        self._window_messages += 1
+        self._window_bytes += size
+
+    def report(self) -> tuple[float, float] | None:
+        """前回から interval 秒以上経っていれば (msg/s, KB/s) を返し、計測区間をリセットする"""
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        if elapsed < self.interval:
+            return None
+        rate = (self._window_messages / elapsed, self._window_bytes / elapsed / 1024)
+        self._window_started = now
+        self._window_messages = 0
+        self._window_bytes = 0
+        return rate
+
+    def summary(self) -> tuple[float, float]:
+        """セッション全体の (msg/s, KB/s)"""
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return self.messages / elapsed, self.bytes / elapsed / 1024
+
+
+class JitterBuffer:
+    """再生用のリングバッファ（適応的な目標深さ付き）
+
+    受信側(イベントループ)が write() し、PyAudio のコールバックスレッドが read() する。
+    バッファは最初に確保した bytearray を使い回し、読み書き位置だけを進める。
+
+    - 再生開始前に目標深さ(target_ms)まで溜めてから出力を始める（プライミング）。
+      ただし最初の書き込みから target_ms 経っても溜まらない短い音声はそのまま出力する。
+    - 再生中にデータが尽きた直後(underrun_gap 秒以内)に続きが届いた場合はアンダーランとして数え、
+      目標深さを step_ms 増やす。decay_after 秒分アンダーランなしで再生できたら step_ms 減らす。
+    - 容量を超えて書き込まれた場合は古いデータを捨て、オーバーランとして数える。
+    - clear() は読み込み位置を書き込み位置に合わせるだけなので O(1)。
+
+    Args:
+        sample_rate: サンプリングレート
+        channels: チャンネル数
+        sample_width: 1サンプルのバイト数(16bit PCMなら2)
+        capacity_ms: バッファ容量(ms)
+        target_ms: 目標深さの初期値(ms)
+        min_ms: 目標深さの下限(ms)
+        max_ms: 目標深さの上限(ms)
+        step_ms: アンダーラン/安定時に目標深さを増減する幅(ms)
+        decay_after: 目標深さを下げるまでのアンダーランなし再生時間(秒)
+        underrun_gap: データが尽きてからこの秒数以内に続きが届いたらアンダーランとみなす
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int = 1,
+        sample_width: int = 2,
+        capacity_ms: int = 60_000,
+        target_ms: float = 60,
+        min_ms: float = 20,
+        max_ms: float = 500,
+        step_ms: float = 20,
+        decay_after: float = 10.0,
+        underrun_gap: float = 0.5,
+    ):
+        self._frame_size = channels * sample_width
+        self._bytes_per_ms = sample_rate * self._frame_size / 1000
+        self._capacity = self._align(capacity_ms * self._bytes_per_ms)
+        self._buffer = bytearray(self._capacity)
+        self._read_pos = 0   # 累積の読み込みバイト数
+        self._write_pos = 0  # 累積の書き込みバイト数
+        self._lock = threading.Lock()
+
+        self.target_ms = target_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.step_ms = step_ms
+        self.decay_after = decay_after
+        self.underrun_gap = underrun_gap
+
+        self._playing = False
+        self._prime_started: float | None = None
+        self._starved_at: float | None = None
+        self._stable_bytes = 0
+
+        self.underruns = 0
+        self.overruns = 0
+
+    def _align(self, nbytes: float) -> int:
+        return int(nbytes) // self._frame_size * self._frame_size
+
+    @property
+    def buffered_ms(self) -> float:
+        """バッファに溜まっている未再生の音声の長さ(ms)"""
+        return (self._write_pos - self._read_pos) / self._bytes_per_ms
+
+    def write(self, data: bytes) -> None:
+        """受信した音声を追加する"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._playing and self._prime_started is None:
+                self._prime_started = now
+                if self._starved_at is not None and now - self._starved_at <= self.underrun_gap:
+                    # 再生中に途切れた直後に続きが届いた = 到着が再生に追いつかなかった
+                    self.underruns += 1
+                    self.target_ms = min(self.max_ms, self.target_ms + self.step_ms)
+                    self._stable_bytes = 0
+                self._starved_at = None
+
+            if len(data) > self._capacity:
+                data = data[-self._capacity:]
+            overflow = self._write_pos - self._read_pos + len(data) - self._capacity
+            if overflow > 0:
+                # 容量超過: 古いデータを捨てる
+                self._read_pos += overflow
+                self.overruns += 1
+
+            start = self._write_pos % self._capacity
+            first = min(len(data), self._capacity - start)
+            self._buffer[start:start + first] = data[:first]
+            self._buffer[:len(data) - first] = data[first:]
+            self._write_pos += len(data)
+
+    def read(self, nbytes: int) -> bytes:
+        """再生する音声を nbytes 取り出す（足りない分は無音で埋める）"""
+        now = time.monotonic()
+        with self._lock:
+            available = self._write_pos - self._read_pos
+            if not self._playing:
+                primed = available >= self.target_ms * self._bytes_per_ms
+                waited = (
+                    self._prime_started is not None
+                    and now - self._prime_started >= self.target_ms / 1000
+                )
+                if available and (primed or waited):
+                    self._playing = True
+                    self._prime_started = None
+                else:
+                    return bytes(nbytes)
+
+            count = self._align(min(nbytes, available))
+            start = self._read_pos % self._capacity
+            first = min(count, self._capacity - start)
+            data = bytes(self._buffer[start:start + first]) + bytes(self._buffer[:count - first])
+            self._read_pos += count
+
+            if count < nbytes:
+                # データが尽きた: 次の書き込みまで待機状態に戻る
+                self._playing = False
+                self._starved_at = now
+                data += bytes(nbytes - count)
+            else:
+                self._stable_bytes += count
+                if self._stable_bytes >= self.decay_after * 1000 * self._bytes_per_ms:
+                    self.target_ms = max(self.min_ms, self.target_ms - self.step_ms)
+                    self._stable_bytes = 0
+            return data
+
+    def clear(self) -> float:
+        """未再生の音声を破棄し、破棄した長さ(ms)を返す（割り込み時）"""
+        with self._lock:
+            cleared_ms = (self._write_pos - self._read_pos) / self._bytes_per_ms
+            self._read_pos = self._write_pos
+            self._playing = False
+            self._prime_started = None
+            self._starved_at = None
+            return cleared_ms
+
+    def stats(self) -> dict:
+        return {
+            "buffered_ms": round(self.buffered_ms),
+            "target_ms": round(self.target_ms),
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+        }
+
+
+def device_format(pa, output: bool, model_rate: int, rate: int | None = None, channels: int = 1) -> tuple[int, int]:
+    """音声デバイスを開く形式 (サンプリングレート, チャンネル数) を決める
+
+    rate が None なら既定のデバイスのネイティブのレートで開き、モデルの形式との変換は AudioConverter で行う
+    （PortAudio / OS のリサンプリングに任せない）。NumPy がなければ変換できないのでモデルの形式で開く。
+    """
+    if rate is None:
+        info = pa.get_default_output_device_info() if output else pa.get_default_input_device_info()
+        rate = int(info["defaultSampleRate"])
+    if (rate != model_rate or channels != 1) and not NUMPY_AVAILABLE:
+        print(f"[Audio] NumPy not installed. Opening the {'output' if output else 'input'} device at {model_rate} Hz mono.")
+        return model_rate, 1
+    return rate, channels
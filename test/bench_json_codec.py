@@ -0,0 +1,96 @@
+"""
+JSONイベントのエンコード/デコードのマイクロベンチマーク
+
+変更前(標準の json、Starlette の send_json / receive_json と同じ処理)と
+json_codec.py(音声テンプレート + json / orjson)の1イベントあたりのコストを比較する。
+
+    python test/bench_json_codec.py
+    python test/bench_json_codec.py --chunk-ms 20,100 --number 20000
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+# サーバー(cdk/bidiagent)と共通の定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+from json_codec import ORJSON_AVAILABLE, JsonCodec
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+
+
+def audio_event(event_type: str, chunk_ms: int) -> dict:
+    pcm = os.urandom(SAMPLE_RATE * chunk_ms // 1000 * CHANNELS * 2)
+    return {
+        "type": event_type,
+        "audio": base64.b64encode(pcm).decode("ascii"),
+        "format": "pcm",
+        "sample_rate": SAMPLE_RATE,
+        "channels": CHANNELS,
+    }
+
+
+TRANSCRIPT_EVENT = {
+    "type": "bidi_transcript_stream",
+    "delta": {"text": "東京の今日の天気は晴れ、最高気温は23度の予想です。"},
+    "text": "東京の今日の天気は晴れ、最高気温は23度の予想です。",
+    "role": "assistant",
+    "is_final": True,
+    "current_transcript": "東京の今日の天気は晴れ、最高気温は23度の予想です。",
+}
+
+
+def baseline_dumps(event: dict) -> str:
+    # Starlette の send_json と同じ
+    return json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+
+
+def bench(func, number: int) -> float:
+    """1回あたりの時間(μs)。3回測って最小値を使う"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the JSON event codec")
+    parser.add_argument("--chunk-ms", default="20,40,100", help="Audio chunk lengths to test (default: 20,40,100)")
+    parser.add_argument("--number", type=int, default=10000, help="Iterations per measurement (default: 10000)")
+    args = parser.parse_args()
+
+    codecs = [("template+json", JsonCodec("json"))]
+    if ORJSON_AVAILABLE:
+        codecs.append(("template+orjson", JsonCodec("orjson")))
+    else:
+        print("[Info] orjson not installed; only the stdlib backend is measured (pip install orjson)")
+
+    rows = []
+    for chunk_ms in (int(value) for value in args.chunk_ms.split(",")):
+        stream = audio_event("bidi_audio_stream", chunk_ms)
+        rows.append((f"encode bidi_audio_stream {chunk_ms}ms", bench(lambda: baseline_dumps(stream), args.number),
+                     [bench(lambda c=c: c.encode(stream), args.number) for _, c in codecs]))
+
+        audio_input = audio_event("bidi_audio_input", chunk_ms)
+        # 変更前のクライアントは json.dumps の既定の区切りで送っていた
+        old_text = json.dumps(audio_input)
+        new_text = codecs[0][1].encode(audio_input)
+        rows.append((f"decode bidi_audio_input {chunk_ms}ms", bench(lambda: json.loads(old_text), args.number),
+                     [bench(lambda c=c: c.decode(new_text), args.number) for _, c in codecs]))
+
+    transcript_text = baseline_dumps(TRANSCRIPT_EVENT)
+    rows.append(("encode bidi_transcript_stream", bench(lambda: baseline_dumps(TRANSCRIPT_EVENT), args.number),
+                 [bench(lambda c=c: c.encode(TRANSCRIPT_EVENT), args.number) for _, c in codecs]))
+    rows.append(("decode bidi_transcript_stream", bench(lambda: json.loads(transcript_text), args.number),
+                 [bench(lambda c=c: c.decode(transcript_text), args.number) for _, c in codecs]))
+
+    header = f"{'case':<36}{'stdlib json':>14}" + "".join(f"{name:>24}" for name, _ in codecs)
+    print(header)
+    print("-" * len(header))
+    for name, baseline, results in rows:
+        cells = "".join(f"{result:>10.2f} us ({baseline / result:>5.1f}x)" for result in results)
+        print(f"{name:<36}{baseline:>11.2f} us{cells}")
+
+
+if __name__ == "__main__":
+    main()
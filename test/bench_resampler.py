@@ -0,0 +1,119 @@
+"""
+デバイスの形式とモデルの形式の変換(cdk/bidiagent/resample.py の AudioConverter)のベンチマーク
+
+録音チャンク(既定32ms)1つあたりの変換時間を、1サンプルずつPythonで処理する素朴な実装
+(線形補間 + チャンネルの平均)と比べる。チャンクの長さを変えても1チャンクあたりの時間が
+長さに比例するだけであること(max も中央値から大きく外れないこと)と、1kHz の正弦波の SNR を確認する。
+
+    python test/bench_resampler.py
+    python test/bench_resampler.py --chunk-ms 10,32,100 --number 500
+"""
+import argparse
+import statistics
+import time
+from array import array
+
+import numpy as np
+
+from audio_pipeline import AudioConverter
+
+MODEL_RATE = 16000
+
+# (入力のレート, 入力のチャンネル数, 出力のレート, 出力のチャンネル数)
+CASES = [
+    (48000, 2, MODEL_RATE, 1),    # マイク(48kHz ステレオ) → モデル
+    (44100, 2, MODEL_RATE, 1),    # マイク(44.1kHz ステレオ) → モデル
+    (44100, 1, MODEL_RATE, 1),
+    (MODEL_RATE, 1, 48000, 2),    # モデル → スピーカー(48kHz ステレオ)
+    (MODEL_RATE, 1, 44100, 2),
+]
+
+
+class NaiveConverter:
+    """1サンプルずつ処理する比較用の実装（線形補間、チャンクをまたぐ状態を持つ）"""
+
+    def __init__(self, in_rate: int, in_channels: int, out_rate: int, out_channels: int):
+        self.step = in_rate / out_rate
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.position = 0.0
+        self.last = 0.0
+
+    def convert(self, pcm: bytes) -> bytes:
+        values = memoryview(pcm).cast("h")
+        mono = [sum(values[i:i + self.in_channels]) / self.in_channels
+                for i in range(0, len(values), self.in_channels)]
+        samples = [self.last] + mono
+        out = []
+        while self.position < len(mono):
+            index = int(self.position)
+            fraction = self.position - index
+            value = int(samples[index] * (1 - fraction) + samples[index + 1] * fraction)
+            out.extend([value] * self.out_channels)
+            self.position += self.step
+        self.position -= len(mono)
+        self.last = samples[-1]
+        return array("h", out).tobytes()
+
+
+def tone(rate: int, channels: int, seconds: float, frequency: float = 1000.0) -> bytes:
+    t = np.arange(int(rate * seconds)) / rate
+    samples = (np.sin(2 * np.pi * frequency * t) * 10000).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1).tobytes()
+
+
+def snr_db(pcm: bytes, rate: int, channels: int, frequency: float = 1000.0) -> float:
+    """出力から正弦波を最小二乗で当てはめ、残りをノイズとみなした SNR(dB)"""
+    y = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels)[:, 0].astype(np.float64)
+    t = np.arange(len(y)) / rate
+    basis = np.stack((np.sin(2 * np.pi * frequency * t), np.cos(2 * np.pi * frequency * t)), axis=1)
+    # フィルタの立ち上がりを除く
+    y, basis = y[rate // 50:], basis[rate // 50:]
+    fit = basis @ np.linalg.lstsq(basis, y, rcond=None)[0]
+    return 10 * np.log10(fit.var() / (y - fit).var())
+
+
+def time_chunks(converter, chunks: list[bytes]) -> list[float]:
+    """チャンクごとの変換時間(μs)"""
+    times = []
+    for chunk in chunks:
+        started = time.perf_counter()
+        converter.convert(chunk)
+        times.append((time.perf_counter() - started) * 1_000_000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the streaming resampler and channel mixer")
+    parser.add_argument("--chunk-ms", default="32", help="Chunk lengths to test (default: 32)")
+    parser.add_argument("--number", type=int, default=300, help="Chunks per measurement (default: 300)")
+    args = parser.parse_args()
+
+    header = (f"{'conversion':<28}{'chunk':>7}{'naive median':>15}{'numpy median':>15}{'numpy max':>12}"
+              f"{'speedup':>9}{'realtime':>10}{'SNR':>9}")
+    print(header)
+    print("-" * len(header))
+    for chunk_ms in (int(value) for value in args.chunk_ms.split(",")):
+        for in_rate, in_channels, out_rate, out_channels in CASES:
+            chunk_bytes = in_rate * chunk_ms // 1000 * in_channels * 2
+            pcm = tone(in_rate, in_channels, chunk_ms * args.number / 1000)
+            chunks = [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)]
+
+            converter = AudioConverter(in_rate, in_channels, out_rate, out_channels)
+            numpy_times = time_chunks(converter, chunks)
+            # 比較用は遅いので一部のチャンクだけ測る
+            naive_times = time_chunks(NaiveConverter(in_rate, in_channels, out_rate, out_channels),
+                                      chunks[:max(10, len(chunks) // 10)])
+            output = AudioConverter(in_rate, in_channels, out_rate, out_channels).convert(pcm)
+
+            numpy_median = statistics.median(numpy_times)
+            naive_median = statistics.median(naive_times)
+            name = f"{in_rate}x{in_channels} -> {out_rate}x{out_channels}"
+            print(f"{name:<28}{chunk_ms:>5}ms{naive_median:>12.0f} us{numpy_median:>12.0f} us"
+                  f"{max(numpy_times[1:]):>9.0f} us{naive_median / numpy_median:>8.1f}x"
+                  f"{chunk_ms * 1000 / numpy_median:>9.0f}x{snr_db(output, out_rate, out_channels):>6.1f} dB")
+    print("\nrealtime: audio duration / conversion time per chunk (numpy)")
+
+
+if __name__ == "__main__":
+    main()
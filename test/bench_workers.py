@@ -0,0 +1,107 @@
+"""
+ワーカー数ごとのセッション数の上限のベンチマーク
+
+フェイクモデル(BIDI_MODEL=fake)のサーバー(cdk/bidiagent/workers.py から起動)をワーカー数を変えて起動し、
+load_test.py で同時通話者を段階的に増やす。各段階で以下を満たす最大の通話者数を
+そのワーカー数で収容できるセッション数とする。
+
+    - 失敗した通話者が無い
+    - turn_latency_ms の p90 が --slo-ms 以下
+    - 受信音声の遅れ(downlink_late / downlink_frames)が --late-ratio 以下
+
+負荷生成側も CPU を使うため、コア数の少ないマシンでは結果が頭打ちになる。
+
+    python test/bench_workers.py
+    python test/bench_workers.py --workers 1,2,4 --steps 20,40,80,160 --turns 2
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER = os.path.join(ROOT, "cdk", "bidiagent", "workers.py")
+LOAD_TEST = os.path.join(ROOT, "test", "load_test.py")
+PING_URL = "http://127.0.0.1:8080/ping"
+
+
+def start_server(workers: int) -> subprocess.Popen:
+    env = {**os.environ, "BIDI_MODEL": "fake", "BIDI_WORKERS": str(workers)}
+    server = subprocess.Popen([sys.executable, SERVER], env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, cwd=os.path.dirname(SERVER))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(PING_URL, timeout=1).read()
+            # 全ワーカーの lifespan(プールの充填)を待つ
+            time.sleep(2 + workers)
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_step(sessions: int, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run(
+            [sys.executable, LOAD_TEST, "--sessions", str(sessions), "--ramp-up", str(args.ramp_up),
+             "--turns", str(args.turns), "--output", output.name, "--report-interval", "3600"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        with open(output.name) as f:
+            return json.load(f)["summary"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session capacity by server worker count (fake model)")
+    parser.add_argument("--workers", default="1,2,4", help="Worker counts to compare (default: 1,2,4)")
+    parser.add_argument("--steps", default="10,20,40,80", help="Concurrent callers per step (default: 10,20,40,80)")
+    parser.add_argument("--turns", type=int, default=2, help="Turns per caller (default: 2)")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which each step's callers start (default: 5)")
+    parser.add_argument("--slo-ms", type=float, default=1500, help="Maximum p90 turn latency (default: 1500)")
+    parser.add_argument("--late-ratio", type=float, default=0.01, help="Maximum ratio of late downlink frames (default: 0.01)")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'callers':>7} {'failed':>6} {'p90 turn ms':>11} {'late %':>7}  ok")
+    capacity = {}
+    for workers in (int(value) for value in args.workers.split(",")):
+        server = start_server(workers)
+        capacity[workers] = 0
+        try:
+            for sessions in (int(value) for value in args.steps.split(",")):
+                summary = run_step(sessions, args)
+                p90 = summary["turn_latency_ms"].get("p90") or 0.0
+                late = summary["downlink_late"] / max(summary["downlink_frames"], 1)
+                ok = (summary["failed"] == 0 and summary["turn_timeouts"] == 0
+                      and p90 <= args.slo_ms and late <= args.late_ratio)
+                print(f"{workers:>7} {sessions:>7} {summary['failed']:>6} {p90:>11.0f} {late * 100:>6.1f}%  "
+                      f"{'yes' if ok else 'no'}")
+                if not ok:
+                    break
+                capacity[workers] = sessions
+        finally:
+            stop_server(server)
+
+    print("=" * 40)
+    for workers, sessions in capacity.items():
+        print(f"{workers} workers: {sessions} sessions")
+
+
+if __name__ == "__main__":
+    main()
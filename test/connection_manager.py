@@ -0,0 +1,311 @@
+"""
+AgentCore Runtime への接続情報のキャッシュと事前準備（クライアント側）
+
+以前の get_websocket_connection は、セッションを始めるたびに AgentCoreRuntimeClient（boto3 のセッション）を作っていた。
+そのたびに認証情報を解決して SigV4 で署名し直すため、この処理が毎回接続の前に入っていた。
+SSO / AssumeRole / IMDS から認証情報を取る環境では、これだけで数百 ms かかる。
+
+ConnectionManager は接続に必要なものを先に用意しておく。
+
+- ランタイムクライアントはリージョンごとにキャッシュする（boto3 のセッションが解決済みの認証情報を保持する）
+- 署名済みの URL とヘッダー（presigned=True なら presigned URL）を用意しておく
+  期限（SIGNATURE_TTL_S）が近づいたらバックグラウンドで署名し直す
+- warm=True なら WebSocket を先に開いておき、最初の接続でそれを渡す
+  サーバーのセッションはその時点で始まる
+
+接続のたびに、事前準備によって接続時間から省けた時間を表示する。
+省けた時間 = 最初の署名にかかった時間（以前は毎回かかっていた） + 先に開いておいた場合はハンドシェイクの時間。
+
+    manager = ConnectionManager(region, runtime_arn, session_id, warm=True)
+    await manager.start(subprotocols)          # 署名（と warm の接続）を始める
+    websocket = await manager.connect(subprotocols)
+    ...
+    await manager.close()
+
+ローカルのサーバーで試す（署名の代わりに固定の URL を使う）:
+
+    BIDI_MODEL=fake python cdk/bidiagent/agent.py
+    python test/connection_manager.py --warm
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Callable
+
+import websockets
+from websockets.protocol import State
+
+# 署名を使う期間（秒）。SigV4 のヘッダー署名は x-amz-date から5分程度、presigned URL は最長300秒
+SIGNATURE_TTL_S = 300
+
+# 期限のこの秒数前に署名し直す
+REFRESH_MARGIN_S = 60
+
+# 署名し直しに失敗したときに再試行するまでの時間（秒）
+REFRESH_RETRY_S = 5.0
+
+_runtime_clients: dict = {}
+_runtime_clients_lock = threading.Lock()
+
+
+def runtime_client(region: str):
+    """リージョンごとに1つの AgentCoreRuntimeClient（認証情報の解決は最初の署名で1回だけ）"""
+    with _runtime_clients_lock:
+        client = _runtime_clients.get(region)
+        if client is None:
+            from bedrock_agentcore.runtime import AgentCoreRuntimeClient
+            client = _runtime_clients[region] = AgentCoreRuntimeClient(region=region)
+        return client
+
+
+class SignedConnection:
+    """署名済みの接続情報
+
+    Attributes:
+        url: WebSocket URL（presigned URL の場合は署名を含む）
+        headers: 認証ヘッダー（presigned URL の場合は None）
+        sign_ms: 署名にかかった時間（ms）
+    """
+
+    def __init__(self, url: str, headers: dict | None, sign_ms: float, ttl_s: float):
+        self.url = url
+        self.headers = headers
+        self.sign_ms = sign_ms
+        self.expires_at = time.monotonic() + ttl_s
+
+    def fresh(self, margin_s: float = 0.0) -> bool:
+        """期限まで margin_s 秒以上残っているか"""
+        return time.monotonic() < self.expires_at - margin_s
+
+
+class ConnectionManager:
+    """AgentCore Runtime への接続情報を用意しておき、接続を速くする
+
+    Args:
+        region: AWSリージョン
+        runtime_arn: AgentCore RuntimeのARN
+        session_id: ランタイムのセッションID（再接続でも同じものを使う）
+        presigned: ヘッダーの代わりに presigned URL を使う
+        warm: WebSocket を先に開いておく
+        refresh_margin_s: 期限のこの秒数前に署名し直す
+        signer: 署名の代わりに (url, headers) を返す関数（ローカルのサーバー用）
+        **connect_kwargs: websockets.connect に渡す引数（open_timeout 等）
+    """
+
+    def __init__(
+        self,
+        region: str,
+        runtime_arn: str | None,
+        session_id: str | None = None,
+        presigned: bool = False,
+        warm: bool = False,
+        refresh_margin_s: float = REFRESH_MARGIN_S,
+        signer: Callable[[], tuple[str, dict | None]] | None = None,
+        **connect_kwargs,
+    ):
+        self.region = region
+        self.runtime_arn = runtime_arn
+        self.session_id = session_id
+        self.presigned = presigned
+        self.warm = warm
+        self.refresh_margin_s = refresh_margin_s
+        self._signer = signer or self._sign_with_runtime_client
+        self._connect_kwargs = connect_kwargs
+        self._signed: SignedConnection | None = None
+        self._refresh_task: asyncio.Task | None = None
+        self._warm_task: asyncio.Task | None = None
+        self._warm_subprotocols: list[str] | None = None
+        # 最初の署名（クライアントの作成と認証情報の解決を含む）にかかった時間
+        self.cold_sign_ms = 0.0
+        self.connects = 0
+        self.warm_used = 0
+        self.signed_on_connect = 0
+        self.refreshes = 0
+        self.connect_ms: list[float] = []
+        self.saved_ms: list[float] = []
+
+    async def start(self, warm_subprotocols: list[str] | None = None) -> None:
+        """署名を用意し、期限前に署名し直すタスクを始める（warm なら WebSocket も開き始める）
+
+        Args:
+            warm_subprotocols: 先に開く WebSocket で提示するサブプロトコル
+        """
+        self._signed = await asyncio.to_thread(self._sign)
+        self.cold_sign_ms = self._signed.sign_ms
+        print(f"[Connect] Signed in {self.cold_sign_ms:.0f} ms"
+              f" ({'presigned URL' if self.presigned else 'SigV4 headers'}, refreshed in the background)")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        if self.warm:
+            self._warm_subprotocols = list(warm_subprotocols or [])
+            self._warm_task = asyncio.create_task(self._open(self._signed, self._warm_subprotocols))
+
+    async def connect(self, subprotocols: list[str] | None = None):
+        """WebSocket で接続する（先に開いておいた接続があり、サブプロトコルが同じならそれを返す）"""
+        started = time.perf_counter()
+        subprotocols = list(subprotocols or [])
+        self.connects += 1
+
+        websocket = await self._take_warm(subprotocols)
+        if websocket is not None:
+            handshake_ms = websocket.handshake_ms
+            source = "warm"
+        else:
+            handshake_ms = 0.0
+            signed = self._signed
+            if signed is not None and signed.fresh():
+                source = "cached signature"
+            else:
+                # start() していない・署名し直せていない場合はここで署名する
+                signed = self._signed = await asyncio.to_thread(self._sign)
+                self.signed_on_connect += 1
+                source = "signed now"
+            websocket = await self._open(signed, subprotocols)
+
+        connect_ms = (time.perf_counter() - started) * 1000
+        saved_ms = (self.cold_sign_ms if source != "signed now" else 0.0) + handshake_ms
+        self.connect_ms.append(connect_ms)
+        self.saved_ms.append(saved_ms)
+        print(f"[Connect] Connected in {connect_ms:.0f} ms ({source}, saved {saved_ms:.0f} ms)")
+        return websocket
+
+    async def close(self) -> None:
+        """バックグラウンドのタスクを止め、使わなかった接続を閉じる"""
+        tasks = [task for task in (self._refresh_task, self._warm_task) if task is not None]
+        self._refresh_task = None
+        warm_task, self._warm_task = self._warm_task, None
+        if warm_task is not None and warm_task.done() and not warm_task.cancelled() \
+                and warm_task.exception() is None:
+            await warm_task.result().close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "cold_sign_ms": round(self.cold_sign_ms, 1),
+            "connects": self.connects,
+            "warm_used": self.warm_used,
+            "signed_on_connect": self.signed_on_connect,
+            "refreshes": self.refreshes,
+            "saved_ms": round(sum(self.saved_ms), 1),
+        }
+
+    # --- 内部 ----------------------------------------------------------------
+
+    def _sign_with_runtime_client(self) -> tuple[str, dict | None]:
+        client = runtime_client(self.region)
+        if self.presigned:
+            return client.generate_presigned_url(
+                runtime_arn=self.runtime_arn, session_id=self.session_id, expires=SIGNATURE_TTL_S), None
+        return client.generate_ws_connection(runtime_arn=self.runtime_arn, session_id=self.session_id)
+
+    def _sign(self) -> SignedConnection:
+        started = time.perf_counter()
+        url, headers = self._signer()
+        return SignedConnection(url, headers, (time.perf_counter() - started) * 1000, SIGNATURE_TTL_S)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            delay = self._signed.expires_at - self.refresh_margin_s - time.monotonic()
+            await asyncio.sleep(max(delay, REFRESH_RETRY_S))
+            try:
+                self._signed = await asyncio.to_thread(self._sign)
+                self.refreshes += 1
+            except Exception as e:
+                # 期限までは古い署名を使い続け、切れたら connect() で署名する
+                print(f"[Connect] Failed to refresh the signature: {e}")
+
+    async def _open(self, signed: SignedConnection, subprotocols: list[str]):
+        started = time.perf_counter()
+        websocket = await websockets.connect(
+            signed.url,
+            additional_headers=signed.headers,
+            subprotocols=subprotocols or None,
+            **self._connect_kwargs,
+        )
+        websocket.handshake_ms = (time.perf_counter() - started) * 1000
+        return websocket
+
+    async def _take_warm(self, subprotocols: list[str]):
+        """先に開いておいた接続を取り出す（使えなければ None。1回だけ使う）"""
+        task, self._warm_task = self._warm_task, None
+        if task is None:
+            return None
+        if subprotocols != self._warm_subprotocols:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if not task.cancelled() and task.exception() is None:
+                await task.result().close()
+            return None
+        try:
+            # まだ開いている途中ならその完了を待つ（新しく開くより早い）
+            websocket = await task
+        except Exception as e:
+            print(f"[Connect] Warm connection failed ({type(e).__name__}: {e}), connecting now")
+            return None
+        if websocket.state is not State.OPEN:
+            print("[Connect] Warm connection was closed, connecting now")
+            return None
+        self.warm_used += 1
+        return websocket
+
+
+# --- デモ ---------------------------------------------------------------------
+
+async def demo(args) -> None:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+    import framing
+
+    subprotocols = [framing.SUBPROTOCOL_BINARY]
+    signer = None if args.arn else (lambda: (args.uri, None))
+
+    def sign_cold() -> tuple[str, dict | None]:
+        # 以前の get_websocket_connection と同じく、クライアントを作って認証情報を解決するところから
+        if not args.arn:
+            return args.uri, None
+        from bedrock_agentcore.runtime import AgentCoreRuntimeClient
+        return AgentCoreRuntimeClient(region=args.region).generate_ws_connection(runtime_arn=args.arn)
+
+    cold, prepared = [], []
+    for _ in range(args.sessions):
+        # 以前の方法: セッションを始めてから署名して接続する
+        started = time.perf_counter()
+        url, headers = await asyncio.to_thread(sign_cold)
+        websocket = await websockets.connect(url, additional_headers=headers, subprotocols=subprotocols,
+                                             open_timeout=60)
+        cold.append((time.perf_counter() - started) * 1000)
+        await websocket.close()
+
+        # 事前準備: 署名（と warm の接続）を済ませておき、利用者が話し始めたら接続する
+        manager = ConnectionManager(args.region, args.arn, warm=args.warm, signer=signer, open_timeout=60)
+        await manager.start(subprotocols)
+        await asyncio.sleep(args.idle_ms / 1000)
+        started = time.perf_counter()
+        websocket = await manager.connect(subprotocols)
+        prepared.append((time.perf_counter() - started) * 1000)
+        await websocket.close()
+        await manager.close()
+
+    print(f"[Demo] connect on the critical path: cold median {statistics.median(cold):.1f} ms, "
+          f"prepared median {statistics.median(prepared):.1f} ms ({'warm' if args.warm else 'cached signature'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached and pre-signed AgentCore Runtime connections demo")
+    parser.add_argument("--uri", default="ws://localhost:8080/ws", help="WebSocket URI (default: ws://localhost:8080/ws)")
+    parser.add_argument("--arn", help="Agent Runtime ARN (sign with SigV4 instead of connecting to --uri)")
+    parser.add_argument("--region", default="ap-northeast-1", help="AWS region for --arn (default: ap-northeast-1)")
+    parser.add_argument("--warm", action="store_true", help="Open the WebSocket before the session starts")
+    parser.add_argument("--sessions", type=int, default=5, help="Sessions to start (default: 5)")
+    parser.add_argument("--idle-ms", type=int, default=200,
+                        help="Time between preparing and starting a session (default: 200)")
+    args = parser.parse_args()
+    asyncio.run(demo(args))
+
+
+if __name__ == "__main__":
+    main()
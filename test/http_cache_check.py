@@ -0,0 +1,146 @@
+"""
+http_request ツールの共有HTTPクライアント(http_client.py)の動作確認
+
+ローカルにHTTPスタブを立て、http_request ツールを変更前(strands_tools のまま)と
+変更後(HttpClient を install)で同じ回数呼び出し、所要時間・TCP接続数・キャッシュの結果を比較する。
+変更後は、呼び出しの Cookie と max_redirects が次の呼び出しに残らないことも確認する。
+
+    /cached   Cache-Control: max-age=60(キャッシュされる)
+    /nostore  Cache-Control: no-store(毎回取得する)
+    /vary     Vary: Accept-Language(ヘッダごとにキャッシュされる)
+    /slow     0.2秒かけて応答する(ホストごとの接続数の上限の確認)
+    /login    Set-Cookie を返す(受け取った Cookie ヘッダを本文に返す)
+    /redirect /login へリダイレクトする
+
+    python test/http_cache_check.py
+    python test/http_cache_check.py --requests 50 --per-host 2
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# サーバー(cdk/bidiagent)と共通の定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+from http_client import HttpClient
+
+# http_request の確認ダイアログ等を出さない
+os.environ.setdefault("BYPASS_TOOL_CONSENT", "true")
+from strands_tools import http_request
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    hits = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubHandler.lock:
+            StubHandler.connections.add(self.client_address)
+            StubHandler.hits += 1
+        headers = {"Content-Type": "application/json"}
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/login")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path == "/login":
+            headers["Set-Cookie"] = "sid=secret; Path=/"
+        elif self.path == "/cached":
+            headers["Cache-Control"] = "max-age=60"
+        elif self.path == "/nostore":
+            headers["Cache-Control"] = "no-store"
+        elif self.path == "/vary":
+            headers["Cache-Control"] = "max-age=60"
+            headers["Vary"] = "Accept-Language"
+        elif self.path == "/slow":
+            time.sleep(0.2)
+        body = (f'{{"path": "{self.path}", "lang": "{self.headers.get("Accept-Language", "")}", '
+                f'"cookie": "{self.headers.get("Cookie", "")}"}}').encode()
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def call(url: str, headers: dict | None = None, **options) -> dict:
+    return http_request.http_request({
+        "toolUseId": "check",
+        "input": {"method": "GET", "url": url, "headers": headers or {}, **options},
+    })
+
+
+def run(base: str, requests: int, label: str) -> None:
+    StubHandler.connections.clear()
+    StubHandler.hits = 0
+    started = time.perf_counter()
+    for path in ("/cached", "/nostore"):
+        for _ in range(requests):
+            result = call(base + path)
+            assert result["status"] == "success", result
+    for lang in ("ja", "en"):
+        for _ in range(requests // 2):
+            result = call(base + "/vary", {"Accept-Language": lang})
+            assert f'"lang": "{lang}"' in result["content"][-1]["text"], result
+    elapsed = time.perf_counter() - started
+    total = 3 * requests
+    print(f"{label:8s} {total} calls  {elapsed * 1000 / total:6.2f} ms/call  "
+          f"server hits {StubHandler.hits:3d}  TCP connections {len(StubHandler.connections)}")
+
+
+def run_isolation(base: str) -> None:
+    """1回の呼び出しの Cookie と max_redirects が次の呼び出しに残らない"""
+    assert call(base + "/login")["status"] == "success"
+    result = call(base + "/login")
+    assert '"cookie": ""' in result["content"][-1]["text"], result
+    assert call(base + "/redirect", max_redirects=0)["status"] == "error"
+    result = call(base + "/redirect")
+    assert result["status"] == "success", result
+    print("isolation: cookies and max_redirects do not leak between calls")
+
+
+def run_concurrent(base: str, workers: int) -> None:
+    StubHandler.connections.clear()
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda _: call(base + "/slow"), range(workers)))
+    print(f"/slow x{workers} concurrent: {time.perf_counter() - started:.2f} s, "
+          f"TCP connections {len(StubHandler.connections)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the pooled HTTP client and response cache of http_request")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint")
+    parser.add_argument("--per-host", type=int, default=4, help="Connections per host (BIDI_HTTP_PER_HOST)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    # http_request の表示(rich)を抑える
+    http_request.console_util.create = lambda: http_request.console_util.Console(file=open(os.devnull, "w"))
+
+    run(base, args.requests, "before")
+    client = HttpClient(per_host=args.per_host)
+    client.install(http_request)
+    run(base, args.requests, "after")
+    print(f"cache: {client.stats()}")
+    run_isolation(base)
+    run_concurrent(base, args.per_host * 2)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""
+WebSocketブリッジの同時接続負荷テスト
+
+N人の仮想通話者がそれぞれ WebSocket で接続し、録音済み(WAV)または合成の音声を
+実時間で送りながらターン(発話 → 応答)を繰り返す。段階的に通話者を増やし、
+以下の分布(p50 / p90 / p99 / max)を表示する。
+
+    connect_ms       接続開始 → WebSocket確立(コーデックのネゴシエーションを含む)
+    first_audio_ms   WebSocket確立 → 最初の bidi_audio_stream
+    turn_latency_ms  発話の最後の音声を送信 → その応答の最初の音声
+
+音声の途切れは次の2つで数える:
+
+    uplink_late / uplink_dropped
+        送信が予定時刻より1チャンク以上遅れた数 / drop_ms 以上遅れて捨てた数
+        (マイクの入力バッファがあふれる状況に相当。負荷生成側の飽和の目安にもなる)
+    downlink_late
+        受信音声が再生予定時刻(応答の最初の音声 + jitter_ms + それまでの音声の長さ)より
+        遅れて届いた数(プレイヤーでは再生が途切れる)
+
+Bedrockなしで試す場合は、フェイクモデルでサーバーを起動する:
+
+    # ターミナル1
+    BIDI_MODEL=fake uv run test/simple_ws_server.py
+
+    # ターミナル2: 20人まで30秒かけて増やし、各自3ターン
+    python test/load_test.py --sessions 20 --ramp-up 30 --turns 3
+
+    # 段階的に増やす(10人まで10秒、50人まで60秒、100人まで60秒)
+    python test/load_test.py --stages 10:10,50:60,100:60
+
+    # 録音済みの発話(16kHz / モノラル / 16bit WAV)を使い、結果をJSONで保存
+    python test/load_test.py --wav utterance.wav --output result.json
+
+    # AgentCore Runtime に対して実行
+    python test/load_test.py --arn "arn:aws:bedrock-agentcore:..." --sessions 5
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import sys
+import time
+import wave
+from array import array
+
+import websockets
+
+# サーバー(cdk/bidiagent)と共通のバイナリフレーム定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import codec
+import control
+import framing
+from json_codec import default_codec
+
+from audio_pipeline import FrameCoalescer
+
+# オーディオ設定（クライアントと同じ）
+SAMPLE_RATE = 16000  # 16kHz
+CHANNELS = 1         # モノラル
+CHUNK_SIZE = 512     # 録音1回分のフレーム数(32ms)
+SAMPLE_WIDTH = 2     # 16bit PCM
+
+CHUNK_BYTES = CHUNK_SIZE * CHANNELS * SAMPLE_WIDTH
+CHUNK_SECONDS = CHUNK_SIZE / SAMPLE_RATE
+
+# 分布に含めるメトリクス
+METRICS = ("connect_ms", "first_audio_ms", "turn_latency_ms")
+
+
+def load_wav(path: str) -> bytes:
+    """発話音声(16kHz / モノラル / 16bit PCM の WAV)を読み込む"""
+    with wave.open(path, "rb") as f:
+        if (f.getframerate(), f.getnchannels(), f.getsampwidth()) != (SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH):
+            raise ValueError(
+                f"{path}: expected {SAMPLE_RATE} Hz / {CHANNELS} ch / 16 bit, "
+                f"got {f.getframerate()} Hz / {f.getnchannels()} ch / {f.getsampwidth() * 8} bit"
+            )
+        return f.readframes(f.getnframes())
+
+
+def synthetic_speech(duration_ms: int) -> bytes:
+    """発話の代わりの合成音声(振幅が4Hzで揺れる200Hzの音)"""
+    frames = SAMPLE_RATE * duration_ms // 1000
+    samples = array("h", (
+        int(8000 * (0.6 + 0.4 * math.sin(2 * math.pi * 4 * i / SAMPLE_RATE))
+            * math.sin(2 * math.pi * 200 * i / SAMPLE_RATE))
+        for i in range(frames)
+    ))
+    return samples.tobytes()
+
+
+def split_chunks(pcm: bytes) -> list[bytes]:
+    """録音と同じ CHUNK_SIZE ごとに分割する(最後の端数は無音で埋める)"""
+    if len(pcm) % CHUNK_BYTES:
+        pcm += bytes(CHUNK_BYTES - len(pcm) % CHUNK_BYTES)
+    return [pcm[i:i + CHUNK_BYTES] for i in range(0, len(pcm), CHUNK_BYTES)]
+
+
+def parse_stages(stages: str | None, sessions: int, ramp_up: float) -> list[tuple[int, float]]:
+    """"10:30,50:60" 形式(通話者数:秒)の段階を [(10, 30.0), (50, 60.0)] にする"""
+    if not stages:
+        return [(sessions, ramp_up)]
+    result = []
+    for stage in stages.split(","):
+        target, _, seconds = stage.partition(":")
+        result.append((int(target), float(seconds or 0)))
+    return result
+
+
+def start_offsets(stages: list[tuple[int, float]]) -> list[float]:
+    """各通話者の開始時刻(テスト開始からの秒数)"""
+    offsets = []
+    started = 0
+    stage_start = 0.0
+    for target, seconds in stages:
+        count = target - started
+        for i in range(count):
+            offsets.append(stage_start + seconds * i / count)
+        started = max(started, target)
+        stage_start += seconds
+    return offsets
+
+
+def percentiles(values: list[float]) -> dict:
+    """p50 / p90 / p99 / max(最近傍順位)"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50), 1),
+        "p90": round(rank(90), 1),
+        "p99": round(rank(99), 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+class VirtualCaller:
+    """1人分の仮想通話者
+
+    接続後、発話(speech)→ 無音を実時間で送り続け、応答が完了したら think_ms 待って
+    次の発話を送る。これを turns 回繰り返して切断する。
+
+    Args:
+        caller_id: 通話者の番号(ログ用)
+        connect: (uri, headers) を返す関数(AgentCore の場合は署名付きURLを毎回生成する)
+        speech: 発話音声(16bit PCM)。最後のチャンクを送った時刻を発話の終了とする
+        args: コマンドライン引数
+    """
+
+    def __init__(self, caller_id: int, connect, speech: bytes, args):
+        self.caller_id = caller_id
+        self._connect = connect
+        self._speech_chunks = split_chunks(speech)
+        self._silence_chunk = bytes(CHUNK_BYTES)
+        self._pause_chunks = int(args.pause_ms / 1000 / CHUNK_SECONDS)
+        self._args = args
+
+        self.connect_ms: float | None = None
+        self.first_audio_ms: float | None = None
+        self.turn_latency_ms: list[float] = []
+        self.turns_completed = 0
+        self.turn_timeouts = 0
+        self.uplink_late = 0
+        self.uplink_dropped = 0
+        self.downlink_late = 0
+        self.downlink_frames = 0
+        self.error: str | None = None
+
+        # 送受信タスク間で共有する状態
+        self._opened = 0.0
+        self._speech_end: float | None = None
+        self._awaiting_audio = False
+        self._turn_done = asyncio.Event()
+        self._playout_start: float | None = None
+        self._played = 0.0
+
+    async def run(self) -> None:
+        args = self._args
+        uri, headers = self._connect()
+        subprotocols = list(framing.SUPPORTED_SUBPROTOCOLS) if args.transport == "binary" else [framing.SUBPROTOCOL_JSON]
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(uri, additional_headers=headers, subprotocols=subprotocols,
+                                          max_size=None) as websocket:
+                binary = websocket.subprotocol == framing.SUBPROTOCOL_BINARY
+
+                # 音声コーデック・ペーシング・受け取るイベントのネゴシエーション（対応サーバーのみ）
+                audio_format = "pcm"
+                options = {
+                    "audio_format": "opus" if args.codec == "opus" and codec.OPUS_AVAILABLE else None,
+                    "audio_lead_ms": args.audio_lead_ms,
+                    "transcripts": args.transcripts,
+                    "usage": args.usage,
+                }
+                if any(value is not None for value in options.values()) and websocket.subprotocol is not None:
+                    ack = await control.negotiate(websocket, **options)
+                    audio_format = ack.get("audio_format", "pcm")
+                encoder = codec.OpusEncoder(SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+                decoder = codec.OpusDecoder(SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+
+                self._opened = time.perf_counter()
+                self.connect_ms = (self._opened - started) * 1000
+
+                send_task = asyncio.create_task(self._send(websocket, binary, encoder))
+                receive_task = asyncio.create_task(self._receive(websocket, decoder))
+                done, pending = await asyncio.wait([send_task, receive_task], return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+                for task in done:
+                    task.result()
+
+        except (websockets.exceptions.WebSocketException, OSError, asyncio.TimeoutError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    # --- 送信 ------------------------------------------------------------
+
+    async def _send(self, websocket, binary: bool, encoder: codec.OpusEncoder | None) -> None:
+        """発話と無音をマイクと同じ間隔(CHUNK_SIZE ごと)で送る"""
+        args = self._args
+        coalescer = FrameCoalescer(args.frame_ms, SAMPLE_RATE, CHANNELS)
+        loop = asyncio.get_running_loop()
+        next_send = loop.time()
+
+        async def send_frame(frame: bytes) -> None:
+            audio_format = "pcm"
+            if encoder:
+                frame = encoder.encode(frame)
+                if not frame:
+                    return
+                audio_format = "opus"
+            if binary:
+                message = framing.encode_audio_frame(
+                    framing.KIND_AUDIO_INPUT, frame, audio_format, SAMPLE_RATE, CHANNELS
+                )
+            else:
+                message = default_codec.encode_audio(
+                    "bidi_audio_input", base64.b64encode(frame).decode("ascii"), audio_format, SAMPLE_RATE, CHANNELS
+                )
+            await websocket.send(message)
+
+        async def send_chunk(chunk: bytes) -> None:
+            # 予定時刻(前回 + CHUNK_SECONDS)まで待って送る。遅れは数える
+            nonlocal next_send
+            delay = next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay >= args.drop_ms / 1000:
+                # 入力バッファがあふれて失われた分を飛ばす
+                dropped = int(-delay / CHUNK_SECONDS)
+                self.uplink_dropped += dropped
+                next_send += dropped * CHUNK_SECONDS
+            elif -delay >= CHUNK_SECONDS:
+                self.uplink_late += 1
+            next_send += CHUNK_SECONDS
+            frame = coalescer.push(chunk)
+            if frame is not None:
+                await send_frame(frame)
+
+        for turn in range(args.turns):
+            self._turn_done.clear()
+            for chunk in self._speech_chunks:
+                await send_chunk(chunk)
+            # 発話の終わり(まとめ中の音声も送り切る)
+            frame = coalescer.flush()
+            if frame is not None:
+                await send_frame(frame)
+            self._speech_end = time.perf_counter()
+            self._awaiting_audio = True
+
+            # サーバーが発話の終了を検出するための無音
+            for _ in range(self._pause_chunks):
+                await send_chunk(self._silence_chunk)
+
+            # 応答が完了するまで無音を送り続ける(マイクは開いたまま)
+            deadline = loop.time() + args.turn_timeout
+            while not self._turn_done.is_set():
+                if loop.time() > deadline:
+                    self.turn_timeouts += 1
+                    break
+                await send_chunk(self._silence_chunk)
+
+            # 次の発話までの間
+            for _ in range(int(args.think_ms / 1000 / CHUNK_SECONDS)):
+                await send_chunk(self._silence_chunk)
+
+    # --- 受信 ------------------------------------------------------------
+
+    async def _receive(self, websocket, decoder: codec.OpusDecoder | None) -> None:
+        async for message in websocket:
+            if isinstance(message, bytes):
+                _, audio_format, sample_rate, channels, audio = framing.decode_audio_frame(message)
+                self._on_audio(audio, audio_format, sample_rate, channels, decoder)
+                continue
+
+            data = default_codec.decode(message)
+            msg_type = data.get("type", "")
+            if msg_type == "bidi_audio_stream":
+                self._on_audio(base64.b64decode(data.get("audio", "")), data.get("format"),
+                               data.get("sample_rate", SAMPLE_RATE), data.get("channels", CHANNELS), decoder)
+            elif msg_type in ("bidi_response_start", "bidi_interruption"):
+                self._playout_start = None
+            elif msg_type == "bidi_response_complete":
+                self._playout_start = None
+                if data.get("stop_reason") != "tool_use" and self._speech_end is not None:
+                    self._speech_end = None
+                    self.turns_completed += 1
+                    self._turn_done.set()
+            elif msg_type == "bidi_error":
+                raise RuntimeError(f"bidi_error: {data.get('message')}")
+
+    def _on_audio(self, audio: bytes, audio_format: str, sample_rate: int, channels: int,
+                  decoder: codec.OpusDecoder | None) -> None:
+        now = time.perf_counter()
+        if audio_format == "opus":
+            audio = decoder.decode(audio)
+        duration = len(audio) / (SAMPLE_WIDTH * channels * sample_rate)
+        self.downlink_frames += 1
+
+        if self.first_audio_ms is None:
+            self.first_audio_ms = (now - self._opened) * 1000
+        if self._awaiting_audio:
+            self._awaiting_audio = False
+            self.turn_latency_ms.append((now - self._speech_end) * 1000)
+
+        # 再生予定時刻に間に合ったか(ジッタバッファ jitter_ms のプレイヤーを想定)
+        jitter = self._args.jitter_ms / 1000
+        if self._playout_start is None:
+            self._playout_start = now + jitter
+            self._played = 0.0
+        elif now > self._playout_start + self._played:
+            # 再生が途切れる。プレイヤーは jitter_ms 溜めてから再開する
+            self.downlink_late += 1
+            self._playout_start = now + jitter - self._played
+        self._played += duration
+
+    def as_dict(self) -> dict:
+        return {
+            "caller": self.caller_id,
+            "connect_ms": self.connect_ms,
+            "first_audio_ms": self.first_audio_ms,
+            "turn_latency_ms": self.turn_latency_ms,
+            "turns_completed": self.turns_completed,
+            "turn_timeouts": self.turn_timeouts,
+            "uplink_late": self.uplink_late,
+            "uplink_dropped": self.uplink_dropped,
+            "downlink_late": self.downlink_late,
+            "downlink_frames": self.downlink_frames,
+            "error": self.error,
+        }
+
+
+def summarize(callers: list[VirtualCaller], peak_active: int, elapsed: float) -> dict:
+    """通話者ごとの結果を分布と合計にまとめる"""
+    values = {name: [] for name in METRICS}
+    for caller in callers:
+        if caller.connect_ms is not None:
+            values["connect_ms"].append(caller.connect_ms)
+        if caller.first_audio_ms is not None:
+            values["first_audio_ms"].append(caller.first_audio_ms)
+        values["turn_latency_ms"].extend(caller.turn_latency_ms)
+
+    return {
+        "sessions": len(callers),
+        "failed": sum(1 for caller in callers if caller.error),
+        "peak_active": peak_active,
+        "elapsed_s": round(elapsed, 1),
+        "turns_completed": sum(caller.turns_completed for caller in callers),
+        "turn_timeouts": sum(caller.turn_timeouts for caller in callers),
+        "uplink_late": sum(caller.uplink_late for caller in callers),
+        "uplink_dropped": sum(caller.uplink_dropped for caller in callers),
+        "downlink_late": sum(caller.downlink_late for caller in callers),
+        "downlink_frames": sum(caller.downlink_frames for caller in callers),
+        **{name: percentiles(values[name]) for name in METRICS},
+    }
+
+
+async def run_load(args) -> dict:
+    """段階に従って通話者を開始し、全員の終了を待って結果を返す"""
+    speech = load_wav(args.wav) if args.wav else synthetic_speech(args.speech_ms)
+
+    if args.arn:
+        from agentcore_client import get_websocket_connection
+
+        def connect():
+            return get_websocket_connection(args.region, args.arn)
+    else:
+        def connect():
+            return args.uri, None
+
+    offsets = start_offsets(parse_stages(args.stages, args.sessions, args.ramp_up))
+    callers = [VirtualCaller(i, connect, speech, args) for i in range(len(offsets))]
+    active = 0
+    peak_active = 0
+    finished = 0
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    async def run_caller(caller: VirtualCaller, offset: float) -> None:
+        nonlocal active, peak_active, finished
+        await asyncio.sleep(max(0.0, started + offset - loop.time()))
+        active += 1
+        peak_active = max(peak_active, active)
+        try:
+            await caller.run()
+        except Exception as e:
+            caller.error = f"{type(e).__name__}: {e}"
+        finally:
+            active -= 1
+            finished += 1
+        if caller.error:
+            print(f"[Load] caller {caller.caller_id} failed: {caller.error}")
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(args.report_interval)
+            print(f"[Load] t={loop.time() - started:.0f}s active={active} finished={finished}"
+                  f"/{len(callers)} turns={sum(caller.turns_completed for caller in callers)}")
+
+    print(f"[Load] {len(callers)} callers, target: {args.arn or args.uri}, transport: {args.transport}, "
+          f"codec: {args.codec}, turns: {args.turns}")
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(*(run_caller(caller, offset) for caller, offset in zip(callers, offsets)))
+    finally:
+        reporter.cancel()
+
+    result = summarize(callers, peak_active, loop.time() - started)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": result, "callers": [caller.as_dict() for caller in callers]}, f, indent=2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load generator for the bidi WebSocket bridge")
+    parser.add_argument("--uri", default="ws://localhost:8080/ws", help="WebSocket URI (default: ws://localhost:8080/ws)")
+    parser.add_argument("--arn", help="Agent Runtime ARN (connect to AgentCore Runtime with SigV4 instead of --uri)")
+    parser.add_argument("--region", default="ap-northeast-1", help="AWS region for --arn (default: ap-northeast-1)")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of virtual callers (default: 10)")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which callers are started (default: 10)")
+    parser.add_argument("--stages", help="Ramp schedule as total_callers:seconds,... (e.g. 10:10,50:60); overrides --sessions/--ramp-up")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per caller (default: 3)")
+    parser.add_argument("--wav", help="Utterance to stream (16 kHz mono 16-bit WAV); synthetic audio if omitted")
+    parser.add_argument("--speech-ms", type=int, default=1500, help="Length of the synthetic utterance (default: 1500)")
+    parser.add_argument("--pause-ms", type=int, default=800, help="Silence after each utterance before waiting for the response (default: 800)")
+    parser.add_argument("--think-ms", type=int, default=500, help="Silence between a response and the next utterance (default: 500)")
+    parser.add_argument("--turn-timeout", type=float, default=30.0, help="Seconds to wait for a response (default: 30)")
+    parser.add_argument("--transport", choices=["binary", "json"], default="binary", help="Audio transport (default: binary)")
+    parser.add_argument("--codec", choices=["pcm", "opus"], default="pcm", help="Audio codec (default: pcm)")
+    parser.add_argument("--audio-lead-ms", type=int, help="Ask the server to pace downlink audio this far ahead of playback (0 disables)")
+    parser.add_argument("--transcripts", choices=["all", "final", "none"], help="Transcript updates to request from the server")
+    parser.add_argument("--usage", choices=["all", "turn", "none"], help="Usage events to request from the server")
+    parser.add_argument("--frame-ms", type=float, default=0, help="Coalesce uplink audio into frames of this many ms (default: 0)")
+    parser.add_argument("--jitter-ms", type=float, default=60, help="Playout buffer assumed for downlink late frames (default: 60)")
+    parser.add_argument("--drop-ms", type=float, default=200, help="Uplink lateness at which audio counts as dropped (default: 200)")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress lines (default: 5)")
+    parser.add_argument("--output", help="Write the summary and per-caller results to this JSON file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args))
+
+    print("=" * 60)
+    print("Load Test Result")
+    print("=" * 60)
+    for key, value in result.items():
+        print(f"{key:>16}: {value}")
+    if result["uplink_late"] or result["uplink_dropped"]:
+        print("[Warning] Uplink fell behind real time; the load generator itself may be saturated.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+多重化WebSocketクライアント(bidi.mux.v1)
+
+1つの WebSocket 接続の上で複数の音声セッション(ストリーム)を開閉するためのクライアント。
+電話ゲートウェイのように多数の通話を中継する場合、通話ごとの SigV4 署名と
+WebSocket のハンドシェイクが不要になる。プロトコルは cdk/bidiagent/mux.py を参照。
+
+    async with await MuxClient.connect(uri, headers) as client:
+        stream = await client.open_stream(transcripts="final", usage="none")
+        await stream.send_audio(pcm)
+        async for event in stream:
+            ...
+        await stream.close()
+
+- ストリームの受信イベントは通常の接続と同じ形式(バイナリの音声フレームも base64 のイベントに直す)
+- サーバーから mux_pause を受けたストリームの send_audio / send_event は mux_resume まで待つ
+- 受信したイベントを読み出さずに溜めたストリームは、サーバーに mux_pause を送って送信を止めてもらう
+
+デモ(N本のストリームを1接続で同時に開き、合成音声で1ターンずつ話す):
+
+    # ローカル(BIDI_MODEL=fake python cdk/bidiagent/agent.py)
+    python test/mux_client.py --streams 10
+
+    # AgentCore Runtime(署名は接続時の1回だけ)
+    python test/mux_client.py --arn "arn:aws:bedrock-agentcore:..." --streams 10
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import os
+import statistics
+import sys
+import time
+
+import websockets
+
+# サーバー(cdk/bidiagent)と共通の定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import framing
+import mux
+from json_codec import default_codec
+
+# ストリームの受信キューで mux_pause を送るイベント数
+INBOX_HIGH = 500
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+
+
+class MuxStreamClosed(Exception):
+    """ストリームが閉じられた(サーバーの mux_closed)"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(f"stream closed ({code}): {reason}")
+        self.code = code
+        self.reason = reason
+
+
+class MuxStream:
+    """1つのストリーム(1つの音声セッション)"""
+
+    def __init__(self, client: "MuxClient", stream: int):
+        self._client = client
+        self.stream = stream
+        self.binary = False
+        self.closed: MuxStreamClosed | None = None
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._paused_server = False
+        self._opened = asyncio.get_running_loop().create_future()
+
+    async def send_event(self, event: dict) -> None:
+        """イベント(bidi_text_input / bridge_config 等)を送る"""
+        await self._wait_writable()
+        await self._client._send(mux.tag_json(self.stream, default_codec.encode(event)))
+
+    async def send_audio(self, pcm: bytes, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS) -> None:
+        """PCM音声を送る(バイナリフレームが使えればバイナリで)"""
+        await self._wait_writable()
+        if self.binary:
+            frame = framing.encode_audio_frame(framing.KIND_AUDIO_INPUT, pcm, "pcm", sample_rate, channels)
+            await self._client._send(mux.encode_stream_frame(self.stream, frame))
+        else:
+            await self._client._send(mux.tag_json(self.stream, default_codec.encode_audio(
+                "bidi_audio_input", base64.b64encode(pcm).decode("ascii"), "pcm", sample_rate, channels)))
+
+    async def receive(self) -> dict:
+        """イベントを1つ受信する(閉じられたら MuxStreamClosed)"""
+        event = await self._events.get()
+        if isinstance(event, MuxStreamClosed):
+            raise event
+        if self._paused_server and self._events.qsize() <= INBOX_HIGH // 4:
+            self._paused_server = False
+            await self._client._send_control(mux.MUX_RESUME, self.stream)
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return await self.receive()
+        except MuxStreamClosed:
+            raise StopAsyncIteration
+
+    async def close(self) -> None:
+        """ストリームを閉じる(サーバーのセッションを終了する)"""
+        if self.closed is None:
+            await self._client._send_control(mux.MUX_CLOSE, self.stream)
+
+    async def _wait_writable(self) -> None:
+        if self.closed is not None:
+            raise self.closed
+        await self._writable.wait()
+
+    # --- MuxClient から呼ばれる ------------------------------------------------
+
+    def _deliver(self, event: dict) -> None:
+        self._events.put_nowait(event)
+        if self._events.qsize() >= INBOX_HIGH and not self._paused_server:
+            self._paused_server = True
+            self._client._send_control_soon(mux.MUX_PAUSE, self.stream)
+
+    def _on_closed(self, code: int, reason: str) -> None:
+        self.closed = MuxStreamClosed(code, reason)
+        self._writable.set()
+        self._events.put_nowait(self.closed)
+        if not self._opened.done():
+            self._opened.set_exception(self.closed)
+
+
+class MuxClient:
+    """多重化された1つの WebSocket 接続"""
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._streams: dict[int, MuxStream] = {}
+        self._ids = itertools.count(1)
+        self._tasks: set[asyncio.Task] = set()
+        self._reader = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, uri: str, headers: dict | None = None, **kwargs) -> "MuxClient":
+        """接続する(サーバーが bidi.mux.v1 に対応していなければ RuntimeError)"""
+        websocket = await websockets.connect(
+            uri, additional_headers=headers, subprotocols=[mux.SUBPROTOCOL_MUX], **kwargs)
+        if websocket.subprotocol != mux.SUBPROTOCOL_MUX:
+            await websocket.close()
+            raise RuntimeError("server does not support multiplexed connections")
+        return cls(websocket)
+
+    async def __aenter__(self) -> "MuxClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open_stream(self, binary: bool = True, **options) -> MuxStream:
+        """ストリームを開き、サーバーが受け入れるまで待つ
+
+        options は mux_open にそのまま載せる(events / transcripts / usage)。
+        受け入れられなかった場合(サーバーの上限等)は MuxStreamClosed。
+        """
+        stream = MuxStream(self, next(self._ids))
+        self._streams[stream.stream] = stream
+        await self._send_control(mux.MUX_OPEN, stream.stream, binary=binary, **options)
+        await stream._opened
+        return stream
+
+    async def close(self) -> None:
+        await self._websocket.close()
+        await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def _send(self, message: str | bytes) -> None:
+        await self._websocket.send(message)
+
+    async def _send_control(self, message_type: str, stream: int, **fields) -> None:
+        await self._send(default_codec.encode({"type": message_type, "stream": stream, **fields}))
+
+    def _send_control_soon(self, message_type: str, stream: int) -> None:
+        task = asyncio.create_task(self._send_control(message_type, stream))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read(self) -> None:
+        try:
+            async for message in self._websocket:
+                if isinstance(message, bytes):
+                    stream_id, frame = mux.decode_stream_frame(message)
+                    stream = self._streams.get(stream_id)
+                    if stream is not None:
+                        stream._deliver(framing.frame_to_event(frame))
+                    continue
+                event = default_codec.decode(message)
+                stream = self._streams.get(event.pop("stream", None))
+                if stream is None:
+                    continue
+                event_type = event.get("type")
+                if event_type == mux.MUX_OPENED:
+                    stream.binary = event.get("subprotocol") == framing.SUBPROTOCOL_BINARY
+                    stream._opened.set_result(None)
+                elif event_type == mux.MUX_CLOSED:
+                    del self._streams[stream.stream]
+                    stream._on_closed(event.get("code", 1000), event.get("reason", ""))
+                elif event_type == mux.MUX_PAUSE:
+                    stream._writable.clear()
+                elif event_type == mux.MUX_RESUME:
+                    stream._writable.set()
+                else:
+                    stream._deliver(event)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for stream in list(self._streams.values()):
+                stream._on_closed(1006, "connection closed")
+            self._streams.clear()
+
+
+# --- デモ ---------------------------------------------------------------------
+
+def synthetic_speech(duration_ms: int) -> bytes:
+    """発話の代わりの合成音声(load_test.py と同じ)"""
+    from load_test import synthetic_speech as speech
+    return speech(duration_ms)
+
+
+async def run_call(client: MuxClient, speech: bytes, chunk_bytes: int) -> dict:
+    """1本のストリームで1ターン話し、開くまでと最初の応答音声までの時間を返す"""
+    started = time.perf_counter()
+    stream = await client.open_stream(transcripts="final", usage="none")
+    opened = time.perf_counter()
+    chunk_seconds = chunk_bytes / (SAMPLE_RATE * CHANNELS * 2)
+    silence = bytes(chunk_bytes)
+
+    async def speak() -> None:
+        for offset in range(0, len(speech), chunk_bytes):
+            await stream.send_audio(speech[offset:offset + chunk_bytes])
+            await asyncio.sleep(chunk_seconds)
+        # 応答が終わるまで無音を送り続ける(マイクと同じ)
+        while True:
+            await stream.send_audio(silence)
+            await asyncio.sleep(chunk_seconds)
+
+    speaker = asyncio.create_task(speak())
+    first_audio = None
+    try:
+        async for event in stream:
+            if event.get("type") == "bidi_audio_stream" and first_audio is None:
+                first_audio = time.perf_counter()
+            if event.get("type") == "bidi_response_complete":
+                break
+    finally:
+        speaker.cancel()
+        await stream.close()
+    return {
+        "open_ms": (opened - started) * 1000,
+        "first_audio_ms": (first_audio - opened) * 1000 if first_audio else None,
+    }
+
+
+async def demo(args) -> None:
+    if args.arn:
+        from agentcore_client import get_websocket_connection
+        uri, headers = get_websocket_connection(args.region, args.arn)
+    else:
+        uri, headers = args.uri, None
+
+    started = time.perf_counter()
+    client = await MuxClient.connect(uri, headers, open_timeout=60)
+    connect_ms = (time.perf_counter() - started) * 1000
+    print(f"[Mux] Connected in {connect_ms:.0f} ms (one handshake for {args.streams} streams)")
+
+    speech = synthetic_speech(args.speech_ms)
+    async with client:
+        results = await asyncio.gather(
+            *(run_call(client, speech, 1024) for _ in range(args.streams)), return_exceptions=True)
+
+    ok = [result for result in results if isinstance(result, dict)]
+    for result in results:
+        if not isinstance(result, dict):
+            print(f"[Mux] Stream failed: {result}")
+    if not ok:
+        return
+    open_ms = [result["open_ms"] for result in ok]
+    first_audio = [result["first_audio_ms"] for result in ok if result["first_audio_ms"] is not None]
+    print(f"[Mux] {len(ok)}/{args.streams} streams completed")
+    print(f"[Mux] stream open: median {statistics.median(open_ms):.0f} ms, max {max(open_ms):.0f} ms "
+          f"(vs. {connect_ms:.0f} ms per connection)")
+    if first_audio:
+        print(f"[Mux] first audio after open: median {statistics.median(first_audio):.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiplexed WebSocket client (bidi.mux.v1) demo")
+    parser.add_argument("--uri", default="ws://localhost:8080/ws", help="WebSocket URI (default: ws://localhost:8080/ws)")
+    parser.add_argument("--arn", help="Agent Runtime ARN (connect to AgentCore Runtime with SigV4 instead of --uri)")
+    parser.add_argument("--region", default="ap-northeast-1", help="AWS region for --arn (default: ap-northeast-1)")
+    parser.add_argument("--streams", type=int, default=5, help="Concurrent streams on the connection (default: 5)")
+    parser.add_argument("--speech-ms", type=int, default=1500, help="Length of the synthetic utterance (default: 1500)")
+    args = parser.parse_args()
+    asyncio.run(demo(args))
+
+
+if __name__ == "__main__":
+    main()
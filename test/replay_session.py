@@ -0,0 +1,244 @@
+"""
+記録したセッションの再生
+
+recorder.py の形式で記録したセッション(サーバーの BIDI_RECORD_DIR、クライアントの --record)を
+同じタイミング(または --speed 倍速)で再生し、ビルド間のレイテンシや CPU 使用率を
+同じ入力で比較できるようにする。
+
+    # 記録の内容(イベント数・バイト数・ターンごとのレイテンシ)を表示
+    python test/replay_session.py show session.bidirec
+
+    # 上りのメッセージをサーバー(websocket_handler)に送り、記録時と今回の結果を並べて表示
+    BIDI_MODEL=fake uv run test/simple_ws_server.py
+    python test/replay_session.py server session.bidirec --uri ws://localhost:8080/ws --speed 2
+
+    # 今回の送受信も記録して、後で別のビルドの結果と比べる
+    python test/replay_session.py server session.bidirec --record replayed.bidirec
+
+    # サーバーのふりをして、接続してきたクライアントに下りのメッセージを再生する
+    python test/replay_session.py client session.bidirec --port 8080
+    python test/websocket_agent_client.py
+
+レイテンシの定義は telemetry.py と同じ(ユーザーの最終トランスクリプト → 応答開始 / 最初の音声)。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import websockets
+
+# サーバー(cdk/bidiagent)と共通の定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import framing
+from recorder import DOWNLINK, UPLINK, Record, SessionRecorder, read_recording
+
+_DIRECTION_NAMES = {UPLINK: "up", DOWNLINK: "down"}
+
+
+def _message_type(record: Record) -> str:
+    if isinstance(record.message, bytes):
+        kind, *_ = framing.decode_audio_frame(record.message)
+        return {
+            framing.KIND_AUDIO_INPUT: "bidi_audio_input",
+            framing.KIND_AUDIO_STREAM: "bidi_audio_stream",
+            framing.KIND_AUDIO_SILENCE: framing.SILENCE_EVENT_TYPE,
+        }[kind]
+    return json.loads(record.message).get("type", "")
+
+
+def summarize(records: list[Record]) -> dict:
+    """記録をイベント数・バイト数・ターンごとのレイテンシにまとめる"""
+    events = Counter()
+    size = Counter()
+    response_start_ms = []
+    first_audio_ms = []
+    speech_end = None
+    response_seen = audio_seen = False
+
+    for record in records:
+        direction = _DIRECTION_NAMES[record.direction]
+        event_type = _message_type(record)
+        events[f"{direction}:{event_type}"] += 1
+        size[direction] += len(record.message)
+        if record.direction != DOWNLINK:
+            continue
+
+        if event_type == "bidi_transcript_stream":
+            event = json.loads(record.message)
+            if event.get("role") == "user" and event.get("is_final"):
+                speech_end = record.time
+                response_seen = audio_seen = False
+        elif event_type == "bidi_response_start" and speech_end is not None and not response_seen:
+            response_seen = True
+            response_start_ms.append(round((record.time - speech_end) * 1000, 1))
+        elif event_type == "bidi_audio_stream" and speech_end is not None and not audio_seen:
+            audio_seen = True
+            first_audio_ms.append(round((record.time - speech_end) * 1000, 1))
+
+    return {
+        "duration_ms": round(records[-1].time * 1000) if records else 0,
+        "bytes_up": size["up"],
+        "bytes_down": size["down"],
+        "turns": len(response_start_ms),
+        "response_start_ms": response_start_ms,
+        "first_audio_ms": first_audio_ms,
+        "events": dict(sorted(events.items())),
+    }
+
+
+def print_summary(title: str, summary: dict) -> None:
+    print("=" * 60)
+    print(title)
+    print("=" * 60)
+    for key, value in summary.items():
+        if key == "events":
+            for event_type, count in value.items():
+                print(f"{'':>20}  {event_type}: {count}")
+        else:
+            print(f"{key:>20}: {value}")
+
+
+def _to_message(record: Record, binary: bool) -> str | bytes:
+    """記録したメッセージを接続の転送方式に合わせる(JSONの場合は音声を base64 に戻す)"""
+    if isinstance(record.message, bytes) and not binary:
+        return json.dumps(record.event())
+    return record.message
+
+
+async def _play(websocket, records: list[Record], speed: float, binary: bool) -> None:
+    """記録の時刻(÷ speed)に合わせてメッセージを送る"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for record in records:
+        delay = started + record.time / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await websocket.send(_to_message(record, binary))
+
+
+async def replay_to_server(path: str, uri: str, speed: float, tail: float, record_path: str | None) -> None:
+    """上りのメッセージをサーバーに再生し、下りのメッセージを集める"""
+    metadata, records = read_recording(path)
+    uplink = [record for record in records if record.direction == UPLINK]
+    subprotocol = metadata.get("subprotocol")
+    print(f"[Replay] {len(uplink)} uplink messages from {path} ({metadata.get('source')}) → {uri} at {speed}x")
+
+    replayed = []
+    started = time.perf_counter()
+    session_recorder = SessionRecorder(record_path, {"source": "replay", "subprotocol": subprotocol}) if record_path else None
+
+    async with websockets.connect(uri, subprotocols=[subprotocol] if subprotocol else None, max_size=None) as websocket:
+        binary = websocket.subprotocol == framing.SUBPROTOCOL_BINARY
+        if websocket.subprotocol != subprotocol:
+            print(f"[Replay] Server chose subprotocol {websocket.subprotocol} (recorded: {subprotocol})")
+
+        async def receive() -> None:
+            async for message in websocket:
+                if session_recorder:
+                    session_recorder.record(DOWNLINK, message)
+                record = Record(time.perf_counter() - started, DOWNLINK, message)
+                if isinstance(message, str) and '"audio"' in message:
+                    # 記録と同じく音声はバイナリフレームで数える
+                    record = record._replace(message=framing.event_to_frame(json.loads(message)))
+                replayed.append(record)
+
+        async def send() -> None:
+            for record in uplink:
+                delay = record.time / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                message = _to_message(record, binary)
+                await websocket.send(message)
+                if session_recorder:
+                    session_recorder.record(UPLINK, message)
+                replayed.append(Record(time.perf_counter() - started, UPLINK, record.message))
+            # 最後の応答を待つ
+            await asyncio.sleep(tail)
+
+        receive_task = asyncio.create_task(receive())
+        try:
+            await send()
+        finally:
+            receive_task.cancel()
+            try:
+                await receive_task
+            except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+                pass
+            if session_recorder:
+                session_recorder.close()
+
+    replayed.sort(key=lambda record: record.time)
+    print_summary(f"Recorded ({path})", summarize(records))
+    print_summary(f"Replayed ({speed}x)", summarize(replayed))
+
+
+async def replay_to_client(path: str, host: str, port: int, speed: float) -> None:
+    """サーバーのふりをして、接続してきたクライアントに下りのメッセージを再生する"""
+    metadata, records = read_recording(path)
+    downlink = [record for record in records if record.direction == DOWNLINK]
+    subprotocols = [metadata["subprotocol"]] if metadata.get("subprotocol") else list(framing.SUPPORTED_SUBPROTOCOLS)
+
+    async def handler(websocket) -> None:
+        binary = websocket.subprotocol == framing.SUBPROTOCOL_BINARY
+        print(f"[Replay] Client connected (subprotocol: {websocket.subprotocol}), "
+              f"playing {len(downlink)} downlink messages at {speed}x")
+        received = Counter()
+
+        async def drain() -> None:
+            # クライアントからのメッセージは数えるだけ(再生内容は入力に依存しない)
+            async for message in websocket:
+                received["bytes" if isinstance(message, bytes) else "text"] += 1
+
+        drain_task = asyncio.create_task(drain())
+        started = time.perf_counter()
+        try:
+            await _play(websocket, downlink, speed, binary)
+        finally:
+            drain_task.cancel()
+        print(f"[Replay] Done in {time.perf_counter() - started:.1f} s (received from client: {dict(received)})")
+
+    async with websockets.serve(handler, host, port, subprotocols=subprotocols, max_size=None):
+        print(f"[Replay] Waiting for a client on ws://{host}:{port}/ws (Ctrl+C to stop)")
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show and replay recorded bidi sessions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    show = subparsers.add_parser("show", help="Summarize a recording")
+    show.add_argument("recording")
+
+    server = subparsers.add_parser("server", help="Replay the uplink of a recording against a server")
+    server.add_argument("recording")
+    server.add_argument("--uri", default="ws://localhost:8080/ws", help="WebSocket URI (default: ws://localhost:8080/ws)")
+    server.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier (default: 1.0)")
+    server.add_argument("--tail", type=float, default=5.0, help="Seconds to keep receiving after the last message (default: 5)")
+    server.add_argument("--record", metavar="PATH", help="Record the replayed session to this file")
+
+    client = subparsers.add_parser("client", help="Serve the downlink of a recording to a connecting client")
+    client.add_argument("recording")
+    client.add_argument("--host", default="localhost", help="Host to listen on (default: localhost)")
+    client.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    client.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier (default: 1.0)")
+
+    args = parser.parse_args()
+    if args.command == "show":
+        metadata, records = read_recording(args.recording)
+        print(f"[Recording] {metadata}")
+        print_summary(f"Recorded ({args.recording})", summarize(records))
+    elif args.command == "server":
+        asyncio.run(replay_to_server(args.recording, args.uri, args.speed, args.tail, args.record))
+    else:
+        try:
+            asyncio.run(replay_to_client(args.recording, args.host, args.port, args.speed))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
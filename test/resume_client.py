@@ -0,0 +1,326 @@
+"""
+セッションを再開できるクライアント(bidi.resume.v1)
+
+WebSocket が切れたら指数バックオフで再接続し、サーバーが保持しているセッション
+(エージェントと会話の状態)を再開する。プロトコルは cdk/bidiagent/resume.py を参照。
+
+    async def run_connection(websocket, resumed: bool):
+        # 1接続分の処理。resumed=True なら bridge_config 等を送り直さない
+        ...
+
+    await run_with_resume(connect, run_connection)
+
+- connect(subprotocols) は提示するサブプロトコル(再開用のものを含む)で接続する関数。
+  再接続のたびに呼ばれるため、SigV4 の署名はそのたびに作り直せる
+- run_connection に渡す接続は受信したメッセージを数え、bridge_session / bridge_resumed を取り除く
+- 再接続してから最初の音声を受信するまでの時間を表示する(ResumeState.reconnect_ms)
+- 切断中のマイク音声の保持は呼び出し側(agentcore_client.py の AudioRecorder)で行う
+
+デモ(ローカルのフェイクモデルに接続し、応答の途中で接続を切って再開する):
+
+    BIDI_MODEL=fake python cdk/bidiagent/agent.py
+    python test/resume_client.py --drops 3
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable
+
+import websockets
+
+# サーバー(cdk/bidiagent)と共通の定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import framing
+import resume
+from json_codec import default_codec
+
+# 再開しない close code(正常終了・ポリシー違反・サーバーの混雑)
+NON_RESUMABLE_CLOSE_CODES = frozenset((1000, 1008, 1013))
+
+# 再接続を諦めるまでの時間(秒)
+GIVE_UP_S = 60.0
+
+_AUDIO_TEXT_PREFIX = '{"type":"bidi_audio_stream"'
+
+
+class Backoff:
+    """再接続の待ち時間(指数バックオフ + ジッター)
+
+    Args:
+        initial: 最初の待ち時間(秒)
+        maximum: 待ち時間の上限(秒)
+        factor: 1回ごとの倍率
+    """
+
+    def __init__(self, initial: float = 0.2, maximum: float = 5.0, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self) -> float:
+        delay = min(self.initial * self.factor ** self.attempts, self.maximum)
+        self.attempts += 1
+        # 同時に切れたクライアントの再接続が揃わないよう 50〜100% に散らす
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class ResumeState:
+    """1セッションの再開に必要な状態"""
+
+    def __init__(self):
+        self.token: str | None = None
+        self.grace_s = 0.0
+        self.received = 0
+        self.resumes = 0
+        self.replayed = 0
+        self.lost = 0
+        self.disconnected_at: float | None = None
+        self._reconnect_started: float | None = None
+        # 再接続(接続を開始した時点)から最初の音声を受信するまで(ms)
+        self.reconnect_ms: list[float] = []
+
+    def subprotocols(self) -> list[str]:
+        """提示するサブプロトコル(トークンがあればそのセッションの再開)"""
+        return resume.offer_subprotocols(self.token, self.received)
+
+    def reset(self) -> None:
+        """再開できなかった: 新しいセッションとして接続する"""
+        self.token = None
+        self.received = 0
+        self._reconnect_started = None
+
+    def disconnected(self) -> None:
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+
+    def reconnecting(self) -> None:
+        """再接続を開始する"""
+        self._reconnect_started = time.perf_counter()
+
+    def within_grace(self) -> bool:
+        """サーバーがまだセッションを保持しているはずか"""
+        return (self.token is not None and self.disconnected_at is not None
+                and time.perf_counter() - self.disconnected_at < self.grace_s)
+
+    # --- ResumableConnection から呼ばれる --------------------------------------
+
+    def _on_session_event(self, event: dict) -> None:
+        if event["type"] == resume.BRIDGE_SESSION:
+            self.token = event.get("resume_token")
+            self.grace_s = float(event.get("resume_grace_s", 0))
+            self.received = 0
+            print(f"[Resume] Session is resumable (grace {self.grace_s:.0f}s)")
+        else:
+            self.resumes += 1
+            self.replayed += event.get("replayed", 0)
+            self.lost += event.get("lost", 0)
+            self.disconnected_at = None
+            print(f"[Resume] Session resumed (replayed {event.get('replayed', 0)}, lost {event.get('lost', 0)})")
+
+    def _on_message(self, message: str | bytes) -> None:
+        self.received += 1
+        if self._reconnect_started is not None and (
+                isinstance(message, bytes) or message.startswith(_AUDIO_TEXT_PREFIX)):
+            elapsed_ms = (time.perf_counter() - self._reconnect_started) * 1000
+            self._reconnect_started = None
+            self.reconnect_ms.append(elapsed_ms)
+            print(f"[Resume] First audio {elapsed_ms:.0f} ms after reconnect")
+
+
+class ResumableConnection:
+    """websockets の接続をラップし、受信したメッセージを数えて bridge_session / bridge_resumed を取り除く
+
+    recv / async for 以外(send, ping, subprotocol 等)はそのまま元の接続に渡す。
+    """
+
+    def __init__(self, websocket, state: ResumeState):
+        self._websocket = websocket
+        self._state = state
+
+    async def recv(self) -> str | bytes:
+        while True:
+            message = await self._websocket.recv()
+            event = resume.session_event(message)
+            if event is None:
+                self._state._on_message(message)
+                return message
+            self._state._on_session_event(event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str | bytes:
+        try:
+            return await self.recv()
+        except websockets.ConnectionClosedOK:
+            raise StopAsyncIteration
+
+    def __getattr__(self, name):
+        return getattr(self._websocket, name)
+
+
+def close_code(error: websockets.ConnectionClosed) -> int:
+    """切断の close code(close フレームを受信していなければ 1006)"""
+    return error.rcvd.code if error.rcvd is not None else 1006
+
+
+async def run_with_resume(
+    connect: Callable[[list[str]], Awaitable],
+    run_connection: Callable[[ResumableConnection, bool], Awaitable[None]],
+    state: ResumeState | None = None,
+    backoff: Backoff | None = None,
+    give_up_s: float = GIVE_UP_S,
+) -> ResumeState:
+    """接続が切れたら再接続してセッションを再開する
+
+    Args:
+        connect: 提示するサブプロトコルを受け取り、websockets の接続を返す非同期関数
+        run_connection: 1接続分の処理(接続が切れたら websockets.ConnectionClosed を送出する)
+        state: 再開の状態(None なら新しく作る)
+        backoff: 再接続の待ち時間
+        give_up_s: 切断からこの秒数を過ぎても接続できなければ諦める
+
+    Returns:
+        再開の状態(回数・再接続から最初の音声までの時間)
+    """
+    state = state or ResumeState()
+    backoff = backoff or Backoff()
+    while True:
+        try:
+            websocket = await connect(state.subprotocols())
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+            if state.disconnected_at is None or time.perf_counter() - state.disconnected_at > give_up_s:
+                raise
+            delay = backoff.next()
+            print(f"[Resume] Reconnect failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        resumed = state.token is not None
+        try:
+            async with websocket:
+                try:
+                    await run_connection(ResumableConnection(websocket, state), resumed)
+                except asyncio.CancelledError:
+                    # 利用者が終了した(Ctrl+C): close code 1000 で閉じ、サーバーにセッションを保持させない
+                    await websocket.close()
+                    raise
+            return state
+        except websockets.ConnectionClosed as e:
+            code = close_code(e)
+            if code == resume.RESUME_FAILED_CLOSE_CODE:
+                print(f"[Resume] Could not resume ({e.rcvd.reason}). Starting a new session.")
+                state.reset()
+                continue
+            if state.token is None or code in NON_RESUMABLE_CLOSE_CODES:
+                raise
+            state.disconnected()
+
+        if not state.within_grace():
+            print("[Resume] Grace period is over. Starting a new session.")
+            state.reset()
+        backoff.reset()
+        delay = backoff.next()
+        print(f"[Resume] Connection lost, reconnecting in {delay:.1f}s...")
+        await asyncio.sleep(delay)
+        state.reconnecting()
+
+
+# --- デモ ---------------------------------------------------------------------
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+CHUNK_BYTES = 1024
+
+
+async def demo(args) -> None:
+    from load_test import synthetic_speech
+
+    speech = synthetic_speech(args.speech_ms)
+    chunk_seconds = CHUNK_BYTES / (SAMPLE_RATE * CHANNELS * 2)
+    # 切断中もマイクの代わりに音声を溜め、再接続後にまとめて送る
+    mic: asyncio.Queue[bytes] = asyncio.Queue()
+    drops_left = args.drops
+    turns_done = 0
+
+    async def microphone() -> None:
+        silence = bytes(CHUNK_BYTES)
+        while True:
+            for offset in range(0, len(speech), CHUNK_BYTES):
+                mic.put_nowait(speech[offset:offset + CHUNK_BYTES])
+                await asyncio.sleep(chunk_seconds)
+            # 応答が終わるまで無音
+            for _ in range(int(args.pause_ms / 1000 / chunk_seconds)):
+                mic.put_nowait(silence)
+                await asyncio.sleep(chunk_seconds)
+
+    async def connect(subprotocols: list[str]):
+        return await websockets.connect(args.uri, subprotocols=[framing.SUBPROTOCOL_BINARY, *subprotocols])
+
+    async def run_connection(websocket: ResumableConnection, resumed: bool) -> None:
+        nonlocal drops_left, turns_done
+
+        async def send() -> None:
+            while True:
+                pcm = await mic.get()
+                await websocket.send(framing.encode_audio_frame(
+                    framing.KIND_AUDIO_INPUT, pcm, "pcm", SAMPLE_RATE, CHANNELS))
+
+        sender = asyncio.create_task(send())
+        audio_in_response = 0
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    audio_in_response += 1
+                    if drops_left and audio_in_response == 5:
+                        # 応答の途中で回線が止まり、そのまま切れたことにする(close フレームを送らない)。
+                        # 止まっている間にサーバーが送ったメッセージは読まずに捨て、再開時に送り直してもらう
+                        drops_left -= 1
+                        print("[Demo] Dropping the connection mid-response")
+                        await asyncio.sleep(args.stall_ms / 1000)
+                        websocket.transport.abort()
+                        raise websockets.ConnectionClosedError(None, None)
+                    continue
+                event = default_codec.decode(message)
+                if event.get("type") == "bidi_response_complete":
+                    turns_done += 1
+                    audio_in_response = 0
+                    print(f"[Demo] Turn {turns_done} complete")
+                    if turns_done >= args.turns:
+                        return
+        finally:
+            sender.cancel()
+
+    speaker = asyncio.create_task(microphone())
+    try:
+        state = await run_with_resume(connect, run_connection)
+    finally:
+        speaker.cancel()
+    print(f"[Demo] turns={turns_done}, resumes={state.resumes}, replayed={state.replayed}, lost={state.lost}")
+    if state.reconnect_ms:
+        print(f"[Demo] reconnect to first audio: median {statistics.median(state.reconnect_ms):.0f} ms, "
+              f"max {max(state.reconnect_ms):.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable session (bidi.resume.v1) demo")
+    parser.add_argument("--uri", default="ws://localhost:8080/ws", help="WebSocket URI (default: ws://localhost:8080/ws)")
+    parser.add_argument("--drops", type=int, default=3, help="Connections to drop mid-response (default: 3)")
+    parser.add_argument("--stall-ms", type=int, default=300, help="How long the connection stalls before it drops (default: 300)")
+    parser.add_argument("--turns", type=int, default=4, help="Turns to complete (default: 4)")
+    parser.add_argument("--speech-ms", type=int, default=1500, help="Length of the synthetic utterance (default: 1500)")
+    parser.add_argument("--pause-ms", type=int, default=4000, help="Silence after each utterance (default: 4000)")
+    args = parser.parse_args()
+    asyncio.run(demo(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
 """
 WebSocketサーバー(BedrockAgentCoreApp版)
-agent.run(inputs=[websocket.receive_json], outputs=[websocket.send_json])パターンを使用
+agent.run(inputs=[bridge.receive], outputs=[output.put])パターンを使用
+(bridge は cdk/bidiagent/bridge.py の WebSocketBridge。音声のバイナリフレームに対応)
+(output は cdk/bidiagent/output_channel.py の OutputChannel。割り込み時に未送信の音声を捨てる)
+BIDI_MODEL=fake で Bedrock に接続しないフェイクモデルを使う(cdk/bidiagent/fake_model.py)
+BIDI_RECORD_DIR を設定すると送受信メッセージを記録する(cdk/bidiagent/recorder.py)
 """
+import os
+import sys
+import uuid
+
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
 from strands.experimental.bidi import BidiAgent
-from strands.experimental.bidi.models import BidiNovaSonicModel
 from strands.experimental.bidi.tools import stop_conversation
 
 from strands_tools import http_request, calculator
 
+# デプロイ用サーバー(cdk/bidiagent)と共通のブリッジを使用
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import framing
+from bridge import WebSocketBridge
+from models import BIDI_MODEL, create_model
+from output_channel import OutputChannel
+from recorder import SessionRecorder
+
+# セッションの送受信メッセージを記録するディレクトリ(未設定なら記録しない)
+RECORD_DIR = os.environ.get("BIDI_RECORD_DIR")
+
 # BedrockAgentCoreApp を使用
 app = BedrockAgentCoreApp()
 
@@ -21,15 +39,13 @@ async def websocket_handler(websocket: WebSocket, context):
     AgentCore Runtime から /ws に来た WebSocket 接続を受け、
     Strands の BidiAgent(Nova Sonic)にブリッジする。
     """
-    await websocket.accept()
-    print("[Server] WebSocket connected")
+    subprotocol = framing.choose_subprotocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    print(f"[Server] WebSocket connected (subprotocol: {subprotocol or 'none'})")
     print(f"[Server] Context: {context}")
 
-    print("[Server] Creating model...")
-    model = BidiNovaSonicModel(
-        model_id='amazon.nova-2-sonic-v1:0',
-        provider_config={"audio": {"voice": "tiffany"}},
-    )
+    print(f"[Server] Creating model ({BIDI_MODEL})...")
+    model = create_model(voice="tiffany")
     print("[Server] Model created")
 
     print("[Server] Creating agent...")
@@ -40,12 +56,21 @@ async def websocket_handler(websocket: WebSocket, context):
     )
     print("[Server] Agent created")
 
+    recorder = None
+    if RECORD_DIR:
+        recorder = SessionRecorder(
+            os.path.join(RECORD_DIR, f"{uuid.uuid4()}.bidirec"),
+            {"source": "server", "subprotocol": subprotocol},
+        )
+    bridge = WebSocketBridge(websocket, subprotocol, recorder=recorder)
+    output = OutputChannel(bridge.send, on_interrupt=bridge.interrupt)
+
     try:
         print("[Server] Starting agent.run()...")
-        # Strandsドキュメントの推奨パターン
+        # Strandsドキュメントの推奨パターン(I/Oはブリッジ経由)
         await agent.run(
-            inputs=[websocket.receive_json],
-            outputs=[websocket.send_json],
+            inputs=[bridge.receive],
+            outputs=[output.put],
         )
         print("[Server] agent.run() completed")
 
@@ -57,6 +82,9 @@ async def websocket_handler(websocket: WebSocket, context):
         traceback.print_exc()
     finally:
         print("[Server] Cleanup...")
+        await output.close()
+        if recorder:
+            recorder.close()
         try:
             await agent.stop()
         except Exception as e:
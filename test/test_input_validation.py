@@ -0,0 +1,98 @@
+"""
+入力イベントの検証(cdk/bidiagent/input_validation.py)の確認
+
+フェイクモデル(BIDI_MODEL=fake)のサーバー(agent.py)に Starlette の TestClient で接続し、
+大きさの上限を超えるテキストフレームが JSON としてデコードされずに bidi_error で断られ、
+セッションが続くことを、通常の接続と多重化接続(bidi.mux.v1)のストリームで確認する。
+
+    python -m pytest test/test_input_validation.py
+"""
+import json
+import os
+import sys
+
+import pytest
+
+os.environ["BIDI_MODEL"] = "fake"
+# サーバー(cdk/bidiagent)のモジュール
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import agent
+import input_validation
+import mux
+from json_codec import default_codec
+from starlette.testclient import TestClient
+
+# テスト用の上限(バイト)
+MAX_EVENT_BYTES = 4096
+
+
+@pytest.fixture
+def client():
+    with TestClient(agent.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def decoded(monkeypatch) -> list[int]:
+    """上限を下げ、デコードしたテキストの長さを記録する"""
+    monkeypatch.setattr(input_validation, "MAX_EVENT_BYTES", MAX_EVENT_BYTES)
+    sizes = []
+    decode = default_codec.decode
+
+    def recording_decode(text):
+        sizes.append(len(text))
+        return decode(text)
+
+    monkeypatch.setattr(default_codec, "decode", recording_decode)
+    return sizes
+
+
+def oversized_audio() -> dict:
+    return {"type": "bidi_audio_input", "audio": "A" * (MAX_EVENT_BYTES * 2), "format": "pcm",
+            "sample_rate": 16000, "channels": 1}
+
+
+def receive_until(ws, event_type: str, stream: int | None = None) -> dict:
+    while True:
+        message = ws.receive()
+        assert message["type"] == "websocket.send", message
+        if message.get("text") is None:
+            continue
+        event = json.loads(message["text"])
+        if event.get("type") == event_type and (stream is None or event.get("stream") == stream):
+            return event
+
+
+def test_oversized_text_is_rejected_before_decoding(client, decoded):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(json.dumps(oversized_audio()))
+        error = receive_until(ws, "bidi_error")
+        assert error["code"] == "InvalidInput"
+        assert "max 4096" in error["message"]
+        assert max(decoded, default=0) <= MAX_EVENT_BYTES
+
+        # 断った後もセッションは続く
+        ws.send_text(json.dumps({"type": "bidi_text_input", "text": "hello"}))
+        assert receive_until(ws, "bidi_transcript_stream")["text"] == "hello"
+        ws.close(1000)
+
+
+def test_oversized_text_on_mux_stream_is_rejected_before_decoding(client, decoded):
+    with client.websocket_connect("/ws", subprotocols=[mux.SUBPROTOCOL_MUX]) as ws:
+        for stream in (1, 2):
+            ws.send_text(json.dumps({"type": mux.MUX_OPEN, "stream": stream, "binary": False}))
+            receive_until(ws, mux.MUX_OPENED, stream)
+
+        ws.send_text(mux.tag_json(2, json.dumps(oversized_audio())))
+        error = receive_until(ws, "bidi_error", stream=2)
+        assert error["code"] == "InvalidInput"
+        assert "max 4096" in error["message"]
+        assert max(decoded) <= MAX_EVENT_BYTES
+
+        # 断ったストリームも、他のストリームも続く
+        for stream in (2, 1):
+            ws.send_text(mux.tag_json(stream, json.dumps({"type": "bidi_text_input", "text": f"hello {stream}"})))
+            assert receive_until(ws, "bidi_transcript_stream", stream)["text"] == f"hello {stream}"
+        for stream in (1, 2):
+            ws.send_text(json.dumps({"type": mux.MUX_CLOSE, "stream": stream}))
+            receive_until(ws, mux.MUX_CLOSED, stream)
@@ -0,0 +1,203 @@
+"""
+出力キュー(cdk/bidiagent/output_channel.py)の確認
+
+送信(bridge.send の代わり)をゲートで止めてキューを溜め、上限に達したときの policy ごとの動作
+(block は上限時間まで待たせる、drop_oldest は一番古い音声を捨てる、drop_newest は追加しようとした音声を捨てる)と、
+割り込みで溜まった音声だけを捨てること、
+エージェントと同じく1件ずつ順に put しても block の後ろの割り込みが上限時間内に届くことを確認する。音声イベントはフェイクモデル(fake_model.py)が
+出すものと同じ形(16kHz モノラル、32ms)。
+
+    python -m pytest test/test_output_channel.py
+"""
+import asyncio
+import base64
+import os
+import sys
+
+# サーバー(cdk/bidiagent)のモジュール
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+from output_channel import OutputChannel
+
+MAX_EVENTS = 3
+
+# 32ms の無音(16kHz モノラル)
+_CHUNK = base64.b64encode(bytes(1024)).decode("ascii")
+
+
+def audio(index: int) -> dict:
+    return {"type": "bidi_audio_stream", "audio": _CHUNK, "format": "pcm",
+            "sample_rate": 16000, "channels": 1, "index": index}
+
+
+def transcript(text: str) -> dict:
+    return {"type": "bidi_transcript_stream", "text": text, "role": "assistant", "is_final": True}
+
+
+class GatedSender:
+    """gate が開くまで送信を止める send"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.sent: list[dict] = []
+
+    async def send(self, event: dict) -> None:
+        await self.gate.wait()
+        self.sent.append(event)
+
+
+def labels(events: list[dict]) -> list:
+    return [event.get("index", event["type"]) for event in events]
+
+
+async def fill(policy: str, interrupted: list | None = None) -> tuple[OutputChannel, GatedSender]:
+    """1件目を送信中(ゲートで停止)にし、キューを上限(audio 2〜4)まで埋める"""
+    sender = GatedSender()
+    channel = OutputChannel(sender.send, max_events=MAX_EVENTS, policy=policy,
+                            on_interrupt=(lambda: interrupted.append(True)) if interrupted is not None else None)
+    await channel.put(audio(1))
+    # 送信タスクが audio 1 を取り出してゲートで止まるまで進める
+    await asyncio.sleep(0)
+    for index in range(2, 2 + MAX_EVENTS):
+        await channel.put(audio(index))
+    assert channel.depth == MAX_EVENTS
+    return channel, sender
+
+
+async def finish(channel: OutputChannel, sender: GatedSender) -> list:
+    sender.gate.set()
+    await channel.close(drain_timeout=1.0)
+    return labels(sender.sent)
+
+
+def test_block_waits_for_space():
+    async def run():
+        channel, sender = await fill("block")
+        put = asyncio.create_task(channel.put(audio(5)))
+        await asyncio.sleep(0.05)
+        # 送信が止まっている間は put() が戻らない(エージェントへのバックプレッシャー)
+        assert not put.done()
+        sender.gate.set()
+        await asyncio.wait_for(put, 1.0)
+        assert await finish(channel, sender) == [1, 2, 3, 4, 5]
+        assert channel.dropped_events == 0
+        assert channel.max_depth == MAX_EVENTS
+    asyncio.run(run())
+
+
+def test_drop_oldest_discards_oldest_queued_audio():
+    async def run():
+        channel, sender = await fill("drop_oldest")
+        await asyncio.wait_for(channel.put(audio(5)), 0.1)
+        await asyncio.wait_for(channel.put(audio(6)), 0.1)
+        assert await finish(channel, sender) == [1, 4, 5, 6]
+        assert channel.overflow_drops == 2
+        assert channel.dropped_bytes == 2 * 1024
+        assert channel.dropped_ms == 64
+    asyncio.run(run())
+
+
+def test_drop_newest_discards_incoming_audio():
+    async def run():
+        channel, sender = await fill("drop_newest")
+        await asyncio.wait_for(channel.put(audio(5)), 0.1)
+        assert await finish(channel, sender) == [1, 2, 3, 4]
+        assert channel.overflow_drops == 1
+        assert channel.dropped_events == 1
+    asyncio.run(run())
+
+
+def test_non_audio_events_are_never_dropped():
+    for policy in ("block", "drop_oldest", "drop_newest"):
+        async def run():
+            channel, sender = await fill(policy)
+            # 上限を超えても音声以外は待たずに追加する
+            await asyncio.wait_for(channel.put(transcript("done")), 0.1)
+            assert channel.depth == MAX_EVENTS + 1
+            assert await finish(channel, sender) == [1, 2, 3, 4, "bidi_transcript_stream"]
+            assert channel.dropped_events == 0
+        asyncio.run(run())
+
+
+def test_drop_oldest_keeps_queue_of_non_audio_events():
+    async def run():
+        sender = GatedSender()
+        channel = OutputChannel(sender.send, max_events=2, policy="drop_oldest")
+        await channel.put(transcript("a"))
+        await asyncio.sleep(0)
+        await channel.put(transcript("b"))
+        await channel.put(transcript("c"))
+        # 捨てられる音声が無ければ追加する
+        await asyncio.wait_for(channel.put(audio(1)), 0.1)
+        assert await finish(channel, sender) == ["bidi_transcript_stream"] * 3 + [1]
+        assert channel.dropped_events == 0
+    asyncio.run(run())
+
+
+def test_interruption_drops_only_queued_audio():
+    for interruption in ({"type": "bidi_interruption"},
+                         {"type": "bidi_response_complete", "stop_reason": "interrupted"}):
+        async def run():
+            interrupted = []
+            channel, sender = await fill("block", interrupted)
+            await channel.put(transcript("kept"))
+            await channel.put(interruption)
+            assert interrupted == [True]
+            # 送信中だった audio 1 以外の音声は送らない
+            assert await finish(channel, sender) == [1, "bidi_transcript_stream", interruption["type"]]
+            assert channel.interrupt_drops == MAX_EVENTS
+            assert channel.overflow_drops == 0
+        asyncio.run(run())
+
+
+class PacedSender:
+    """音声を実時間(32ms/件)で送る send(bridge.py のペーシングの代わり)"""
+
+    def __init__(self):
+        self.sent: list[dict] = []
+
+    async def send(self, event: dict) -> None:
+        if event["type"] == "bidi_audio_stream":
+            await asyncio.sleep(0.032)
+        self.sent.append(event)
+
+
+def test_interruption_behind_blocked_audio_arrives_within_bound():
+    async def run():
+        sender = PacedSender()
+        channel = OutputChannel(sender.send, max_events=10, policy="block", block_timeout_ms=100)
+        # エージェントの出力(session.py と同じく1件ずつ順に put する)。
+        # 応答の音声(約6秒分)の後に割り込みがあり、次の応答の音声が続く
+        events = [audio(index) for index in range(200)] + [{"type": "bidi_interruption"}]
+        events += [audio(index) for index in range(1000, 1003)]
+        started = asyncio.get_running_loop().time()
+        for event in events:
+            await channel.put(event)
+            if event["type"] == "bidi_interruption":
+                interrupted_after = asyncio.get_running_loop().time() - started
+        # 待つのは上限時間(+ 余裕)まで。待ち続けると送り切るまで(約6秒)割り込みが届かない
+        assert interrupted_after < 1.0
+        assert channel.block_timeouts == 1
+        await channel.close(drain_timeout=1.0)
+        sent = labels(sender.sent)
+        # 割り込みの後に前の応答の音声は送らない
+        assert sent[sent.index("bidi_interruption") + 1:] == [1000, 1001, 1002]
+        assert channel.overflow_drops + channel.interrupt_drops + len(sent) == len(events)
+    asyncio.run(run())
+
+
+def test_sender_failure_reaches_put():
+    async def run():
+        async def failing_send(event: dict) -> None:
+            raise ConnectionResetError("client gone")
+
+        channel = OutputChannel(failing_send, max_events=MAX_EVENTS)
+        await channel.put(audio(1))
+        await asyncio.sleep(0)
+        try:
+            await channel.put(audio(2))
+        except ConnectionResetError:
+            pass
+        else:
+            raise AssertionError("put() should raise the sender's error")
+        await channel.close(drain_timeout=0.1)
+    asyncio.run(run())
@@ -0,0 +1,179 @@
+"""
+セッションの再開(cdk/bidiagent/resumable.py)の確認
+
+フェイクモデル(BIDI_MODEL=fake)のサーバー(agent.py)に Starlette の TestClient で接続し、
+1ターン分の応答を受け取ってから切断(close code 4000)して再開する。
+
+- 再開時に、クライアントが受信済みと申告した件数より後のメッセージだけが同じ順序・内容で送り直される
+- 保持している範囲より前が抜けていれば lost に件数が入る
+- 再開したセッションで会話を続けられる
+- 猶予時間が切れたトークン、終了したセッションのトークン、知らないトークンは close code 4404 で断られる
+
+    python -m pytest test/test_resumable.py
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+import pytest
+
+os.environ["BIDI_MODEL"] = "fake"
+# サーバー(cdk/bidiagent)のモジュール
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import agent
+import resume
+from starlette.testclient import TestClient
+
+SUBPROTOCOLS = ["bidi.json.v1"]
+
+# 切断に使う close code(1000 / 1001 以外なのでセッションは保留される)
+DROP_CLOSE_CODE = 4000
+
+
+@pytest.fixture
+def client():
+    with TestClient(agent.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def sessions():
+    """テストごとに resumable_sessions の設定を戻す"""
+    grace_s, replay_events = agent.resumable_sessions.grace_s, agent.resumable_sessions.replay_events
+    yield agent.resumable_sessions
+    agent.resumable_sessions.grace_s, agent.resumable_sessions.replay_events = grace_s, replay_events
+
+
+def receive_message(ws) -> str | bytes:
+    message = ws.receive()
+    assert message["type"] == "websocket.send", message
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+
+def receive_event(ws) -> dict:
+    return json.loads(receive_message(ws))
+
+
+def connect(client: TestClient, stack: contextlib.ExitStack, subprotocols: list[str]):
+    # TestClient はコンテキストを抜けるとサーバーのハンドラを止めるため、テストの終わりまで開いておく
+    return stack.enter_context(client.websocket_connect("/ws", subprotocols=SUBPROTOCOLS + subprotocols))
+
+
+def start_session(client: TestClient, stack: contextlib.ExitStack) -> tuple[object, str, list]:
+    """再開できるセッションを始め、1ターン分の応答を受け取る(トークンと受信したメッセージを返す)"""
+    ws = connect(client, stack, resume.offer_subprotocols())
+    session = receive_event(ws)
+    assert session["type"] == resume.BRIDGE_SESSION
+    received = take_turn(ws, "hello")
+    return ws, session["resume_token"], received
+
+
+def take_turn(ws, text: str) -> list:
+    """テキストを送り、bidi_response_complete までのメッセージを返す"""
+    ws.send_text(json.dumps({"type": "bidi_text_input", "text": text}))
+    received = []
+    while True:
+        message = receive_message(ws)
+        received.append(message)
+        if isinstance(message, str) and json.loads(message).get("type") == "bidi_response_complete":
+            return received
+
+
+def drop(ws, sessions) -> None:
+    """接続を切り、サーバーがセッションを保留するまで待つ"""
+    ws.close(DROP_CLOSE_CODE)
+    wait_for(lambda: sessions.stats()["parked"] == 1)
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def assert_rejected(ws) -> None:
+    message = ws.receive()
+    assert message["type"] == "websocket.close"
+    assert message["code"] == resume.RESUME_FAILED_CLOSE_CODE
+
+
+def test_replay_after_reconnect(client, sessions):
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        assert len(received) > 5
+        drop(ws, sessions)
+
+        # 最後の5件を受け取れなかったことにする
+        last_seen = len(received) - 5
+        resumed = connect(client, stack, resume.offer_subprotocols(token, last_seen))
+        assert receive_event(resumed) == {"type": resume.BRIDGE_RESUMED, "replayed": 5, "lost": 0}
+        assert [receive_message(resumed) for _ in range(5)] == received[last_seen:]
+
+        # 再開したセッションで会話を続けられる
+        next_turn = [json.loads(message) for message in take_turn(resumed, "again")]
+        transcripts = [event["text"] for event in next_turn
+                       if event.get("type") == "bidi_transcript_stream" and event.get("role") == "user"]
+        assert transcripts == ["again"]
+        assert sessions.counts["resumed"] >= 1
+        resumed.close(1000)
+
+
+def test_replay_when_everything_was_received(client, sessions):
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        drop(ws, sessions)
+        # 送った件数より多く申告されても送り直さない
+        resumed = connect(client, stack, resume.offer_subprotocols(token, len(received) + 10))
+        assert receive_event(resumed) == {"type": resume.BRIDGE_RESUMED, "replayed": 0, "lost": 0}
+        take_turn(resumed, "again")
+        resumed.close(1000)
+
+
+def test_replay_reports_lost_messages(client, sessions):
+    sessions.replay_events = 4
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        drop(ws, sessions)
+        resumed = connect(client, stack, resume.offer_subprotocols(token, 0))
+        assert receive_event(resumed) == {"type": resume.BRIDGE_RESUMED, "replayed": 4,
+                                          "lost": len(received) - 4}
+        assert [receive_message(resumed) for _ in range(4)] == received[-4:]
+        resumed.close(1000)
+
+
+def test_expired_token_is_rejected(client, sessions):
+    sessions.grace_s = 0.2
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        expired = sessions.counts["expired"]
+        drop(ws, sessions)
+        wait_for(lambda: sessions.counts["expired"] == expired + 1)
+        assert_rejected(connect(client, stack, resume.offer_subprotocols(token, len(received))))
+
+
+def test_token_of_finished_session_is_rejected(client, sessions):
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        # 1000 で閉じるとセッションは終了し、トークンは使えなくなる
+        ws.close(1000)
+        wait_for(lambda: sessions.stats()["sessions"] == 0)
+        assert_rejected(connect(client, stack, resume.offer_subprotocols(token, len(received))))
+
+
+def test_token_cannot_be_reused_after_resumed_session_ends(client, sessions):
+    with contextlib.ExitStack() as stack:
+        ws, token, received = start_session(client, stack)
+        drop(ws, sessions)
+        resumed = connect(client, stack, resume.offer_subprotocols(token, len(received)))
+        assert receive_event(resumed)["type"] == resume.BRIDGE_RESUMED
+        resumed.close(1000)
+        wait_for(lambda: sessions.stats()["sessions"] == 0)
+        assert_rejected(connect(client, stack, resume.offer_subprotocols(token, len(received))))
+
+
+def test_unknown_token_is_rejected(client, sessions):
+    with contextlib.ExitStack() as stack:
+        assert_rejected(connect(client, stack, resume.offer_subprotocols("not-a-token", 0)))
@@ -2,15 +2,46 @@ import asyncio
 import websockets
 import json
 import base64
+import os
 import sys
 import threading
-import queue
 
 # =============================================================================
 # ローカルAgentCore RuntimeへのWebSocket接続テストクライアント
 # マイクから音声を取得してWebSocket経由で送信
+#
+#   python test/websocket_agent_client.py          # 音声モード（バイナリフレーム）
+#   python test/websocket_agent_client.py --json   # 音声モード（base64入りJSON）
+#   python test/websocket_agent_client.py --text   # テキストモード
+#
+#   --frame-ms=100 / --frame-ms=auto               # 送信音声をまとめる長さ（autoはRTTに追従）
+#   --vad                                          # 無音区間の音声を送らない（要numpy）
+#   --opus                                         # 音声をOpusで圧縮して送受信する（要opuslib + libopus）
+#   --record=session.bidirec                       # 送受信したメッセージを記録する（test/replay_session.py で再生）
+#   --device-rate=48000 --device-channels=2        # マイク・スピーカーを開く形式（既定はネイティブのレート・モノラル、
+#                                                  # 16kHzモノラルとの変換はクライアントで行う、要numpy）
 # =============================================================================
 
+# サーバー(cdk/bidiagent)と共通のバイナリフレーム定義
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdk", "bidiagent"))
+import codec
+import control
+import framing
+from json_codec import default_codec
+from recorder import DOWNLINK, UPLINK, SessionRecorder
+
+from audio_pipeline import (
+    NUMPY_AVAILABLE,
+    AdaptiveFrameSize,
+    AudioConverter,
+    FrameCoalescer,
+    JitterBuffer,
+    MessageRateMeter,
+    VoiceActivityDetector,
+    adapt_frame_size,
+    device_format,
+)
+
 # PyAudioのインポート（音声入出力用）
 try:
     import pyaudio
@@ -22,84 +53,153 @@ except ImportError:
 
 
 # オーディオ設定（Nova Sonicの要件に合わせる）
+# （モデルとやり取りする形式。デバイスはネイティブの形式で開き、AudioConverter で変換する）
 SAMPLE_RATE = 16000  # 16kHz
 CHANNELS = 1         # モノラル
-CHUNK_SIZE = 512     # フレームサイズ
+CHUNK_SIZE = 512     # フレームサイズ（モデルのレートで。デバイスでは同じ長さ(32ms)になるフレーム数）
 FORMAT = pyaudio.paInt16 if PYAUDIO_AVAILABLE else None  # 16bit PCM
 
 
 class AudioPlayer:
-    """受信した音声データを再生するクラス"""
+    """受信した音声データを再生するクラス（コールバック方式・ジッタバッファ付き）
+
+    受信した音声はリングバッファ(JitterBuffer)に書き込むだけで即座に戻り、
+    PyAudio のコールバックスレッドが必要な分だけ取り出して再生する。
+    割り込み時にはバッファを O(1) で破棄して即座に再生を停止できる。
+
+    出力デバイスは device_rate / device_channels（None ならネイティブのレート）で開き、
+    受信した音声はその形式に変換してからバッファに書き込む（受信した形式が変わったら変換も作り直す）。
+    """
 
-    def __init__(self):
+    def __init__(self, device_rate: int | None = None, device_channels: int = 1):
         if not PYAUDIO_AVAILABLE:
             return
 
         self.pa = pyaudio.PyAudio()
+        self._sample_rate, self._channels = device_format(self.pa, True, SAMPLE_RATE, device_rate, device_channels)
+        self._frame_bytes = self._channels * self.pa.get_sample_size(FORMAT)
+        self.buffer = JitterBuffer(self._sample_rate, self._channels, self.pa.get_sample_size(FORMAT))
+        self.converter = AudioConverter(SAMPLE_RATE, CHANNELS, self._sample_rate, self._channels)
+        self.stream = None
+        self._running = True
+        print(f"[AudioPlayer] Initialized with sample_rate={self._sample_rate}, channels={self._channels}")
+
+    def start(self):
+        """コールバック方式で再生ストリームを開始"""
+        if not PYAUDIO_AVAILABLE:
+            return
         self.stream = self.pa.open(
             format=FORMAT,
-            channels=CHANNELS,
-            rate=SAMPLE_RATE,
+            channels=self._channels,
+            rate=self._sample_rate,
             output=True,
-            frames_per_buffer=CHUNK_SIZE
+            frames_per_buffer=CHUNK_SIZE * self._sample_rate // SAMPLE_RATE,  # 小さめのバッファで遅延を減らす
+            stream_callback=self._playback_callback
         )
-        self._running = True
+        self.stream.start_stream()
+        print("[AudioPlayer] Playback stream started")
 
-    def play(self, audio_bytes: bytes):
-        """音声データを再生"""
+    def _playback_callback(self, in_data, frame_count, time_info, status):
+        """PyAudioのコールバック（別スレッドで実行）: バッファから1回分を取り出す"""
+        return (self.buffer.read(frame_count * self._frame_bytes), pyaudio.paContinue)
+
+    @property
+    def latency_ms(self) -> float:
+        """今受け取った音声が再生されるまでの時間(ms): バッファ + 出力デバイスの遅延"""
+        if not PYAUDIO_AVAILABLE:
+            return 0.0
+        device_ms = self.stream.get_output_latency() * 1000 if self.stream else 0.0
+        return self.buffer.buffered_ms + device_ms
+
+    def stats(self) -> dict:
+        """ジッタバッファの状態（遅延・目標深さ・アンダーラン/オーバーラン回数）"""
+        if not PYAUDIO_AVAILABLE:
+            return {}
+        return {"latency_ms": round(self.latency_ms), **self.buffer.stats()}
+
+    def play(self, audio_bytes: bytes, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS):
+        """音声データを出力デバイスの形式に変換してバッファに追加（ノンブロッキング）"""
         if not PYAUDIO_AVAILABLE or not self._running:
             return
-        try:
-            self.stream.write(audio_bytes)
-        except Exception as e:
-            print(f"[AudioPlayer] Error: {e}")
+        if sample_rate != self.converter.in_rate or channels != self.converter.in_channels:
+            self.converter = AudioConverter(sample_rate, channels, self._sample_rate, self._channels)
+        self.buffer.write(self.converter.convert(audio_bytes))
+
+    def clear(self):
+        """割り込み時に未再生の音声を破棄して再生を即座に停止"""
+        if not PYAUDIO_AVAILABLE:
+            return
+        self.converter.reset()
+        cleared_ms = self.buffer.clear()
+        if cleared_ms > 0:
+            print(f"[AudioPlayer] Cleared {cleared_ms:.0f} ms of audio (interrupted)")
 
     def stop(self):
         """再生を停止"""
         self._running = False
         if PYAUDIO_AVAILABLE:
+            print(f"[AudioPlayer] Stats: {self.stats()}")
             try:
-                self.stream.stop_stream()
-                self.stream.close()
+                if self.stream:
+                    self.stream.stop_stream()
+                    self.stream.close()
                 self.pa.terminate()
             except Exception:
                 pass
+        print("[AudioPlayer] Stopped")
 
 
 class AudioRecorder:
-    """マイクから音声を録音するクラス"""
+    """マイクから音声を録音するクラス
 
-    def __init__(self):
+    入力デバイスは device_rate / device_channels（None ならネイティブのレート）で開き、
+    コールバックスレッドでモデルの形式（SAMPLE_RATE のモノラル）に変換してからキューに入れる。
+    """
+
+    def __init__(self, device_rate: int | None = None, device_channels: int = 1):
         if not PYAUDIO_AVAILABLE:
             return
 
         self.pa = pyaudio.PyAudio()
-        self.audio_queue = queue.Queue()
+        self._sample_rate, self._channels = device_format(self.pa, False, SAMPLE_RATE, device_rate, device_channels)
+        self.converter = AudioConverter(self._sample_rate, self._channels, SAMPLE_RATE, CHANNELS)
+        self.audio_queue: asyncio.Queue | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
         self._running = False
         self._stream = None
 
     def _audio_callback(self, in_data, frame_count, time_info, status):
-        """PyAudioのコールバック（別スレッドで実行）"""
+        """PyAudioのコールバック（別スレッドで実行）
+
+        イベントループのキューへ call_soon_threadsafe で渡し、
+        送信側を音声の到着と同時に起こす。
+        """
         if self._running:
-            self.audio_queue.put(in_data)
+            try:
+                self._loop.call_soon_threadsafe(self.audio_queue.put_nowait, self.converter.convert(in_data))
+            except RuntimeError:
+                # 停止処理中にイベントループが閉じられた
+                pass
         return (None, pyaudio.paContinue)
 
     def start(self):
-        """録音を開始"""
+        """録音を開始（イベントループ上で呼ぶ）"""
         if not PYAUDIO_AVAILABLE:
             return
 
+        self._loop = asyncio.get_running_loop()
+        self.audio_queue = asyncio.Queue()
         self._running = True
         self._stream = self.pa.open(
             format=FORMAT,
-            channels=CHANNELS,
-            rate=SAMPLE_RATE,
+            channels=self._channels,
+            rate=self._sample_rate,
             input=True,
-            frames_per_buffer=CHUNK_SIZE,
+            frames_per_buffer=CHUNK_SIZE * self._sample_rate // SAMPLE_RATE,
             stream_callback=self._audio_callback
         )
         self._stream.start_stream()
-        print("[AudioRecorder] Started recording")
+        print(f"[AudioRecorder] Started recording ({self.converter})")
 
     def stop(self):
         """録音を停止"""
@@ -117,16 +217,28 @@ class AudioRecorder:
                 pass
         print("[AudioRecorder] Stopped recording")
 
-    def get_audio_chunk(self) -> bytes | None:
-        """キューから音声チャンクを取得（ノンブロッキング）"""
-        try:
-            return self.audio_queue.get_nowait()
-        except queue.Empty:
-            return None
-
-
-async def audio_session():
-    """マイク入力を使った音声対話セッション"""
+    async def get_audio_chunks(self) -> list[bytes]:
+        """音声チャンクが届くまで待ち、キューに溜まっている分をまとめて取得"""
+        chunks = [await self.audio_queue.get()]
+        while not self.audio_queue.empty():
+            chunks.append(self.audio_queue.get_nowait())
+        return chunks
+
+
+async def audio_session(transport: str = "binary", frame_ms: str = "0", vad: bool = False,
+                        audio_codec: str = "pcm", record: str | None = None,
+                        device_rate: int | None = None, device_channels: int = 1):
+    """マイク入力を使った音声対話セッション
+
+    transport="binary" の場合はサブプロトコルでバイナリフレームを提示し、
+    サーバーが対応していなければJSONにフォールバックする。
+    frame_ms は送信音声を何msずつまとめるか（"0" でまとめない、"auto" でRTTに合わせる）。
+    vad=True の場合は無音区間の音声を送らず、無音マーカーで長さだけを送る。
+    audio_codec="opus" の場合は、サーバーが対応していれば音声をOpusで圧縮して送受信する。
+    record を指定すると、送受信したメッセージをそのファイルに記録する（test/replay_session.py で再生できる）。
+    マイク・スピーカーは device_rate / device_channels（None ならネイティブのレート）で開き、
+    モデルの形式（16kHz モノラル）との変換はクライアントで行う（audio_pipeline.AudioConverter）。
+    """
     if not PYAUDIO_AVAILABLE:
         print("[Error] PyAudio is required for audio session.")
         print("Install with: pip install pyaudio")
@@ -142,19 +254,60 @@ async def audio_session():
     print("Press Ctrl+C to disconnect.")
     print("=" * 60)
 
-    recorder = AudioRecorder()
-    player = AudioPlayer()
+    recorder = AudioRecorder(device_rate, device_channels)
+    player = AudioPlayer(device_rate, device_channels)
+    session_recorder = None
 
     try:
-        async with websockets.connect(uri) as websocket:
-            print("[Connected] WebSocket connection established\n")
-
-            # 録音を開始
+        # JSONの場合も bidi.json.v1 を提示し、無音マーカー等に対応したサーバーか判別する
+        subprotocols = list(framing.SUPPORTED_SUBPROTOCOLS) if transport == "binary" else [framing.SUBPROTOCOL_JSON]
+        async with websockets.connect(uri, subprotocols=subprotocols) as websocket:
+            binary = websocket.subprotocol == framing.SUBPROTOCOL_BINARY
+            print(f"[Connected] WebSocket connection established (transport: {'binary' if binary else 'json'})\n")
+
+            if record:
+                session_recorder = SessionRecorder(record, {"source": "client", "subprotocol": websocket.subprotocol})
+
+            # 音声コーデックのネゴシエーション（対応サーバーのみ）
+            audio_format = "pcm"
+            if audio_codec == "opus" and not codec.OPUS_AVAILABLE:
+                print("[Codec] opuslib (libopus) not installed. Using pcm.")
+            elif audio_codec == "opus" and websocket.subprotocol is None:
+                print("[Codec] Server does not support codec negotiation. Using pcm.")
+            elif audio_codec == "opus":
+                ack = await control.negotiate(websocket, audio_format="opus")
+                audio_format = ack.get("audio_format", "pcm")
+                if session_recorder:
+                    session_recorder.record(UPLINK, control.config_event(audio_format="opus"))
+                    session_recorder.record(DOWNLINK, ack)
+                print(f"[Codec] audio_format={audio_format}")
+            encoder = codec.OpusEncoder(SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+            decoder = codec.OpusDecoder(SAMPLE_RATE, CHANNELS) if audio_format == "opus" else None
+
+            # 録音と再生を開始
             recorder.start()
+            player.start()
+
+            # 送信音声のまとめ方（frame_ms="auto" ならRTTに合わせて調整）
+            adaptive = AdaptiveFrameSize() if frame_ms == "auto" else None
+            coalescer = FrameCoalescer(
+                adaptive.frame_ms if adaptive else float(frame_ms), SAMPLE_RATE, CHANNELS
+            )
+            rtt_task = asyncio.create_task(adapt_frame_size(websocket, coalescer, adaptive)) if adaptive else None
+
+            # VAD（無音マーカーを解釈できるサーバーの場合のみ）
+            detector = None
+            if vad and not NUMPY_AVAILABLE:
+                print("[VAD] NumPy not installed. VAD disabled.")
+            elif vad and websocket.subprotocol is None:
+                print("[VAD] Server does not support silence markers. VAD disabled.")
+            elif vad:
+                detector = VoiceActivityDetector(SAMPLE_RATE, CHANNELS)
 
             # 送信タスクと受信タスクを並行実行
-            send_task = asyncio.create_task(send_audio(websocket, recorder))
-            receive_task = asyncio.create_task(receive_messages(websocket, player))
+            send_task = asyncio.create_task(send_audio(websocket, recorder, binary, coalescer, detector, encoder,
+                                                   session_recorder))
+            receive_task = asyncio.create_task(receive_messages(websocket, player, decoder, session_recorder))
 
             # どちらかが終了するまで待機
             done, pending = await asyncio.wait(
@@ -163,6 +316,8 @@ async def audio_session():
             )
 
             # 残りのタスクをキャンセル
+            if rtt_task:
+                pending.add(rtt_task)
             for task in pending:
                 task.cancel()
                 try:
@@ -181,39 +336,106 @@ async def audio_session():
     finally:
         recorder.stop()
         player.stop()
+        if session_recorder:
+            session_recorder.close()
         print("[Disconnected]")
 
 
-async def send_audio(websocket, recorder: AudioRecorder):
-    """マイクからの音声をWebSocketに送信"""
+async def send_audio(websocket, recorder: AudioRecorder, binary: bool = False,
+                     coalescer: FrameCoalescer | None = None,
+                     vad: VoiceActivityDetector | None = None,
+                     encoder: codec.OpusEncoder | None = None,
+                     session_recorder: SessionRecorder | None = None):
+    """マイクからの音声をWebSocketに送信
+
+    音声が届くまで待機し、届いたらキューに溜まっている分をすべて送信する。
+    coalescer を渡すと、目標フレーム長までまとめてから1メッセージとして送る。
+    vad を渡すと、無音区間の音声は送らず、長さだけを無音マーカーで送る。
+    encoder を渡すと、Opus で圧縮して送る。
+    session_recorder を渡すと、送信したメッセージを記録する。
+    """
+    if coalescer is None:
+        coalescer = FrameCoalescer(0, SAMPLE_RATE, CHANNELS)
+    meter = MessageRateMeter()
+
+    async def send_payload(payload: bytes, audio_format: str):
+        if binary:
+            # ヘッダ + 音声データのバイナリフレームで送信
+            message = framing.encode_audio_frame(
+                framing.KIND_AUDIO_INPUT, payload, audio_format, SAMPLE_RATE, CHANNELS
+            )
+        else:
+            # BidiAudioInputEvent形式で送信（固定部分はテンプレートを使う）
+            # Strandsドキュメントに従い、format, sample_rate, channelsを含める
+            message = default_codec.encode_audio(
+                "bidi_audio_input", base64.b64encode(payload).decode("ascii"), audio_format, SAMPLE_RATE, CHANNELS
+            )
+        await websocket.send(message)
+        meter.record(len(message))
+        if session_recorder:
+            session_recorder.record(UPLINK, message)
+
+    async def send_frame(frame: bytes):
+        if encoder:
+            # Opusで圧縮（1パケットに満たない端数は次回に持ち越す）
+            payload = encoder.encode(frame)
+            if payload:
+                await send_payload(payload, "opus")
+        else:
+            await send_payload(frame, "pcm")
+
+    async def send_silence(frames: int):
+        # 無音区間の長さだけを送る（サーバーがゼロPCMに展開する）
+        if binary:
+            message = framing.encode_silence_frame(frames, SAMPLE_RATE, CHANNELS)
+        else:
+            message = default_codec.encode(framing.silence_event(frames, SAMPLE_RATE, CHANNELS))
+        await websocket.send(message)
+        meter.record(len(message))
+        if session_recorder:
+            session_recorder.record(UPLINK, message)
+
     try:
         while True:
-            # 音声チャンクを取得
-            audio_chunk = recorder.get_audio_chunk()
-
-            if audio_chunk:
-                # BidiAudioInputEvent形式で送信
-                # Strandsドキュメントに従い、format, sample_rate, channelsを含める
-                message = {
-                    "type": "bidi_audio_input",
-                    "audio": base64.b64encode(audio_chunk).decode("utf-8"),
-                    "format": "pcm",
-                    "sample_rate": SAMPLE_RATE,
-                    "channels": CHANNELS
-                }
-                await websocket.send(json.dumps(message))
-
-            # 少し待機（CPU負荷軽減）
-            await asyncio.sleep(0.01)
+            # 音声チャンクを取得（届くまで待機）
+            for audio_chunk in await recorder.get_audio_chunks():
+                # VADで無音区間を間引く（無効ならそのまま送る）
+                for item in vad.process(audio_chunk) if vad else (audio_chunk,):
+                    if isinstance(item, int):
+                        # 時間順を保つため、まとめ中の音声を先に送ってからマーカーを送る
+                        frame = coalescer.flush()
+                        if frame is not None:
+                            await send_frame(frame)
+                        if encoder:
+                            payload = encoder.flush()
+                            if payload:
+                                await send_payload(payload, "opus")
+                        await send_silence(item)
+                        continue
+
+                    frame = coalescer.push(item)
+                    if frame is not None:
+                        await send_frame(frame)
+
+            # 実効メッセージレートを定期的に表示
+            rate = meter.report()
+            if rate:
+                print(f"[Uplink] {rate[0]:.1f} msg/s, {rate[1]:.1f} KB/s (frame: {coalescer.frame_ms:.0f} ms)")
 
     except asyncio.CancelledError:
         pass
     except Exception as e:
         print(f"[Send Error] {e}")
         raise
+    finally:
+        msg_per_sec, kb_per_sec = meter.summary()
+        print(f"[Uplink] total {meter.messages} messages ({msg_per_sec:.1f} msg/s, {kb_per_sec:.1f} KB/s)")
+        if vad:
+            print(f"[VAD] {vad.stats()}")
 
 
-async def receive_messages(websocket, player: AudioPlayer):
+async def receive_messages(websocket, player: AudioPlayer, decoder: codec.OpusDecoder | None = None,
+                           session_recorder: SessionRecorder | None = None):
     """WebSocketからメッセージを受信して処理
 
     Strandsの出力イベント形式に対応:
@@ -222,24 +444,51 @@ async def receive_messages(websocket, player: AudioPlayer):
     - bidi_connection_start: 接続開始
     - bidi_response_start/complete: レスポンス開始/終了
     - bidi_error: エラー
+
+    バイナリフレーム(音声)とJSONテキストフレーム(その他)の両方を受け付ける。
+    Opus の音声は decoder で PCM に戻してから再生する（再生側で出力デバイスの形式に変換する）。
+    session_recorder を渡すと、受信したメッセージを記録する。
     """
+    # 受信した音声の形式（変わったときに表示する）
+    shown_format = None
     try:
         async for message in websocket:
+            if session_recorder:
+                session_recorder.record(DOWNLINK, message)
+            if isinstance(message, bytes):
+                # バイナリフレーム (bidi_audio_stream)
+                try:
+                    _, audio_format, sample_rate, channels, audio_bytes = framing.decode_audio_frame(message)
+                except framing.FrameError as e:
+                    print(f"[Receive] Invalid frame: {e}")
+                    continue
+                if (audio_format, sample_rate, channels) != shown_format:
+                    shown_format = (audio_format, sample_rate, channels)
+                    print(f"[Audio Format] format={audio_format}, sample_rate={sample_rate}, channels={channels} (binary)")
+                if audio_format == "opus":
+                    audio_bytes = decoder.decode(audio_bytes)
+                player.play(audio_bytes, sample_rate, channels)
+                continue
+
             try:
-                data = json.loads(message)
+                data = default_codec.decode(message)
                 msg_type = data.get("type", "")
 
                 # 音声ストリーム (Strands BidiAudioStreamEvent)
                 if msg_type == "bidi_audio_stream":
                     audio_data = data.get("audio", "")
-                    # 音声形式情報を表示（初回のみ）
-                    if not hasattr(receive_messages, '_audio_format_shown'):
-                        receive_messages._audio_format_shown = True
-                        print(f"[Audio Format] format={data.get('format')}, sample_rate={data.get('sample_rate')}, channels={data.get('channels')}")
+                    # 音声形式情報を表示（変わったときのみ）
+                    sample_rate = data.get("sample_rate", SAMPLE_RATE)
+                    channels = data.get("channels", CHANNELS)
+                    if (data.get("format"), sample_rate, channels) != shown_format:
+                        shown_format = (data.get("format"), sample_rate, channels)
+                        print(f"[Audio Format] format={data.get('format')}, sample_rate={sample_rate}, channels={channels}")
                     if audio_data:
                         audio_bytes = base64.b64decode(audio_data)
+                        if data.get("format") == "opus":
+                            audio_bytes = decoder.decode(audio_bytes)
                         # print(f"[Audio] Received {len(audio_bytes)} bytes")  # デバッグ
-                        player.play(audio_bytes)
+                        player.play(audio_bytes, sample_rate, channels)
 
                 # 旧形式互換
                 elif msg_type == "audio":
@@ -280,6 +529,10 @@ async def receive_messages(websocket, player: AudioPlayer):
                     reason = data.get("stop_reason", "")
                     if reason == "interrupted":
                         print("[Agent] (interrupted)")
+                        # 割り込み時は未再生の音声データをクリアして即座に停止
+                        player.clear()
+                    else:
+                        print(f"[AudioPlayer] {player.stats()}")
 
                 # エラー (Strands BidiErrorEvent)
                 elif msg_type == "bidi_error":
@@ -395,4 +648,9 @@ if __name__ == "__main__":
         asyncio.run(text_session())
     else:
         # 音声モード（デフォルト）
-        asyncio.run(audio_session())
+        frame_ms = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--frame-ms=")), "0")
+        record = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--record=")), None)
+        device_rate = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--device-rate=")), None)
+        device_channels = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--device-channels=")), 1)
+        asyncio.run(audio_session("json" if "--json" in sys.argv else "binary", frame_ms, "--vad" in sys.argv,
+                                  "opus" if "--opus" in sys.argv else "pcm", record, device_rate, device_channels))